@@ -0,0 +1,165 @@
+# coding:utf-8
+"""
+基于asyncio的即梦接口客户端
+
+VisualService 的调用都是同步阻塞的，每个并发任务都要占用一个线程。这里直接
+用与SDK相同的AK/SK签名（SignerV4）构造 CVSync2AsyncSubmitTask /
+CVSync2AsyncGetResult 请求，通过共享连接池的 aiohttp 会话发出，上千个任务
+同时等待出图也只需要一个事件循环线程。需要安装 aiohttp（可选依赖）。
+"""
+import json
+import time
+import random
+import asyncio
+
+from volcengine import VERSION
+from volcengine.Credentials import Credentials
+from volcengine.auth.SignerV4 import SignerV4
+from volcengine.base.Request import Request
+
+from generation_engine import (DEFAULT_REQ_KEY, DEFAULT_SEED, MAX_THROTTLE_BACKOFF,
+                               build_submit_form, build_result_form)
+from rate_limiter import ThrottledError, is_throttled
+from task_poller import TaskPollError, TaskTimeoutError, DEFAULT_EXPECTED, DEFAULT_INTERVAL
+
+# aiohttp 可选：没有安装时无法使用异步客户端
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+VISUAL_HOST = "visual.volcengineapi.com"
+VISUAL_SERVICE = "cv"
+VISUAL_REGION = "cn-north-1"
+API_VERSION = "2022-08-31"
+ACTION_SUBMIT = "CVSync2AsyncSubmitTask"
+ACTION_GET_RESULT = "CVSync2AsyncGetResult"
+
+# 等待出图的默认超时（秒）
+DEFAULT_TIMEOUT = 100.0
+# 连续被限流多少次后放弃
+MAX_THROTTLE_RETRIES = 8
+
+
+class AsyncVisualClient:
+    """异步的提交/查询客户端，一个实例可被同一事件循环中的所有任务共用"""
+
+    def __init__(self, ak, sk, host=VISUAL_HOST, scheme="https", max_connections=100,
+                 timeout=30, region=VISUAL_REGION, service=VISUAL_SERVICE):
+        self.host = host
+        self.scheme = scheme
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.credentials = Credentials(ak, sk, service, region)
+        self._session = None
+
+    async def open(self):
+        """创建连接池；在事件循环中调用"""
+        if aiohttp is None:
+            raise RuntimeError("异步客户端需要安装 aiohttp: pip install aiohttp")
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def close(self):
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def sign_request(self, action, form):
+        """构造并签名请求，返回 (url, headers, body)；与SDK的 json 调用方式一致"""
+        r = Request()
+        r.set_schema(self.scheme)
+        r.set_method("POST")
+        r.set_host(self.host)
+        r.set_path("/")
+        r.set_headers({
+            "Host": self.host,
+            "Content-Type": "application/json",
+            "User-Agent": "volc-sdk-python/" + VERSION
+        })
+        r.set_query({"Action": action, "Version": API_VERSION})
+        r.set_body(json.dumps(form))
+        # 签名中带有当前时间，必须在每次发送前重新计算
+        SignerV4.sign(r, self.credentials)
+        return r.build(), r.headers, r.body
+
+    async def call(self, action, form):
+        """发送一次请求并返回解析后的JSON；被限流时抛出ThrottledError"""
+        if self._session is None:
+            await self.open()
+        url, headers, body = self.sign_request(action, form)
+        async with self._session.post(url, headers=headers, data=body) as response:
+            text = await response.text()
+            status = response.status
+
+        if status == 200:
+            return json.loads(text)
+        try:
+            resp = json.loads(text)
+        except ValueError:
+            resp = None
+        if is_throttled(resp):
+            raise ThrottledError(text)
+        raise Exception(text)
+
+    async def submit_task(self, form):
+        """对应 cv_sync2async_submit_task"""
+        return await self.call(ACTION_SUBMIT, form)
+
+    async def get_result(self, form):
+        """对应 cv_sync2async_get_result"""
+        return await self.call(ACTION_GET_RESULT, form)
+
+    async def _call_with_backoff(self, action, form):
+        """被限流时按带随机抖动的指数退避重试"""
+        attempt = 0
+        while True:
+            try:
+                resp = await self.call(action, form)
+                if not is_throttled(resp):
+                    return resp
+            except ThrottledError:
+                pass
+            attempt += 1
+            if attempt > MAX_THROTTLE_RETRIES:
+                raise ThrottledError(f"{action} 连续{MAX_THROTTLE_RETRIES}次被限流")
+            await asyncio.sleep(random.uniform(0, min(MAX_THROTTLE_BACKOFF, 2 ** attempt)))
+
+    async def generate(self, prompt, width, height, seed=DEFAULT_SEED, req_key=DEFAULT_REQ_KEY,
+                       first_poll=DEFAULT_EXPECTED, poll_interval=DEFAULT_INTERVAL,
+                       timeout=DEFAULT_TIMEOUT):
+        """提交任务并等待出图，返回 (task_id, 图片URL列表)"""
+        submit_resp = await self._call_with_backoff(
+            ACTION_SUBMIT, build_submit_form(prompt, width, height, seed=seed, req_key=req_key))
+        if submit_resp.get("code") != 10000:
+            raise TaskPollError(f"提交任务失败: {json.dumps(submit_resp, ensure_ascii=False)}")
+        task_id = (submit_resp.get("data") or {}).get("task_id")
+        if not task_id:
+            raise TaskPollError("获取任务ID失败")
+
+        deadline = time.monotonic() + timeout
+        result_form = build_result_form(task_id, req_key)
+        delay = first_poll
+        while True:
+            if time.monotonic() + delay > deadline:
+                raise TaskTimeoutError(f"任务 {task_id} 处理超时")
+            await asyncio.sleep(delay)
+            delay = poll_interval
+
+            result_resp = await self._call_with_backoff(ACTION_GET_RESULT, result_form)
+            if result_resp.get("code") != 10000:
+                raise TaskPollError(f"查询结果失败: {json.dumps(result_resp, ensure_ascii=False)}")
+            status = result_resp["data"].get("status", "")
+            if status == "done":
+                return task_id, result_resp["data"].get("image_urls") or []
+            if status == "failed":
+                raise TaskPollError(f"任务 {task_id} 处理失败")
@@ -0,0 +1,286 @@
+# coding:utf-8
+"""
+命令行批量生成图片（无需图形界面）
+
+清单格式:
+    JSONL: 每行一个JSON对象，例如 {"id": "a1", "prompt": "...", "ratio": "16:9", "seed": 42}
+    CSV:   表头包含 prompt，可选 id / ratio / width / height / seed / req_key
+
+使用示例:
+    python batch_generate.py prompts.jsonl -o results.jsonl -c 8
+    python batch_generate.py --sweep sweep.json --contact-sheet   （提示词矩阵，见 prompt_sweep.py）
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import itertools
+
+from generation_engine import GenerationEngine, load_manifest, write_results_manifest
+from image_postprocess import PostProcessConfig, ImagePostProcessor
+from generation_trace import Tracer, MetricsServer
+from result_cache import ResultCache
+from rate_limiter import ServiceLimiter
+from credential_pool import Account, CredentialPool
+from prompt_sweep import SweepSpec, write_sweep_index
+from task_journal import TaskJournal
+from output_store import OutputStore
+from config_store import apply_profile
+
+
+def decode_secret(encoded_text):
+    """解码配置文件中以Base64保存的密钥"""
+    if not encoded_text:
+        return ""
+    try:
+        return base64.b64decode(encoded_text.encode('utf-8')).decode('utf-8')
+    except Exception:
+        return encoded_text
+
+
+def load_config(config_file):
+    """读取图形界面保存的配置文件，不存在时返回空配置"""
+    if not os.path.exists(config_file):
+        return {}
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"加载配置失败: {e}")
+        return {}
+
+
+def load_accounts(entries, encoded):
+    """由账号列表构造Account；encoded 为True时密钥以Base64保存（与配置文件一致）"""
+    accounts = []
+    for index, entry in enumerate(entries, 1):
+        ak = entry.get("ak", "")
+        sk = entry.get("sk", "")
+        if encoded:
+            ak, sk = decode_secret(ak), decode_secret(sk)
+        if not ak.strip() or not sk.strip():
+            raise ValueError(f"第{index}个账号缺少ak或sk")
+        accounts.append((entry.get("name"), ak.strip(), sk.strip(), entry.get("max_concurrency")))
+    return accounts
+
+
+def resolve_accounts(args, config):
+    """按命令行参数、环境变量和配置文件确定账号列表 [(name, ak, sk, max_concurrency), ...]
+
+    多账号：--accounts 文件（明文）优先；命令行没有指定密钥时使用配置文件中的 accounts（Base64）。
+    读取失败或没有可用密钥时抛出ValueError。
+    """
+    try:
+        if args.accounts:
+            with open(args.accounts, 'r', encoding='utf-8') as f:
+                account_list = load_accounts(json.load(f), encoded=False)
+        elif not (args.ak and args.sk):
+            account_list = load_accounts(config.get("accounts") or [], encoded=True)
+        else:
+            account_list = []
+    except (OSError, ValueError) as e:
+        raise ValueError(f"读取账号列表失败: {e}")
+    if account_list:
+        return account_list
+
+    ak = args.ak or os.environ.get("VOLC_ACCESSKEY") or decode_secret(config.get("ak", ""))
+    sk = args.sk or os.environ.get("VOLC_SECRETKEY") or decode_secret(config.get("sk", ""))
+    if not ak or not sk:
+        raise ValueError("请提供Access Key和Secret Key")
+    return [(None, ak.strip(), sk.strip(), None)]
+
+
+def build_pool(account_list, submit_qps, poll_qps, concurrency):
+    """每个账号有独立的限流器和并发名额，返回 (账号池, 总在途任务数)"""
+    pool = CredentialPool([
+        Account(name, ak, sk, limiter=ServiceLimiter(
+            submit_qps=submit_qps, poll_qps=poll_qps,
+            max_concurrency=max_concurrency or concurrency))
+        for name, ak, sk, max_concurrency in account_list])
+    return pool, sum(account.limiter.concurrency.max_limit for account in pool.accounts)
+
+
+def with_timeout(tasks, timeout):
+    """给没有指定期限的任务设置默认期限（逐个处理，不展开整个清单）"""
+    for task in tasks:
+        if not task.timeout:
+            task.timeout = timeout
+        yield task
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI图像批量生成")
+    parser.add_argument("manifest", nargs="?", help="提示词清单文件（.jsonl 或 .csv）")
+    parser.add_argument("--sweep", help="提示词矩阵/参数扫描配置（JSON），组合逐个展开后提交")
+    parser.add_argument("--sweep-start", type=int, default=0, help="从扫描的第N个组合开始（跳过已完成的部分）")
+    parser.add_argument("--sweep-index", help="扫描结果的网格索引路径（默认为 <名称>_index.html）")
+    parser.add_argument("--contact-sheet", action="store_true", help="同时把扫描结果拼成联系表图片")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="结果清单输出路径")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="每个账号同时在途（等待出图）的任务数")
+    parser.add_argument("--submit-workers", type=int, help="提交阶段的线程数")
+    parser.add_argument("--download-workers", type=int, help="下载阶段的线程数")
+    parser.add_argument("--queue-size", type=int, help="阶段之间队列的容量")
+    parser.add_argument("--task-timeout", type=float, help="每个任务的期限（秒），超过时取消（清单中的timeout优先）")
+    parser.add_argument("--max-downloads", type=int, default=8, help="所有任务合计同时下载的图片数")
+    parser.add_argument("--downloads-per-task", type=int, default=4, help="单个任务同时下载的图片数")
+    parser.add_argument("--save-dir", help="图片保存目录（默认使用配置文件中的目录）")
+    parser.add_argument("--flat", action="store_true", help="图片平铺保存在保存目录中（不分片、不写索引）")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--profile", help="使用配置文件中该名称的配置方案（密钥、保存目录等）")
+    parser.add_argument("--stats-file", default="render_stats.json", help="出图耗时统计文件")
+    parser.add_argument("--submit-qps", type=float, default=2.0, help="提交接口的QPS上限")
+    parser.add_argument("--poll-qps", type=float, default=10.0, help="查询接口的QPS上限")
+    parser.add_argument("--cache-dir", default="image_cache", help="结果缓存目录（仅缓存固定种子的任务）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果缓存")
+    parser.add_argument("--no-coalesce", action="store_true", help="不合并同时在途的相同请求（固定种子）")
+    parser.add_argument("--journal", default="task_journal.sqlite3", help="任务日志文件（用于崩溃恢复）")
+    parser.add_argument("--resume", action="store_true", help="先恢复任务日志中未完成的任务（继续查询和下载）")
+    parser.add_argument("--thumbnail", type=int, default=0, metavar="SIZE", help="生成边长不超过SIZE的缩略图")
+    parser.add_argument("--preview", type=int, default=0, metavar="SIZE", help="生成长边不超过SIZE的预览图")
+    parser.add_argument("--convert", choices=["webp", "avif"], help="另存为WebP或AVIF格式")
+    parser.add_argument("--quality", type=int, default=85, help="后处理输出的图片质量（1-100）")
+    parser.add_argument("--recompress", action="store_true", help="按--quality重新压缩原始JPEG（变小时替换）")
+    parser.add_argument("--embed-metadata", action="store_true", help="把提示词和参数写入图片EXIF")
+    parser.add_argument("--postprocess-workers", type=int, help="后处理进程数（默认为CPU核数）")
+    parser.add_argument("--trace", help="把各阶段的span事件写入该JSONL文件")
+    parser.add_argument("--metrics-port", type=int, help="在该端口的 /metrics 上暴露Prometheus指标")
+    parser.add_argument("--metrics-file", help="结束时把Prometheus文本格式的指标写入该文件")
+    parser.add_argument("--accounts", help="多账号列表（JSON数组，每项含name/ak/sk，可选max_concurrency）")
+    parser.add_argument("--ak", help="Access Key（默认读取环境变量VOLC_ACCESSKEY或配置文件）")
+    parser.add_argument("--sk", help="Secret Key（默认读取环境变量VOLC_SECRETKEY或配置文件）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+    if args.profile:
+        try:
+            config = apply_profile(config, args.profile)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return 2
+
+    try:
+        account_list = resolve_accounts(args, config)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 2
+
+    if args.manifest is None and args.sweep is None and not args.resume:
+        print("错误: 请提供清单文件或 --sweep 扫描配置，或使用 --resume 恢复未完成的任务")
+        return 2
+    if args.manifest is not None and not os.path.exists(args.manifest):
+        print(f"错误: 找不到清单文件 {args.manifest}")
+        return 2
+    sweep = None
+    if args.sweep is not None:
+        try:
+            sweep = SweepSpec.load(args.sweep)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"错误: 读取扫描配置失败: {e}")
+            return 2
+        print(f"扫描 {sweep.name}: {len(sweep)}个组合")
+
+    post_config = PostProcessConfig(thumbnail_size=args.thumbnail, preview_size=args.preview,
+                                    convert_format=args.convert, quality=args.quality,
+                                    recompress=args.recompress, embed_metadata=args.embed_metadata)
+    postprocessor = None
+    if post_config.enabled():
+        try:
+            postprocessor = ImagePostProcessor(post_config, max_workers=args.postprocess_workers)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return 2
+
+    save_dir = args.save_dir or config.get("save_dir", "generated_images")
+    tracer = Tracer(args.trace)
+    metrics_server = None
+    if args.metrics_port:
+        metrics_server = MetricsServer(tracer, port=args.metrics_port).start()
+        print(f"Prometheus指标: http://127.0.0.1:{args.metrics_port}/metrics")
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    journal = TaskJournal(args.journal)
+    storage = None if args.flat else OutputStore(save_dir)
+    # 总在途任务数为各账号之和
+    pool, max_in_flight = build_pool(account_list, args.submit_qps, args.poll_qps, args.concurrency)
+    engine = GenerationEngine(pool.accounts[0].ak, pool.accounts[0].sk, save_dir=save_dir,
+                              max_in_flight=max_in_flight, stats_file=args.stats_file,
+                              max_downloads=args.max_downloads,
+                              downloads_per_task=args.downloads_per_task, cache=cache,
+                              limiter=pool.accounts[0].limiter, journal=journal,
+                              postprocessor=postprocessor, tracer=tracer,
+                              coalesce=not args.no_coalesce, pool=pool, storage=storage)
+
+    tasks = []
+    if args.resume:
+        resumed = journal.unfinished(accounts=pool)
+        print(f"从任务日志恢复{len(resumed)}个未完成的任务")
+        tasks = resumed
+    if args.manifest is not None:
+        tasks = itertools.chain(tasks, load_manifest(args.manifest))
+    if sweep is not None:
+        tasks = itertools.chain(tasks, sweep.tasks(start=args.sweep_start))
+    if args.task_timeout:
+        tasks = with_timeout(tasks, args.task_timeout)
+
+    start = time.time()
+    try:
+        succeeded, failed = write_results_manifest(args.output, engine.run_batch(
+            tasks,
+            submit_workers=args.submit_workers,
+            download_workers=args.download_workers,
+            queue_size=args.queue_size
+        ))
+    except ValueError as e:
+        print(f"错误: 清单格式有误: {e}")
+        return 2
+    finally:
+        engine.close()
+        if postprocessor is not None:
+            # 等待剩余图片处理完
+            postprocessor.close()
+            stats = postprocessor.stats()
+            print(f"图片后处理: 完成{stats['processed']}张, 失败{stats['failed']}张")
+        if cache is not None:
+            stats = cache.stats()
+            print(f"缓存: 命中{stats['hits']}次, 未命中{stats['misses']}次, "
+                  f"{stats['entries']}条记录, 占用{stats['bytes'] / 1024 / 1024:.1f}MB")
+            cache.close()
+        journal.close()
+        if storage is not None:
+            storage.close()
+        tracer.close()
+        if metrics_server is not None:
+            metrics_server.stop()
+        if args.metrics_file:
+            tracer.write_prometheus(args.metrics_file)
+
+    print("各阶段耗时（秒）:")
+    print(tracer.format_summary())
+
+    if len(pool.accounts) > 1:
+        for stats in pool.stats():
+            state = "正常" if stats["healthy"] else f"暂停（{stats['last_error']}）"
+            print(f"账号 {stats['name']}: 提交{stats['submitted']}个任务, {state}")
+    if engine.coalescer is not None and engine.coalescer.coalesced:
+        print(f"合并了{engine.coalescer.coalesced}个与在途任务相同的请求")
+
+    if sweep is not None:
+        try:
+            outputs = write_sweep_index(sweep, args.output, args.sweep_index or f"{sweep.name}_index.html",
+                                        contact_sheet=args.contact_sheet)
+            print("扫描索引: " + ", ".join(outputs))
+        except (OSError, ValueError) as e:
+            print(f"生成扫描索引失败: {e}")
+
+    elapsed = time.time() - start
+    print(f"批量生成完成: 成功{succeeded}个, 失败{failed}个, 用时{elapsed:.1f}秒")
+    print(f"结果清单: {args.output}")
+    return 0 if failed == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+# coding:utf-8
+"""
+线程方式与asyncio方式的吞吐量和内存对比
+
+在本进程中启动模拟服务（见 mock_visual_server），然后对每个并发数分别在
+独立的子进程中运行两种客户端，使内存统计互不影响：
+    threads  每个任务一个线程，使用同步的 VisualService 提交和轮询
+    async    所有任务在一个事件循环中，使用 AsyncVisualClient
+每种方式同时有N个任务在远端处理中，记录总耗时、吞吐量、峰值RSS增量、
+Python堆峰值和峰值线程数。两种客户端的模块在开始计量前都已导入，内存
+增量中不包含模块本身。
+
+用法：
+    python bench_async_vs_threads.py --levels 10 100 1000 --render-time 3
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+import subprocess
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows 上没有 resource 模块，只统计Python堆
+    resource = None
+
+from requests.adapters import HTTPAdapter
+from volcengine.visual.VisualService import VisualService
+
+from async_visual_client import AsyncVisualClient
+from generation_engine import MAX_THROTTLE_BACKOFF, build_submit_form, build_result_form
+from mock_visual_server import MockVisualServer
+
+BENCH_AK = "mock-access-key"
+BENCH_SK = "mock-secret-key"
+BENCH_PROMPT = "一只在雪地里奔跑的柴犬，电影感光线"
+BENCH_SIZE = 1328
+
+
+def peak_rss_kb():
+    """进程的峰值常驻内存（KB），无法获取时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 上单位是字节
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_threads(endpoint, tasks, first_poll, poll_interval):
+    """每个任务一个线程，阻塞地提交并轮询"""
+    visual_service = VisualService()
+    visual_service.set_ak(BENCH_AK)
+    visual_service.set_sk(BENCH_SK)
+    visual_service.service_info.host = endpoint
+    visual_service.service_info.scheme = "http"
+    # 连接池与线程数一致，否则连接会被反复丢弃重建
+    visual_service.session.mount("http://", HTTPAdapter(pool_maxsize=tasks))
+
+    results = []
+
+    def call(method, form):
+        attempt = 0
+        while True:
+            try:
+                return method(form)
+            except Exception as e:
+                attempt += 1
+                if attempt > 8 or ("50429" not in str(e) and "50430" not in str(e)):
+                    raise
+                time.sleep(random.uniform(0, min(MAX_THROTTLE_BACKOFF, 2 ** attempt)))
+
+    def worker(index):
+        try:
+            resp = call(visual_service.cv_sync2async_submit_task,
+                        build_submit_form(f"{BENCH_PROMPT} #{index}", BENCH_SIZE, BENCH_SIZE))
+            result_form = build_result_form(resp["data"]["task_id"])
+            time.sleep(first_poll)
+            while True:
+                data = call(visual_service.cv_sync2async_get_result, result_form)["data"]
+                if data["status"] in ("done", "failed"):
+                    results.append(data["status"] == "done")
+                    return
+                time.sleep(poll_interval)
+        except Exception:
+            results.append(False)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(tasks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(results)
+
+
+def run_async(endpoint, tasks, first_poll, poll_interval):
+    """所有任务在一个事件循环中并发"""
+    async def main():
+        async with AsyncVisualClient(BENCH_AK, BENCH_SK, host=endpoint, scheme="http",
+                                     max_connections=min(tasks, 100)) as client:
+            results = await asyncio.gather(*[
+                client.generate(f"{BENCH_PROMPT} #{i}", BENCH_SIZE, BENCH_SIZE,
+                                first_poll=first_poll, poll_interval=poll_interval, timeout=600)
+                for i in range(tasks)], return_exceptions=True)
+        return sum(1 for r in results if not isinstance(r, BaseException))
+
+    return asyncio.run(main())
+
+
+def run_child(args):
+    """子进程：运行一种方式并以JSON输出结果"""
+    # 后台每50毫秒采样一次线程数
+    peak_threads = [threading.active_count()]
+    finished = threading.Event()
+
+    def sample_threads():
+        while not finished.wait(0.05):
+            peak_threads[0] = max(peak_threads[0], threading.active_count() - 1)
+
+    sampler = threading.Thread(target=sample_threads, daemon=True)
+    sampler.start()
+
+    baseline_rss = peak_rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    runner = run_threads if args.child == "threads" else run_async
+    succeeded = runner(args.endpoint, args.tasks, args.first_poll, args.poll_interval)
+    elapsed = time.perf_counter() - start
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    finished.set()
+
+    rss = peak_rss_kb()
+    print(json.dumps({
+        "mode": args.child,
+        "tasks": args.tasks,
+        "succeeded": succeeded,
+        "seconds": round(elapsed, 2),
+        "throughput": round(succeeded / elapsed, 2) if elapsed else 0,
+        "rss_delta_mb": round((rss - baseline_rss) / 1024, 1) if rss is not None else None,
+        "heap_peak_mb": round(heap_peak / 1024 / 1024, 1),
+        "threads": peak_threads[0]
+    }))
+
+
+def run_level(args, endpoint, mode, tasks):
+    command = [sys.executable, __file__, "--child", mode, "--endpoint", endpoint,
+               "--tasks", str(tasks), "--first-poll", str(args.first_poll),
+               "--poll-interval", str(args.poll_interval)]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="线程方式与asyncio方式的吞吐量和内存对比")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 100, 1000], help="同时处理中的任务数")
+    parser.add_argument("--modes", nargs="+", default=["threads", "async"], choices=["threads", "async"])
+    parser.add_argument("--render-time", type=float, default=3.0, help="模拟的出图耗时中位数（秒）")
+    parser.add_argument("--queue-time", type=float, default=0.5, help="模拟的平均排队时间（秒）")
+    parser.add_argument("--submit-qps", type=float, default=0, help="模拟服务的提交QPS上限，0为不限")
+    parser.add_argument("--first-poll", type=float, default=2.0, help="提交后第一次查询的时间（秒）")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="之后的查询间隔（秒）")
+    parser.add_argument("-o", "--output", help="把结果写入JSON文件")
+    # 以下参数供子进程使用
+    parser.add_argument("--child", choices=["threads", "async"], help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", help=argparse.SUPPRESS)
+    parser.add_argument("--tasks", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        run_child(args)
+        return
+
+    server = MockVisualServer(render_time=args.render_time, queue_time=args.queue_time,
+                              submit_qps=args.submit_qps, seed=1).start()
+    print(f"模拟服务: http://{server.endpoint}（出图耗时约{args.render_time}秒）")
+    header = f"{'方式':<8}{'任务数':>8}{'成功':>8}{'耗时(秒)':>10}{'吞吐(个/秒)':>12}{'RSS增量(MB)':>13}{'堆峰值(MB)':>12}{'线程数':>8}"
+    print(header)
+    rows = []
+    try:
+        for tasks in args.levels:
+            for mode in args.modes:
+                row = run_level(args, server.endpoint, mode, tasks)
+                rows.append(row)
+                rss = "-" if row["rss_delta_mb"] is None else row["rss_delta_mb"]
+                print(f"{mode:<8}{tasks:>8}{row['succeeded']:>8}{row['seconds']:>10}"
+                      f"{row['throughput']:>12}{rss:>13}{row['heap_peak_mb']:>12}{row['threads']:>8}")
+    finally:
+        server.stop()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# coding:utf-8
+"""
+图形界面的启动耗时
+
+分两部分测量，每项重复多次取中位数：
+    导入耗时    python -X importtime 导入 image_generator_gui，按累计耗时列出最慢的模块
+    首个窗口    从启动进程到窗口画出第一帧的时间（源码运行，以及 --exe 指定的打包版本）
+另外检查导入界面模块（主窗口、任务列表、图库）时没有提前加载应延迟导入的重量级
+依赖（Pillow、requests、火山引擎SDK、http.server），加载了时退出码为1。
+首个窗口的测量通过环境变量 JIMENG_STARTUP_PROBE 让程序画出第一帧后写入时间戳
+并立即退出；程序在临时目录中运行，不会读写当前目录的配置和任务日志。需要图形
+环境，没有显示器时只输出导入耗时。
+
+用法：
+    python bench_startup.py
+    python bench_startup.py --exe dist/AI图像生成器.exe --exe dist/AI图像生成器/AI图像生成器.exe
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+from render_stats import quantile
+from image_generator_gui import STARTUP_PROBE_ENV
+
+GUI_MODULE = "image_generator_gui"
+GUI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), GUI_MODULE + ".py")
+LAUNCH_TIMEOUT = 60
+# 启动时不应导入的模块：用到时才在函数内导入
+DEFERRED_MODULES = ("PIL", "requests", "volcengine", "http.server")
+# 启动时导入的界面模块，逐个在新进程中检查
+STARTUP_MODULES = (GUI_MODULE, "job_panel", "gallery_panel")
+
+
+def import_breakdown(module=GUI_MODULE, top=15):
+    """用 -X importtime 导入模块，返回 (总耗时, [(累计耗时, 自身耗时, 模块名), ...])，单位秒"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(GUI_SCRIPT))
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, name.rstrip()))
+        except ValueError:
+            # 表头行
+            continue
+    total = next((row[0] for row in rows if row[2].strip() == module), None)
+    rows.sort(reverse=True)
+    return total, rows[:top]
+
+
+def time_import(module=GUI_MODULE):
+    """在新进程中导入模块的耗时（秒）"""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(GUI_SCRIPT), text=True)
+    return float(output.strip())
+
+
+def eager_imports(module):
+    """在新进程中导入模块，返回被一并加载的 DEFERRED_MODULES"""
+    code = (f"import sys; import {module}; "
+            f"print(' '.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))")
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(GUI_SCRIPT), text=True)
+    return output.split()
+
+
+def time_first_window(command):
+    """启动程序到画出第一帧的时间（秒），失败时抛出RuntimeError"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        probe_file = os.path.join(work_dir, "startup_probe.txt")
+        env = dict(os.environ)
+        env[STARTUP_PROBE_ENV] = probe_file
+        start = time.time()
+        result = subprocess.run(command, cwd=work_dir, env=env, capture_output=True,
+                                text=True, timeout=LAUNCH_TIMEOUT)
+        if not os.path.exists(probe_file):
+            error = (result.stderr or "").strip().splitlines()
+            raise RuntimeError(error[-1] if error else f"退出码 {result.returncode}")
+        with open(probe_file, 'r', encoding='utf-8') as f:
+            return float(f.read()) - start
+
+
+def format_times(samples):
+    samples = sorted(samples)
+    return f"中位数 {quantile(samples, 0.5) * 1000:.0f}ms, 最快 {samples[0] * 1000:.0f}ms, 最慢 {samples[-1] * 1000:.0f}ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="图形界面启动耗时")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    parser.add_argument("--top", type=int, default=15, help="列出导入最慢的模块数")
+    parser.add_argument("--exe", action="append", default=[], help="同时测量该打包版本（可重复指定）")
+    args = parser.parse_args(argv)
+
+    total, rows = import_breakdown(top=args.top)
+    print(f"导入 {GUI_MODULE}（-X importtime）: {total * 1000:.0f}ms" if total else f"导入 {GUI_MODULE}")
+    print(f"{'累计(ms)':>10}{'自身(ms)':>10}  模块")
+    for cumulative, self_time, name in rows:
+        print(f"{cumulative * 1000:>10.1f}{self_time * 1000:>10.1f}  {name}")
+
+    samples = [time_import() for _ in range(args.repeat)]
+    print(f"\n导入耗时: {format_times(samples)}")
+
+    print("\n延迟导入:")
+    eager = False
+    for module in STARTUP_MODULES:
+        loaded = eager_imports(module)
+        eager = eager or bool(loaded)
+        print(f"  {module}: " + (f"提前加载了 {', '.join(loaded)}" if loaded else "正常"))
+
+    targets = [("源码", [sys.executable, GUI_SCRIPT])]
+    targets += [(path, [os.path.abspath(path)]) for path in args.exe]
+    print("\n首个窗口:")
+    for label, command in targets:
+        try:
+            samples = [time_first_window(command) for _ in range(args.repeat)]
+        except (OSError, RuntimeError, subprocess.TimeoutExpired) as e:
+            print(f"  {label}: 无法测量（{e}）")
+            continue
+        print(f"  {label}: {format_times(samples)}")
+    return 1 if eager else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,9 +5,13 @@
 使用步骤:
 1. 安装依赖: pip install -r requirements.txt
 2. 运行打包: python build_exe.py
+   启动更快的目录版: python build_exe.py --onedir
+   （单文件exe每次启动都要先解压到临时目录；目录版不需要解压）
+3. 比较启动耗时: python bench_startup.py --exe dist/AI图像生成器.exe --exe dist/AI图像生成器/AI图像生成器.exe
 """
 
 import os
+import argparse
 import subprocess
 import sys
 
@@ -33,14 +37,14 @@ def install_dependencies():
                 return False
     return True
 
-def build_exe():
-    """使用PyInstaller打包exe"""
+def build_exe(onedir=False):
+    """使用PyInstaller打包exe；onedir 为True时打包成目录"""
     print("\n开始打包exe文件...")
     
     # PyInstaller命令
     cmd = [
         'pyinstaller',
-        '--onefile',                    # 打包成单个exe文件
+        '--onedir' if onedir else '--onefile',  # 打包成目录 / 单个exe文件
         '--windowed',                   # 不显示控制台窗口
         '--name=AI图像生成器',           # exe文件名
         '--icon=icon.ico',              # 图标文件（如果有的话）
@@ -50,6 +54,10 @@ def build_exe():
         'image_generator_gui.py'        # 主程序文件
     ]
     
+    if onedir:
+        # 不用UPX压缩：压缩后的DLL每次加载都要先解压
+        cmd.insert(1, '--noupx')
+    
     # 如果没有图标文件，移除图标参数
     if not os.path.exists('icon.ico'):
         cmd = [item for item in cmd if not item.startswith('--icon')]
@@ -57,13 +65,20 @@ def build_exe():
     try:
         subprocess.check_call(cmd)
         print("\n✓ 打包成功！")
-        print("exe文件位置: dist/AI图像生成器.exe")
+        if onedir:
+            print("exe文件位置: dist/AI图像生成器/AI图像生成器.exe（发布时需要复制整个目录）")
+        else:
+            print("exe文件位置: dist/AI图像生成器.exe")
         return True
     except subprocess.CalledProcessError as e:
         print(f"\n✗ 打包失败: {e}")
         return False
 
 def main():
+    parser = argparse.ArgumentParser(description="AI图像生成器打包工具")
+    parser.add_argument("--onedir", action="store_true", help="打包成目录（启动更快，不需要每次解压）")
+    args = parser.parse_args()
+
     print("=== AI图像生成器打包工具 ===\n")
     
     # 检查主程序文件是否存在
@@ -78,7 +93,7 @@ def main():
         return
     
     # 打包exe
-    if build_exe():
+    if build_exe(onedir=args.onedir):
         print("\n打包完成！可以在dist目录下找到生成的exe文件")
         print("\n注意事项:")
         print("1. 首次运行exe时，杀毒软件可能会报警，这是正常现象")
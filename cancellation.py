@@ -0,0 +1,93 @@
+# coding:utf-8
+"""
+协作式取消和任务期限
+
+每个 GenerationTask 带一个 CancelToken。提交、查询和下载的各个等待点（限流等待、
+账号并发名额、被限流后的退避、轮询排期、下载的每个数据块和重试退避）都会检查
+它：调用 cancel() 或超过期限后，任务在下一个检查点以 TaskCancelledError 结束，
+占用的并发名额立即归还，不会继续查询和下载没人要的结果。
+已经发出的HTTP请求无法中断，等它返回后再放弃。
+"""
+import time
+import threading
+
+CANCELLED = "已取消"
+DEADLINE_EXCEEDED = "超过任务期限"
+
+
+class TaskCancelledError(Exception):
+    """任务被取消或超过期限"""
+
+
+class CancelToken:
+    """取消标记：可被任意线程取消；设置期限后到期也视为取消"""
+
+    def __init__(self, timeout=None):
+        self.reason = None
+        # 期限（time.monotonic()），为None时不限
+        self.deadline = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        if timeout:
+            self.set_timeout(timeout)
+
+    def set_timeout(self, seconds):
+        """从现在起seconds秒后到期"""
+        self.deadline = time.monotonic() + float(seconds)
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+            return True
+        return False
+
+    def cancel(self, reason=CANCELLED):
+        """取消并调用登记的回调，已取消时返回False"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+        return True
+
+    def add_callback(self, callback):
+        """登记取消时调用的回调（在调用cancel的线程中执行），已取消时立即调用"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback):
+        """撤销登记的回调，不再需要取消通知时调用"""
+        with self._lock:
+            try:
+                self._callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    def remaining(self):
+        """距期限的秒数，没有期限时返回None"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def wait(self, timeout=None):
+        """代替time.sleep：最多等待timeout秒，取消或到期时提前返回；返回是否已取消"""
+        remaining = self.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        self._event.wait(timeout)
+        return self.cancelled
+
+    def check(self):
+        """已取消时抛出TaskCancelledError"""
+        if self.cancelled:
+            raise TaskCancelledError(self.reason)
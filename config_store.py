@@ -0,0 +1,191 @@
+# coding:utf-8
+"""
+配置文件（config.json）的读写
+
+启动时读取一次，之后的修改只更新内存中的副本，由后台线程合并成一次延迟
+写入：连续的修改（例如逐字输入宽度）在最后一次修改 delay 秒后才写文件；
+内容与上次写入的相同时不写。写入先写临时文件再替换，中途退出不会留下
+损坏的配置文件。
+
+命名方案（profiles）保存在同一文件的 "profiles" 中，每个方案是一组设置
+（密钥、比例、保存目录等），切换方案不需要重新读取文件。
+"""
+import os
+import json
+import time
+import threading
+
+# 最后一次修改之后等待多久再写文件（秒）
+DEFAULT_DELAY = 0.5
+PROFILES_KEY = "profiles"
+ACTIVE_PROFILE_KEY = "profile"
+
+
+class ConfigStore:
+    """config.json 在内存中的副本，修改后延迟写入；可被多个线程共用"""
+
+    def __init__(self, path, delay=DEFAULT_DELAY, log=None):
+        self.path = path
+        self.delay = delay
+        self.log = log or print
+        self.writes = 0
+
+        self._data = self._read()
+        # 与文件内容一致的序列化结果，用于判断是否需要写入
+        self._written = self._serialize(self._data)
+        self._due = None
+        # 上次写入失败，内存中的修改仍未保存
+        self._unsaved = False
+        self._closed = False
+        self._cond = threading.Condition()
+        # 后台线程和 flush 不会同时写文件
+        self._write_lock = threading.Lock()
+        self._writer = None
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except Exception as e:
+            self.log(f"加载配置失败: {e}")
+            return {}
+
+    @staticmethod
+    def _serialize(data):
+        return json.dumps(data, ensure_ascii=False, indent=2)
+
+    def get(self, key, default=None):
+        with self._cond:
+            return self._data.get(key, default)
+
+    def snapshot(self):
+        """当前全部设置的副本"""
+        with self._cond:
+            return json.loads(self._serialize(self._data))
+
+    def update(self, values, immediate=False):
+        """合并设置；有变化时安排写入，immediate 为True时不等待直接写。返回是否有变化"""
+        with self._cond:
+            changed = {k: v for k, v in values.items() if self._data.get(k) != v}
+            if not changed:
+                if immediate and (self._due is not None or self._unsaved):
+                    self._schedule(0)
+                return False
+            self._data.update(changed)
+            self._schedule(0 if immediate else self.delay)
+            return True
+
+    def remove(self, key):
+        with self._cond:
+            if key not in self._data:
+                return False
+            del self._data[key]
+            self._schedule(self.delay)
+            return True
+
+    def _schedule(self, delay):
+        """（持有锁时调用）安排在delay秒后写入，之前安排的写入被推迟"""
+        if self._closed:
+            return
+        self._due = time.monotonic() + delay
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, name="config-writer")
+            self._writer.daemon = True
+            self._writer.start()
+        self._cond.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._due is None or self._due > time.monotonic()):
+                    self._cond.wait(None if self._due is None else self._due - time.monotonic())
+                if self._closed:
+                    return
+                self._due = None
+                text = self._serialize(self._data)
+            self._write(text)
+
+    def _write(self, text):
+        """内容有变化时写入临时文件再替换原文件"""
+        with self._write_lock:
+            with self._cond:
+                if text == self._written:
+                    return False
+            tmp_path = f"{self.path}.tmp"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                self.log(f"保存配置失败: {e}")
+                with self._cond:
+                    self._unsaved = True
+                return False
+            with self._cond:
+                self._written = text
+                self._unsaved = False
+                self.writes += 1
+            return True
+
+    def flush(self):
+        """立即写入尚未保存的修改（在调用线程中）"""
+        with self._cond:
+            self._due = None
+            text = self._serialize(self._data)
+        return self._write(text)
+
+    def close(self):
+        """停止后台线程并写入尚未保存的修改"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.join()
+        self.flush()
+
+    # 命名方案
+
+    def profile_names(self):
+        with self._cond:
+            return sorted(self._data.get(PROFILES_KEY) or {})
+
+    def get_profile(self, name):
+        """返回方案中的设置，不存在时返回None"""
+        with self._cond:
+            profile = (self._data.get(PROFILES_KEY) or {}).get(name)
+            return dict(profile) if profile is not None else None
+
+    def save_profile(self, name, values):
+        """保存（或覆盖）一个方案，并设为当前方案"""
+        with self._cond:
+            profiles = dict(self._data.get(PROFILES_KEY) or {})
+            profiles[name] = dict(values)
+            self._data[PROFILES_KEY] = profiles
+            self._data[ACTIVE_PROFILE_KEY] = name
+            self._schedule(self.delay)
+
+    def delete_profile(self, name):
+        with self._cond:
+            profiles = dict(self._data.get(PROFILES_KEY) or {})
+            if profiles.pop(name, None) is None:
+                return False
+            self._data[PROFILES_KEY] = profiles
+            if self._data.get(ACTIVE_PROFILE_KEY) == name:
+                self._data.pop(ACTIVE_PROFILE_KEY, None)
+            self._schedule(self.delay)
+            return True
+
+
+def apply_profile(config, name):
+    """返回用方案中的设置覆盖后的配置，方案不存在时抛出ValueError"""
+    profile = (config.get(PROFILES_KEY) or {}).get(name)
+    if profile is None:
+        raise ValueError(f"找不到配置方案: {name}")
+    merged = dict(config)
+    merged.update(profile)
+    return merged
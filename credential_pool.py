@@ -0,0 +1,192 @@
+# coding:utf-8
+"""
+多账号（AK/SK）池
+
+每个账号有自己的 VisualService、限流器（提交/查询QPS和并发上限）和健康
+状态。提交任务时选择当前在途任务最少、且还有并发名额的健康账号；账号出现
+鉴权错误或额度/欠费错误时暂停使用一段时间，其余账号继续工作，总吞吐量随
+账号数增长。查询结果必须使用提交该任务的账号，任务上记录了账号名。
+火山引擎SDK导入较慢，第一次创建VisualService时才导入，不拖慢程序启动。
+"""
+import time
+import threading
+
+from rate_limiter import ServiceLimiter
+
+# 鉴权失败：密钥错误或被禁用
+AUTH_ERROR_CODES = {"InvalidAccessKey", "InvalidSecretKey", "SignatureDoesNotMatch",
+                    "InvalidAuthorization", "InvalidCredential", "AccessDenied"}
+# 额度用尽、欠费或未开通服务
+QUOTA_ERROR_CODES = {"AccountOverdue", "QuotaExceeded", "InsufficientBalance", "ServiceNotOpen"}
+# 账号被暂停使用的时长（秒），到期后重新尝试
+AUTH_COOLDOWN = 3600.0
+QUOTA_COOLDOWN = 600.0
+# 等待空闲名额时的最长单次等待（并发上限可能在其他线程中被调高）
+WAIT_SLICE = 1.0
+
+_visual_service_class = None
+
+
+class NoHealthyAccountError(Exception):
+    """所有账号都处于暂停状态"""
+
+
+class AccountError(Exception):
+    """账号鉴权失败（reason="auth"）或额度不足（reason="quota"）"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def account_error(resp_or_exc):
+    """判断接口返回或SDK异常是否为账号问题，返回 "auth" / "quota" / None"""
+    if isinstance(resp_or_exc, dict):
+        error = (resp_or_exc.get("ResponseMetadata") or {}).get("Error") or {}
+        text = str(error.get("Code", ""))
+    else:
+        text = str(resp_or_exc)
+    if any(code in text for code in AUTH_ERROR_CODES):
+        return "auth"
+    if any(code in text for code in QUOTA_ERROR_CODES):
+        return "quota"
+    return None
+
+
+def visual_service_class():
+    """返回每次创建独立实例的VisualService子类（首次调用时导入SDK）"""
+    global _visual_service_class
+    if _visual_service_class is None:
+        from volcengine.visual.VisualService import VisualService
+
+        class AccountVisualService(VisualService):
+            """SDK中的VisualService是单例，所有实例共用同一组密钥；每个账号需要独立的实例"""
+
+            def __new__(cls, *args, **kwargs):
+                return object.__new__(cls)
+
+        _visual_service_class = AccountVisualService
+    return _visual_service_class
+
+
+class Account:
+    """一个AK/SK账号及其限流器和健康状态"""
+
+    def __init__(self, name, ak, sk, limiter=None, max_concurrency=4, submit_qps=2.0, poll_qps=10.0):
+        # 未命名时以AK作为账号名（AK不是机密，SK才是）
+        self.name = name or ak
+        self.ak = ak
+        self.sk = sk
+        self.limiter = limiter or ServiceLimiter(submit_qps=submit_qps, poll_qps=poll_qps,
+                                                 max_concurrency=max_concurrency)
+        self.outstanding = 0
+        self.submitted = 0
+        self.disabled_until = 0.0
+        self.last_error = None
+        self._visual_service = None
+        self._lock = threading.Lock()
+
+    def visual_service(self):
+        """返回该账号的VisualService（复用同一实例和连接池）"""
+        with self._lock:
+            if self._visual_service is None:
+                visual_service = visual_service_class()()
+                visual_service.set_ak(self.ak)
+                visual_service.set_sk(self.sk)
+                self._visual_service = visual_service
+            return self._visual_service
+
+    def healthy(self, now=None):
+        return (now or time.monotonic()) >= self.disabled_until
+
+    def stats(self):
+        stats = self.limiter.stats()
+        stats.update({
+            "name": self.name,
+            "healthy": self.healthy(),
+            "outstanding": self.outstanding,
+            "submitted": self.submitted,
+            "last_error": self.last_error
+        })
+        return stats
+
+
+class CredentialPool:
+    """在多个账号之间分配任务：在途任务最少的健康账号优先"""
+
+    def __init__(self, accounts):
+        if not accounts:
+            raise ValueError("至少需要一个账号")
+        self.accounts = list(accounts)
+        if len({account.name for account in self.accounts}) != len(self.accounts):
+            raise ValueError("账号名不能重复")
+        # 也可以按AK查找：任务日志中的账号名在改名后仍能对应到同一账号
+        self._by_name = {account.ak: account for account in self.accounts}
+        self._by_name.update({account.name: account for account in self.accounts})
+        self._cond = threading.Condition()
+
+    def get(self, name):
+        """按名称或AK取账号，未知时返回第一个账号"""
+        return self._by_name.get(name, self.accounts[0])
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    def acquire(self, name=None, token=None):
+        """取得一个账号的并发名额并返回该账号；name 指定时只使用该账号
+
+        所有账号都在暂停中时抛出NoHealthyAccountError；等待期间 token（CancelToken）
+        被取消时抛出TaskCancelledError。
+        """
+        if token is None:
+            return self._acquire(name, None)
+        # 取消时立即唤醒等待，不必等到下一次检查；返回后撤销，重复获取不会累积回调
+        token.add_callback(self._wake)
+        try:
+            return self._acquire(name, token)
+        finally:
+            token.remove_callback(self._wake)
+
+    def _acquire(self, name, token):
+        with self._cond:
+            while True:
+                if token is not None:
+                    token.check()
+                now = time.monotonic()
+                if name is not None:
+                    candidates = [self.get(name)]
+                else:
+                    candidates = [a for a in self.accounts if a.healthy(now)]
+                    if not candidates:
+                        raise NoHealthyAccountError("所有账号都暂停使用: " + "; ".join(
+                            f"{a.name}: {a.last_error}" for a in self.accounts))
+                for account in sorted(candidates, key=lambda a: a.outstanding / a.limiter.concurrency.limit):
+                    if account.limiter.concurrency.try_acquire():
+                        account.outstanding += 1
+                        return account
+                remaining = token.remaining() if token is not None else None
+                self._cond.wait(WAIT_SLICE if remaining is None else min(WAIT_SLICE, remaining))
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def release(self, account):
+        """归还账号的并发名额"""
+        with self._cond:
+            account.outstanding -= 1
+            account.limiter.concurrency.release()
+            self._cond.notify_all()
+
+    def mark_unhealthy(self, account, reason, error):
+        """账号出现鉴权或额度错误时暂停使用一段时间"""
+        cooldown = AUTH_COOLDOWN if reason == "auth" else QUOTA_COOLDOWN
+        with self._cond:
+            account.disabled_until = time.monotonic() + cooldown
+            account.last_error = str(error)[:200]
+            self._cond.notify_all()
+        return cooldown
+
+    def stats(self):
+        with self._cond:
+            return [account.stats() for account in self.accounts]
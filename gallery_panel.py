@@ -0,0 +1,359 @@
+# coding:utf-8
+"""
+图库面板
+
+以缩略图网格显示保存目录中生成过的图片（来自保存目录的索引，见 output_store.py；
+保存目录第一层中不在索引里的图片，如旧版平铺保存或手工放入的，排在后面），
+可以按提示词（未索引的图片按文件名）筛选，单击显示完整提示词，双击用系统程序打开原图。图片有几千张时
+滚动仍然流畅，内存占用有上限：
+    只绘制可见的行：滚动时按可见范围在画布上创建和回收格子，不为每张图片建控件
+    后台线程池解码：JPEG 在解码时直接按缩小比例读取，已滚出可见范围的请求跳过
+    解码好的 PhotoImage 放在按内存计量的LRU缓存中，超过上限时丢弃最久未显示的
+面板的状态只在主线程中修改，工作线程通过 post_ui 把结果交回主线程。
+"""
+import os
+import math
+import threading
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import tkinter as tk
+from tkinter import ttk
+
+from output_store import preview_file
+
+# Pillow 可选：没有安装时只显示占位格子；第一次解码时才导入
+HAS_PIL = importlib.util.find_spec("PIL") is not None
+
+CELL_SIZE = 160
+CELL_PADDING = 8
+LABEL_HEIGHT = 18
+DECODE_WORKERS = 2
+# 缩略图缓存的内存上限（按每像素4字节计算）
+CACHE_BYTES = 64 * 1024 * 1024
+# 可见范围上下额外绘制的行数，滚动时下一行已经在解码
+OVERSCAN_ROWS = 1
+PLACEHOLDER_COLOR = "#e8e8e8"
+
+
+def short_label(prompt, limit=12):
+    prompt = " ".join(prompt.split())
+    return prompt if len(prompt) <= limit else prompt[:limit] + "…"
+
+
+class ThumbnailCache:
+    """按内存计量的 PhotoImage LRU 缓存（只在主线程中使用）"""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        self._items.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, photo, keep=()):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        cost = photo.width() * photo.height() * 4
+        self._items[key] = (photo, cost)
+        self.bytes += cost
+        self.evict(keep)
+
+    def evict(self, keep=()):
+        """超过上限时从最久未使用的开始丢弃，keep 中的（正在显示的）保留"""
+        for key in list(self._items):
+            if self.bytes <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            _, cost = self._items.pop(key)
+            self.bytes -= cost
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+
+
+class GalleryPanel(ttk.Frame):
+    """图库：提示词筛选 + 虚拟滚动的缩略图网格"""
+
+    def __init__(self, parent, store_for, save_dir, post_ui, log, on_open=None,
+                 cache_bytes=CACHE_BYTES, workers=DECODE_WORKERS):
+        super().__init__(parent, padding="10")
+        # store_for(save_dir) 返回保存目录的 OutputStore，save_dir() 返回当前的保存目录
+        self.store_for = store_for
+        self.save_dir = save_dir
+        self.post_ui = post_ui
+        self.log = log
+        self.on_open = on_open
+        self.workers = workers
+
+        self.query = tk.StringVar()
+        # [(图片路径, task_id, 提示词), ...]
+        self.items = []
+        self.columns = 1
+        # 已绘制的格子：序号 -> [图片或占位item, 文字item]
+        self.cells = {}
+        self.cache = ThumbnailCache(cache_bytes)
+        self.pending = set()
+        self.failed = set()
+        # 可见格子的图片路径；解码线程读取它来跳过已滚出的请求，只整体替换
+        self.visible = frozenset()
+        self._executor = None
+        self._listing = 0
+
+        self.setup_ui()
+
+    def setup_ui(self):
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        toolbar = ttk.Frame(self)
+        toolbar.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
+        ttk.Label(toolbar, text="提示词:").pack(side=tk.LEFT)
+        search_entry = ttk.Entry(toolbar, textvariable=self.query, width=30)
+        search_entry.pack(side=tk.LEFT, padx=(5, 5))
+        search_entry.bind('<Return>', lambda e: self.refresh())
+        ttk.Button(toolbar, text="搜索", command=self.refresh).pack(side=tk.LEFT)
+        ttk.Button(toolbar, text="刷新", command=self.refresh).pack(side=tk.LEFT, padx=(5, 0))
+        self.count_label = ttk.Label(toolbar, text="")
+        self.count_label.pack(side=tk.LEFT, padx=(10, 0))
+
+        self.canvas = tk.Canvas(self, background="white", highlightthickness=0,
+                                yscrollincrement=(CELL_SIZE + LABEL_HEIGHT + CELL_PADDING) // 4)
+        self.canvas.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.on_scrollbar)
+        scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+
+        self.detail_label = ttk.Label(self, text="", wraplength=800, justify=tk.LEFT)
+        self.detail_label.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 0))
+
+        self.canvas.bind('<Configure>', lambda e: self.layout())
+        self.canvas.bind('<Button-1>', self.on_click)
+        self.canvas.bind('<Double-1>', self.on_double_click)
+        # 鼠标在画布上时滚轮滚动图库
+        self.canvas.bind('<Enter>', lambda e: self._bind_wheel(True))
+        self.canvas.bind('<Leave>', lambda e: self._bind_wheel(False))
+
+    def _bind_wheel(self, enabled):
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            if enabled:
+                self.canvas.bind_all(sequence, self.on_mousewheel)
+            else:
+                self.canvas.unbind_all(sequence)
+
+    def get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(1, self.workers),
+                                                thread_name_prefix="gallery-decode")
+        return self._executor
+
+    def close(self):
+        """丢弃排队的解码请求并释放缓存"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self.cache.clear()
+
+    # 列表
+
+    def refresh(self):
+        """在后台线程查询保存目录的索引并扫描未索引的图片，完成后重新排列网格"""
+        self._listing += 1
+        listing = self._listing
+        save_dir = self.save_dir()
+        text = self.query.get()
+
+        def load():
+            try:
+                store = self.store_for(save_dir)
+                items = store.list_images(text) + store.unindexed_images(text)
+            except Exception as e:
+                self.log(f"读取图库失败: {str(e)}")
+                items = []
+            self.post_ui(self.set_items, listing, items)
+
+        thread = threading.Thread(target=load)
+        thread.daemon = True
+        thread.start()
+
+    def set_items(self, listing, items):
+        if listing != self._listing:
+            # 之后又刷新过，丢弃过期的结果
+            return
+        self.items = items
+        self.failed.clear()
+        self.count_label.config(text=f"{len(items)}张图片")
+        self.detail_label.config(text="")
+        self.canvas.yview_moveto(0)
+        self.layout(force=True)
+
+    # 网格
+
+    @staticmethod
+    def cell_size():
+        return CELL_SIZE + CELL_PADDING, CELL_SIZE + LABEL_HEIGHT + CELL_PADDING
+
+    def cell_origin(self, index):
+        cell_width, cell_height = self.cell_size()
+        row, column = divmod(index, self.columns)
+        return CELL_PADDING + column * cell_width, CELL_PADDING + row * cell_height
+
+    def index_at(self, x, y):
+        """画布坐标处的图片序号，不在图片上时返回None"""
+        cell_width, cell_height = self.cell_size()
+        column = int((x - CELL_PADDING) // cell_width)
+        row = int((y - CELL_PADDING) // cell_height)
+        if x < CELL_PADDING or y < CELL_PADDING or column >= self.columns:
+            return None
+        index = row * self.columns + column
+        left, top = self.cell_origin(index)
+        if index >= len(self.items) or x > left + CELL_SIZE or y > top + CELL_SIZE + LABEL_HEIGHT:
+            return None
+        return index
+
+    def layout(self, force=False):
+        """按画布宽度计算列数和滚动范围；列数变化时重画全部格子"""
+        cell_width, cell_height = self.cell_size()
+        columns = max(1, (self.canvas.winfo_width() - CELL_PADDING) // cell_width)
+        if force or columns != self.columns:
+            self.columns = columns
+            self.clear_cells()
+        rows = math.ceil(len(self.items) / self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.columns * cell_width + CELL_PADDING,
+                                            rows * cell_height + CELL_PADDING))
+        self.render()
+
+    def clear_cells(self):
+        for items in self.cells.values():
+            for item in items:
+                self.canvas.delete(item)
+        self.cells.clear()
+
+    def render(self):
+        """只绘制可见范围内的格子，回收已滚出的格子"""
+        _, cell_height = self.cell_size()
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first_row = max(0, int((top - CELL_PADDING) // cell_height) - OVERSCAN_ROWS)
+        last_row = int((bottom - CELL_PADDING) // cell_height) + OVERSCAN_ROWS
+        wanted = range(min(len(self.items), first_row * self.columns),
+                       min(len(self.items), (last_row + 1) * self.columns))
+
+        for index in list(self.cells):
+            if index not in wanted:
+                for item in self.cells.pop(index):
+                    self.canvas.delete(item)
+        self.visible = frozenset(self.items[index][0] for index in wanted)
+        for index in wanted:
+            if index not in self.cells:
+                self.draw_cell(index)
+
+    def draw_cell(self, index):
+        path, _, prompt = self.items[index]
+        x, y = self.cell_origin(index)
+        text_item = self.canvas.create_text(x + CELL_SIZE // 2, y + CELL_SIZE + 2, anchor=tk.N,
+                                            text=short_label(prompt or os.path.basename(path)),
+                                            fill="#555555")
+        self.cells[index] = [self.draw_image(index, path), text_item]
+
+    def draw_image(self, index, path):
+        """缩略图已解码时画图片，否则画占位格子并请求解码"""
+        x, y = self.cell_origin(index)
+        photo = self.cache.get(path)
+        if photo is not None:
+            return self.canvas.create_image(x + CELL_SIZE // 2, y + CELL_SIZE // 2, image=photo)
+        item = self.canvas.create_rectangle(x, y, x + CELL_SIZE, y + CELL_SIZE,
+                                            fill=PLACEHOLDER_COLOR, outline="")
+        self.request_decode(path)
+        return item
+
+    # 解码
+
+    def request_decode(self, path):
+        if not HAS_PIL or path in self.pending or path in self.failed:
+            return
+        self.pending.add(path)
+        self.get_executor().submit(self._decode, path)
+
+    def _decode(self, path):
+        """工作线程：解码缩略图，请求排队期间已滚出可见范围的跳过"""
+        if path not in self.visible:
+            self.post_ui(self._decode_skipped, path)
+            return
+        try:
+            from PIL import Image
+
+            with Image.open(preview_file(path)) as image:
+                # thumbnail 对JPEG使用draft按缩小比例直接解码，不必解出整张大图
+                image.thumbnail((CELL_SIZE, CELL_SIZE))
+                thumbnail = image.convert("RGB")
+        except Exception as e:
+            self.post_ui(self._decode_failed, path, e)
+            return
+        self.post_ui(self._show_thumbnail, path, thumbnail)
+
+    def _decode_skipped(self, path):
+        self.pending.discard(path)
+        # 跳过之后又滚回来了
+        if path in self.visible:
+            self.request_decode(path)
+
+    def _decode_failed(self, path, error):
+        self.pending.discard(path)
+        self.failed.add(path)
+        self.log(f"生成缩略图失败: {str(error)}")
+
+    def _show_thumbnail(self, path, thumbnail):
+        from PIL import ImageTk
+
+        self.pending.discard(path)
+        if self._executor is None:
+            # 面板已关闭
+            return
+        photo = ImageTk.PhotoImage(thumbnail)
+        self.cache.put(path, photo, keep=self.visible)
+        for index, items in self.cells.items():
+            if self.items[index][0] == path:
+                self.canvas.delete(items[0])
+                items[0] = self.draw_image(index, path)
+
+    # 事件
+
+    def on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self.render()
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            step = -1
+        else:
+            step = 1
+        self.canvas.yview_scroll(step * 2, "units")
+        self.render()
+
+    def on_click(self, event):
+        index = self.index_at(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        if index is None:
+            return
+        path, _, prompt = self.items[index]
+        self.detail_label.config(text=f"{prompt}\n{path}")
+
+    def on_double_click(self, event):
+        index = self.index_at(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        if index is None or self.on_open is None:
+            return
+        try:
+            self.on_open(self.items[index][0])
+        except Exception as e:
+            self.log(f"打开图片失败: {str(e)}")
@@ -0,0 +1,785 @@
+# coding:utf-8
+"""
+无界面的图像生成引擎
+
+把提交任务、查询结果、下载图片的流程从 ImageGeneratorGUI 中剥离出来，
+不依赖 Tkinter，可被图形界面和命令行批处理共同复用。
+"""
+import os
+import csv
+import json
+import time
+import random
+import shutil
+import threading
+from concurrent.futures import Future
+
+from generation_pipeline import GenerationPipeline, RESUBMIT
+from task_poller import TaskPoller, TaskPollError, TaskTimeoutError, PollerClosedError
+from render_stats import shared_stats
+from image_downloader import ImageDownloader
+from rate_limiter import ServiceLimiter, ThrottledError, is_throttled, is_throttled_error
+from generation_trace import Tracer
+from request_coalescer import RequestCoalescer
+from credential_pool import Account, AccountError, CredentialPool, account_error
+from cancellation import CancelToken, TaskCancelledError, CANCELLED, DEADLINE_EXCEEDED
+
+# 默认使用的模型
+DEFAULT_REQ_KEY = "jimeng_t2i_v31"
+# 默认随机种子
+DEFAULT_SEED = -5
+
+# 预设比例对应的尺寸（基于1024像素）
+RATIO_DIMENSIONS = {
+    "1:1": (1024, 1024),
+    "2:3": (683, 1024),
+    "4:3": (1024, 768),
+    "9:16": (576, 1024),
+    "16:9": (1024, 576),
+    "16:7": (1024, 448)
+}
+DEFAULT_DIMENSIONS = (1024, 1024)
+MIN_CUSTOM_SIZE = 500
+# 提交被限流后重新提交的最长等待时间（秒）
+MAX_THROTTLE_BACKOFF = 60
+
+
+def default_log(message):
+    """默认日志输出：打印到控制台"""
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", flush=True)
+
+
+def resolve_dimensions(ratio, custom_width=None, custom_height=None):
+    """根据比例（或自定义宽高）返回图片尺寸"""
+    if ratio == "自定义":
+        try:
+            width = max(MIN_CUSTOM_SIZE, int(custom_width))
+            height = max(MIN_CUSTOM_SIZE, int(custom_height))
+            return (width, height)
+        except (TypeError, ValueError):
+            # 如果输入无效，返回默认尺寸
+            return DEFAULT_DIMENSIONS
+    return RATIO_DIMENSIONS.get(ratio, DEFAULT_DIMENSIONS)
+
+
+def build_submit_form(prompt, width, height, seed=DEFAULT_SEED, req_key=DEFAULT_REQ_KEY):
+    """构造提交任务的请求体"""
+    return {
+        "req_key": req_key,
+        "prompt": prompt,
+        "seed": seed,
+        "width": width,
+        "height": height
+    }
+
+
+def build_result_form(task_id, req_key=DEFAULT_REQ_KEY):
+    """构造查询结果的请求体"""
+    return {
+        "req_key": req_key,
+        "task_id": task_id,
+        "req_json": json.dumps({
+            "logo_info": {
+                "add_logo": False,
+                "position": 0,
+                "language": 0,
+                "opacity": 0.3,
+                "logo_text_content": "这里是明水印内容"
+            },
+            "return_url": True
+        })
+    }
+
+
+class GenerationTask:
+    """单个图像生成任务及其执行结果"""
+
+    def __init__(self, prompt, width=1024, height=1024, seed=DEFAULT_SEED,
+                 req_key=DEFAULT_REQ_KEY, task_key=None, save_dir=None, timeout=None):
+        self.task_key = task_key
+        self.prompt = prompt
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.req_key = req_key
+        # 为空时使用引擎的保存目录
+        self.save_dir = save_dir
+        # 任务期限（秒，从开始提交时算起），为空时不限
+        self.timeout = timeout
+        # 取消标记，提交、查询、下载的各个等待点都会检查
+        self.cancel_token = CancelToken()
+
+        # 执行结果
+        self.task_id = None
+        self.status = "queued"
+        self.image_urls = []
+        self.files = []
+        self.error = None
+        self.cached = False
+        # 与同时在途的相同请求合并：leader 为合并到的任务结束时得到该任务的Future
+        self.coalesced = False
+        self.leader = None
+        self.coalesce_key = None
+        # 是否占用着远端并发名额（提交成功后到出图结束前）
+        self.admitted = False
+        # 提交该任务的账号名，查询结果时必须使用同一账号
+        self.account = None
+        # 远端报告任务失败（或查询出错），该task_id不能再查询
+        self.remote_failed = False
+        # 从任务日志恢复（或重试时继续查询）的任务，真实的提交时间未知
+        self.resumed = False
+        self.started_at = None
+        self.finished_at = None
+
+    @classmethod
+    def from_row(cls, row, index):
+        """从清单中的一行（JSON对象或CSV行）构造任务"""
+        # CSV中的空单元格视为未填写
+        row = {k: v for k, v in row.items() if k and v not in (None, "")}
+        prompt = str(row.get("prompt", "")).strip()
+        if not prompt:
+            raise ValueError(f"第{index}行缺少prompt")
+
+        if "width" in row or "height" in row:
+            width, height = resolve_dimensions("自定义", row.get("width", 1024), row.get("height", 1024))
+        else:
+            width, height = resolve_dimensions(row.get("ratio", "1:1"))
+
+        try:
+            seed = int(row.get("seed", DEFAULT_SEED))
+        except ValueError:
+            raise ValueError(f"第{index}行seed无效: {row.get('seed')}")
+
+        timeout = None
+        if "timeout" in row:
+            try:
+                timeout = float(row["timeout"])
+            except (TypeError, ValueError):
+                timeout = 0
+            if not timeout > 0:
+                raise ValueError(f"第{index}行timeout无效: {row['timeout']}")
+
+        return cls(prompt, width, height, seed=seed,
+                   req_key=row.get("req_key", DEFAULT_REQ_KEY),
+                   task_key=str(row.get("id", index)), timeout=timeout)
+
+    def submit_form(self):
+        """返回该任务的提交参数"""
+        return build_submit_form(self.prompt, self.width, self.height, seed=self.seed, req_key=self.req_key)
+
+    def can_reattach(self):
+        """已提交且远端可能仍在处理（或已出图）：重试时应继续查询原来的task_id，不必重新生成"""
+        return bool(self.task_id and self.account and not self.remote_failed and not self.coalesced)
+
+    def reattach(self):
+        """返回继续查询同一task_id的新任务（本任务的取消标记已经用过）"""
+        task = GenerationTask(self.prompt, self.width, self.height, seed=self.seed, req_key=self.req_key,
+                              task_key=self.task_key, save_dir=self.save_dir, timeout=self.timeout)
+        task.task_id = self.task_id
+        task.account = self.account
+        task.image_urls = list(self.image_urls)
+        task.status = "submitted"
+        return task
+
+    def fail(self, error):
+        """标记任务失败"""
+        self.status = "failed"
+        self.error = error
+
+    def cancel(self, reason=CANCELLED):
+        """请求取消任务（可在任意线程调用），任务在下一个检查点结束"""
+        return self.cancel_token.cancel(reason)
+
+    def to_result(self):
+        """转换为结果清单中的一行"""
+        elapsed = None
+        if self.started_at is not None and self.finished_at is not None:
+            elapsed = round(self.finished_at - self.started_at, 3)
+        return {
+            "id": self.task_key,
+            "prompt": self.prompt,
+            "width": self.width,
+            "height": self.height,
+            "seed": self.seed,
+            "req_key": self.req_key,
+            "task_id": self.task_id,
+            "status": self.status,
+            "image_urls": self.image_urls,
+            "files": self.files,
+            "error": self.error,
+            "cached": self.cached,
+            "coalesced": self.coalesced,
+            "elapsed": elapsed
+        }
+
+
+class GenerationEngine:
+    """图像生成引擎：提交任务、查询结果并下载图片"""
+
+    def __init__(self, ak, sk, save_dir="generated_images", max_in_flight=4, log=None,
+                 stats_file="render_stats.json", max_downloads=8, downloads_per_task=4, cache=None,
+                 limiter=None, journal=None, postprocessor=None, tracer=None, coalesce=True, pool=None,
+                 storage=None):
+        self.ak = ak
+        self.sk = sk
+        self.save_dir = save_dir
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.log = log or default_log
+        # 出图耗时统计，决定轮询节奏和超时时间；使用同一文件的引擎共用一个实例
+        self.render_stats = shared_stats(stats_file)
+        # 所有任务共用的下载器（连接池）
+        self.max_downloads = max_downloads
+        self.downloads_per_task = downloads_per_task
+        self._downloader = None
+        # 可选的结果缓存（ResultCache），固定种子的重复请求直接复用本地图片
+        self.cache = cache
+        # 提交/查询限流和远端并发控制
+        self.limiter = limiter or ServiceLimiter(max_concurrency=self.max_in_flight)
+        # 账号池（CredentialPool），未指定时只有 ak/sk 这一个账号
+        self.pool = pool or CredentialPool([Account(None, ak, sk, limiter=self.limiter)])
+        # 可选的任务日志（TaskJournal），用于崩溃后恢复未完成的任务
+        self.journal = journal
+        # 可选的图片后处理（ImagePostProcessor），在进程池中处理下载好的图片
+        self.postprocessor = postprocessor
+        # 各阶段的耗时追踪（Tracer），未指定时只在内存中汇总
+        self.tracer = tracer or Tracer()
+        # 同时在途的相同请求（固定种子）只提交一次
+        self.coalescer = RequestCoalescer() if coalesce else None
+        # 可选的分片存储（OutputStore）：保存目录为其根目录时按哈希分子目录保存并写入索引
+        self.storage = storage
+
+        self._poller = None
+        self._service_lock = threading.Lock()
+
+    def log_message(self, message):
+        """输出日志"""
+        self.log(message)
+
+    def get_visual_service(self):
+        """返回第一个账号的VisualService（同一引擎内复用）"""
+        return self.pool.accounts[0].visual_service()
+
+    def get_downloader(self):
+        """返回引擎共用的下载器"""
+        with self._service_lock:
+            if self._downloader is None:
+                self._downloader = ImageDownloader(max_parallel=self.max_downloads,
+                                                   per_task_parallel=self.downloads_per_task,
+                                                   tracer=self.tracer)
+            return self._downloader
+
+    def download_image(self, url, save_path):
+        """下载图片并保存到本地"""
+        try:
+            self.get_downloader().download(url, save_path)
+            self.log_message(f"图片已保存到: {save_path}")
+            return True
+        except Exception as e:
+            self.log_message(f"下载图片失败: {str(e)}")
+            return False
+
+    def generate_image(self, visual_service, prompt, width, height,
+                       seed=DEFAULT_SEED, req_key=DEFAULT_REQ_KEY, limiter=None, token=None):
+        """提交图像生成任务并返回task_id；limiter 为提交所用账号的限流器
+
+        token（CancelToken）在等待提交令牌期间被取消时抛出TaskCancelledError。
+        """
+        submit_form = build_submit_form(prompt, width, height, seed=seed, req_key=req_key)
+        limiter = limiter or self.limiter
+
+        wait_start = time.monotonic()
+        limiter.submit.acquire(token)
+        rate_wait = time.monotonic() - wait_start
+        self.log_message(f"正在提交图像生成任务... (尺寸: {width}×{height})")
+        try:
+            with self.tracer.span("submit", req_key=req_key, width=width, height=height,
+                                  rate_wait=round(rate_wait, 3)) as span:
+                submit_resp = visual_service.cv_sync2async_submit_task(submit_form)
+                span.set_response(submit_resp)
+                span.set(task_id=(submit_resp.get("data") or {}).get("task_id"))
+        except Exception as e:
+            if is_throttled_error(e):
+                limiter.on_submit_throttled()
+                raise ThrottledError(str(e))
+            reason = account_error(e)
+            if reason:
+                raise AccountError(reason, str(e))
+            raise
+
+        if is_throttled(submit_resp):
+            limiter.on_submit_throttled()
+            raise ThrottledError(json.dumps(submit_resp, ensure_ascii=False))
+        reason = account_error(submit_resp)
+        if reason:
+            raise AccountError(reason, json.dumps(submit_resp, ensure_ascii=False))
+
+        if submit_resp.get("code") != 10000:
+            self.log_message(f"提交任务失败: {json.dumps(submit_resp, ensure_ascii=False)}")
+            return None
+
+        task_id = submit_resp["data"].get("task_id")
+        if not task_id:
+            self.log_message("获取任务ID失败")
+            return None
+
+        limiter.on_submit_success()
+        self.log_message(f"任务已提交，ID: {task_id}")
+        return task_id
+
+    def get_poller(self):
+        """返回引擎共用的任务轮询器"""
+        with self._service_lock:
+            if self._poller is None:
+                self._poller = TaskPoller(log=self.log_message, history=self.render_stats,
+                                          limiter=self.limiter, tracer=self.tracer)
+            return self._poller
+
+    def close(self):
+        """停止轮询线程、关闭下载连接池并保存耗时统计"""
+        with self._service_lock:
+            poller, self._poller = self._poller, None
+            downloader, self._downloader = self._downloader, None
+        if poller is not None:
+            poller.close()
+        if downloader is not None:
+            downloader.close()
+        self.render_stats.save()
+
+    def get_image_result(self, visual_service, task_id, req_key=DEFAULT_REQ_KEY, width=None, height=None):
+        """查询任务结果并返回图片URL列表"""
+        future = self.get_poller().watch(visual_service, task_id, build_result_form(task_id, req_key),
+                                         req_key, width, height)
+        try:
+            return future.result()
+        except TaskPollError:
+            # 失败原因已由轮询器记录到日志
+            return []
+
+    def submit_task(self, task):
+        """流水线第一段：提交任务，需要继续查询时返回True（命中缓存时直接完成）"""
+        token = task.cancel_token
+        if task.started_at is None:
+            task.started_at = time.time()
+            if task.timeout and token.deadline is None:
+                token.set_timeout(task.timeout)
+        if token.cancelled:
+            return self._cancel_task(task)
+        if task.task_id:
+            # 从任务日志恢复的任务已经提交过，直接进入查询（必须使用提交时的账号）
+            if task.account not in self.pool:
+                self.log_message(f"任务 {task.task_id} 的账号 {task.account} 不在账号池中，改用其他账号查询")
+                task.account = None
+            try:
+                task.account = self.pool.acquire(task.account, token=token).name
+            except TaskCancelledError:
+                return self._cancel_task(task)
+            except Exception as e:
+                return self._abort_task(task, e)
+            task.admitted = True
+            task.resumed = True
+            task.status = "submitted"
+            self.log_message(f"恢复任务 {task.task_id}")
+            return True
+        try:
+            if self.cache is not None and self._load_from_cache(task):
+                return False
+            if self._join_leader(task):
+                return True
+            throttled = 0
+            while True:
+                # 选一个账号并占用它的远端并发名额，出图结束（或提交失败）后归还
+                wait_start = time.monotonic()
+                account = self.pool.acquire(token=token)
+                task.account = account.name
+                task.admitted = True
+                self.tracer.record("admission", time.monotonic() - wait_start, task_key=task.task_key,
+                                   account=account.name, retries=throttled)
+                try:
+                    task.task_id = self.generate_image(account.visual_service(), task.prompt, task.width,
+                                                       task.height, seed=task.seed, req_key=task.req_key,
+                                                       limiter=account.limiter, token=token)
+                    if task.task_id:
+                        account.submitted += 1
+                    break
+                except AccountError as e:
+                    # 账号不可用：暂停该账号，换其他账号重新提交
+                    self._release_admission(task)
+                    cooldown = self.pool.mark_unhealthy(account, e.reason, e)
+                    self.log_message(f"账号 {account.name} 不可用，暂停{cooldown / 60:.0f}分钟: {str(e)}")
+                except ThrottledError:
+                    # 被限流的任务稍后重新提交，不会丢失
+                    self._release_admission(task)
+                    throttled += 1
+                    delay = random.uniform(0.5, 1.0) * min(MAX_THROTTLE_BACKOFF, 2 ** throttled)
+                    self.log_message(f"提交被限流，{delay:.1f}秒后重新提交")
+                    if token.wait(delay):
+                        return self._cancel_task(task)
+        except TaskCancelledError:
+            self._release_admission(task)
+            return self._cancel_task(task)
+        except Exception as e:
+            self._release_admission(task)
+            return self._abort_task(task, e)
+
+        if not task.task_id:
+            self._release_admission(task)
+            return self._finish_task(task, "提交任务失败")
+        if token.cancelled:
+            # 提交请求进行中被取消：远端已经开始处理，但不再查询和下载
+            self._release_admission(task)
+            return self._cancel_task(task)
+        task.status = "submitted"
+        self._write_journal("record_submitted", task, self.task_save_dir(task))
+        return True
+
+    def task_save_dir(self, task):
+        """返回任务的保存目录"""
+        return task.save_dir or self.save_dir
+
+    def _task_storage(self, task):
+        """任务保存目录对应的分片存储，没有时返回None（平铺保存）"""
+        if self.storage is not None and os.path.realpath(self.task_save_dir(task)) == self.storage.root:
+            return self.storage
+        return None
+
+    def image_path(self, task, idx):
+        """任务第idx张图片的保存路径"""
+        storage = self._task_storage(task)
+        if storage is not None:
+            return storage.image_path(task.task_id, idx)
+        return os.path.join(self.task_save_dir(task), f"{task.task_id}_{idx}.jpg")
+
+    def _write_journal(self, method, task, *args):
+        """写任务日志，失败只记录不影响任务"""
+        if self.journal is None:
+            return
+        try:
+            getattr(self.journal, method)(task, *args)
+        except Exception as e:
+            self.log_message(f"写入任务日志失败: {str(e)}")
+
+    def _release_admission(self, task):
+        """归还任务占用的远端并发名额"""
+        if task.admitted:
+            task.admitted = False
+            self.pool.release(self.pool.get(task.account))
+
+    def _join_leader(self, task):
+        """已有相同请求在途时合并过去并返回True，否则本任务作为leader继续提交"""
+        if self.coalescer is None:
+            return False
+        key = self.coalescer.key_for(task.submit_form(), self.task_save_dir(task))
+        if key is None:
+            return False
+        future, is_leader = self.coalescer.join(key)
+        if is_leader:
+            task.coalesce_key = key
+            return False
+        task.leader = future
+        task.status = "submitted"
+        self.log_message("已有相同的请求在处理，等待其结果")
+        return True
+
+    def _adopt_result(self, task, leader):
+        """合并的任务直接使用leader的结果，不再单独查询和下载"""
+        task.task_id = leader.task_id
+        task.image_urls = list(leader.image_urls)
+        task.files = list(leader.files)
+        task.coalesced = True
+        if leader.status == "done":
+            task.status = "done"
+            task.error = leader.error
+        else:
+            task.fail(leader.error or "合并的请求失败")
+        task.finished_at = time.time()
+        if task.started_at is not None:
+            self.tracer.record("task", task.finished_at - task.started_at,
+                               "ok" if task.status == "done" else "error", task_id=task.task_id,
+                               task_key=task.task_key, coalesced=True, images=len(task.files))
+        return False
+
+    def _rejoin(self, task, done):
+        """合并的leader被取消：交回调用方重新提交"""
+        task.leader = None
+        self.log_message("合并的请求已取消，重新提交")
+        done.set_result(RESUBMIT)
+
+    def _load_from_cache(self, task):
+        """尝试从缓存取得结果，命中时把图片放到保存目录并完成任务"""
+        hit = self.cache.lookup(task.submit_form())
+        if hit is None:
+            return False
+
+        task.task_id, blob_paths = hit
+        os.makedirs(self.task_save_dir(task), exist_ok=True)
+        for idx, blob_path in enumerate(blob_paths):
+            save_path = self.image_path(task, idx)
+            if not os.path.exists(save_path):
+                shutil.copyfile(blob_path, save_path)
+            task.files.append(save_path)
+        task.cached = True
+        self.log_message(f"命中缓存，复用任务 {task.task_id} 的{len(task.files)}张图片")
+        return self._finish_task(task)
+
+    def watch_task(self, task):
+        """流水线第二段：把任务交给轮询器，返回完成时得到True/False的Future
+
+        合并的任务在leader被取消时得到RESUBMIT：它的请求仍然有效，需要重新调用
+        submit_task（第一个重新提交的成为新的leader）。
+        """
+        done = Future()
+        if task.leader is not None:
+            # 合并的任务：leader结束时一并结束，不需要进入下载阶段；自身被取消或到期时立即结束
+            settled = threading.Lock()
+            token = task.cancel_token
+            timer = None
+
+            def settle(finish):
+                if not settled.acquire(blocking=False):
+                    return
+                # 任务已结束：停止计时器，撤销取消回调
+                if timer is not None:
+                    timer.cancel()
+                token.remove_callback(on_cancel)
+                finish()
+
+            def on_cancel():
+                settle(lambda: done.set_result(self._cancel_task(task)))
+
+            if token.deadline is not None:
+                # 合并的任务不经过轮询器，由计时器在到期时取消（计时器可能略早于期限触发，直接取消）
+                timer = threading.Timer(token.remaining(), token.cancel, (DEADLINE_EXCEEDED,))
+                timer.daemon = True
+                timer.start()
+
+            def on_leader(future):
+                leader = future.result()
+                if leader is None:
+                    settle(lambda: self._rejoin(task, done))
+                else:
+                    settle(lambda: done.set_result(self._adopt_result(task, leader)))
+
+            token.add_callback(on_cancel)
+            task.leader.add_done_callback(on_leader)
+            return done
+
+        def on_result(future):
+            # 远端已出图（或失败），不再占用并发名额
+            self._release_admission(task)
+            failed = False
+            try:
+                task.image_urls = future.result()
+            except TaskCancelledError:
+                done.set_result(self._cancel_task(task))
+                return
+            except PollerClosedError as e:
+                # 程序正在退出，不是远端失败：日志中的记录保持已提交，下次启动时恢复
+                done.set_result(self._finish_task(task, str(e)))
+                return
+            except TaskTimeoutError:
+                # 远端可能仍在处理，保留日志中的记录以便之后恢复
+                pass
+            except TaskPollError:
+                failed = True
+                task.remote_failed = True
+            except Exception as e:
+                done.set_result(self._abort_task(task, e))
+                return
+            # 恢复的任务重新查询失败时，沿用日志中记下的图片URL
+            if not task.image_urls:
+                passed = self._finish_task(task, "未获取到图片URL或任务失败")
+                if failed:
+                    self._write_journal("record_failed", task)
+                done.set_result(passed)
+            else:
+                self._write_journal("record_done", task)
+                done.set_result(True)
+
+        try:
+            account = self.pool.get(task.account)
+            future = self.get_poller().watch(account.visual_service(), task.task_id,
+                                             build_result_form(task.task_id, task.req_key),
+                                             task.req_key, task.width, task.height,
+                                             limiter=account.limiter, token=task.cancel_token,
+                                             resumed=task.resumed)
+        except Exception as e:
+            self._release_admission(task)
+            done.set_result(self._abort_task(task, e))
+            return done
+        future.add_done_callback(on_result)
+        return done
+
+    def poll_task(self, task):
+        """等待任务完成并取得图片URL，成功返回True"""
+        while True:
+            passed = self.watch_task(task).result()
+            if passed is not RESUBMIT:
+                return passed
+            # 合并的leader被取消：在当前线程重新提交
+            if not self.submit_task(task):
+                return False
+
+    def download_task(self, task):
+        """流水线第三段：下载任务的全部图片"""
+        token = task.cancel_token
+        if token.cancelled:
+            return self._cancel_task(task)
+        try:
+            os.makedirs(self.task_save_dir(task), exist_ok=True)
+            items = [(url, self.image_path(task, idx)) for idx, url in enumerate(task.image_urls)]
+            self.log_message(f"正在下载任务 {task.task_id} 的{len(items)}张图片")
+            with self.tracer.span("download_task", task_id=task.task_id, images=len(items)) as span:
+                results = self.get_downloader().download_all(items, token=token)
+                span.set(bytes=sum(r for r in results if not isinstance(r, Exception)),
+                         failed=sum(1 for r in results if isinstance(r, Exception)))
+            if token.cancelled:
+                return self._cancel_task(task)
+            for (url, save_path), result in zip(items, results):
+                if isinstance(result, Exception):
+                    self.log_message(f"下载图片失败: {str(result)}")
+                else:
+                    self.log_message(f"图片已保存到: {save_path}")
+                    task.files.append(save_path)
+        except Exception as e:
+            return self._abort_task(task, e)
+
+        if len(task.files) == len(task.image_urls):
+            self._write_journal("record_downloaded", task)
+            return self._finish_task(task, cacheable=True)
+        if task.files:
+            task.error = f"部分图片下载失败({len(task.files)}/{len(task.image_urls)})"
+            return self._finish_task(task)
+        return self._finish_task(task, "图片下载失败")
+
+    def _store_in_cache(self, task):
+        """把完整下载的结果存入缓存，失败不影响任务本身"""
+        if self.cache is None:
+            return
+        try:
+            self.cache.store(task.submit_form(), task.task_id, task.files)
+        except Exception as e:
+            self.log_message(f"写入缓存失败: {str(e)}")
+
+    def _finish_task(self, task, error=None, cancelled=False, cacheable=False):
+        """结束任务，error为空表示成功；cancelled表示任务因取消或到期结束，
+        cacheable表示图片已完整下载，可以存入缓存
+        """
+        if error:
+            task.fail(error)
+            if cancelled:
+                task.status = "cancelled"
+        else:
+            task.status = "done"
+            self._post_process(task, cacheable)
+        task.finished_at = time.time()
+        if task.status == "done":
+            self._index_task(task)
+        if task.started_at is not None:
+            self.tracer.record("task", task.finished_at - task.started_at,
+                               "ok" if error is None else "error", task_id=task.task_id,
+                               task_key=task.task_key, cached=task.cached, images=len(task.files))
+        if task.coalesce_key is not None:
+            # 唤醒等待该结果的相同请求
+            key, task.coalesce_key = task.coalesce_key, None
+            self.coalescer.finish(key, task)
+        return error is None
+
+    def _index_task(self, task):
+        """把完成的任务写入分片存储的索引，失败不影响任务本身"""
+        storage = self._task_storage(task)
+        if storage is None or not task.files:
+            return
+        try:
+            storage.record(task)
+        except Exception as e:
+            self.log_message(f"写入图片索引失败: {str(e)}")
+
+    def _post_process(self, task, cacheable=False):
+        """把图片交给后处理进程池，不等待处理结果
+
+        后处理会改写原图（重新压缩、写入元数据）时，等处理完再存入缓存，缓存中的
+        内容与保存的图片一致；命中缓存的图片已经处理过，不再改写，只生成派生文件。
+        """
+        if self.postprocessor is None or not task.files:
+            if cacheable:
+                self._store_in_cache(task)
+            return
+        on_done = None
+        if cacheable:
+            if self.postprocessor.config.rewrites_original():
+                on_done = self._store_in_cache
+            else:
+                self._store_in_cache(task)
+        try:
+            self.postprocessor.submit(task, on_done=on_done, rewrite=not task.cached)
+        except Exception as e:
+            self.log_message(f"提交图片后处理失败: {str(e)}")
+
+    def _cancel_task(self, task):
+        """任务被取消或超过期限：结束任务，已提交的不再从任务日志恢复"""
+        reason = task.cancel_token.reason
+        self.log_message(f"任务 {task.task_id} {reason}" if task.task_id else f"任务{reason}")
+        passed = self._finish_task(task, reason, cancelled=True)
+        if task.task_id:
+            self._write_journal("record_failed", task)
+        return passed
+
+    def _abort_task(self, task, exc):
+        """任务因异常中止"""
+        self.log_message(f"生成过程中发生错误: {str(exc)}")
+        return self._finish_task(task, str(exc))
+
+    def run_task(self, task):
+        """在当前线程中依次执行提交、查询、下载"""
+        if self.submit_task(task) and self.poll_task(task):
+            self.download_task(task)
+        return task
+
+    def run_batch(self, tasks, submit_workers=None, download_workers=None, queue_size=None):
+        """以流水线方式并发执行一批任务，按完成顺序逐个返回
+
+        同时在途的任务不超过max_in_flight个；等待出图的任务由轮询器统一
+        查询，不占用工作线程，提交和下载阶段的线程数默认按其比例分配。
+        """
+        pipeline = GenerationPipeline(
+            self,
+            max_in_flight=self.max_in_flight,
+            submit_workers=submit_workers or max(1, min(8, self.max_in_flight // 4)),
+            download_workers=download_workers or max(1, min(16, self.max_in_flight // 2)),
+            queue_size=queue_size or min(self.max_in_flight, 64)
+        )
+        return pipeline.run(tasks)
+
+
+def load_manifest(path):
+    """逐行读取JSONL或CSV格式的提示词清单，返回任务生成器"""
+    is_csv = os.path.splitext(path)[1].lower() == ".csv"
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if is_csv:
+            for index, row in enumerate(csv.DictReader(f), 1):
+                yield GenerationTask.from_row(row, index)
+        else:
+            for index, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"第{index}行不是有效的JSON: {e}")
+                yield GenerationTask.from_row(row, index)
+
+
+def write_results_manifest(path, results):
+    """把任务结果逐行写入JSONL结果清单，返回(成功数, 失败数)"""
+    succeeded = 0
+    failed = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for task in results:
+            f.write(json.dumps(task.to_result(), ensure_ascii=False) + "\n")
+            # 及时落盘，进程中断时已完成的结果不会丢失
+            f.flush()
+            if task.status == "done":
+                succeeded += 1
+            else:
+                failed += 1
+    return succeeded, failed
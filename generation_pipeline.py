@@ -0,0 +1,192 @@
+# coding:utf-8
+"""
+提交 / 查询 / 下载 三段式流水线
+
+提交和下载阶段各有独立的工作线程，阶段之间用有界队列连接：下游处理不过来时，
+上游往队列里放任务会被阻塞（背压）。查询阶段交给多路复用的轮询器，等待出图的
+任务不占用工作线程。整条流水线中同时在途的任务数受 max_in_flight 限制，远端
+出图的等待时间与先完成任务的本地下载可以互相重叠。
+"""
+import queue
+import threading
+
+# 队列结束标记
+_STOP = object()
+# 查询阶段的结果：合并到的leader被取消，任务交回提交阶段重新提交
+RESUBMIT = object()
+
+
+class ResultSink:
+    """流水线的出口：收集完成的任务并归还在途名额"""
+
+    def __init__(self, slots):
+        self.queue = queue.Queue()
+        self.slots = slots
+
+    def put(self, task):
+        self.queue.put(task)
+        self.slots.release()
+
+    def close(self):
+        self.queue.put(_STOP)
+
+
+class PipelineStage:
+    """流水线中的一个阶段：从输入队列取任务，处理成功交给下一阶段，否则直接产出结果"""
+
+    def __init__(self, name, handler, workers, queue_size, results, downstream=None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.inbox = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.results = results
+        self.downstream = downstream
+
+        self._alive = self.workers
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动本阶段的工作线程"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-{i}")
+            thread.daemon = True
+            thread.start()
+
+    def put(self, task):
+        """放入一个任务，队列已满时阻塞"""
+        self.inbox.put(task)
+
+    def close(self):
+        """通知本阶段的所有工作线程：不会再有新任务"""
+        for _ in range(self.workers):
+            self.inbox.put(_STOP)
+
+    def _worker(self):
+        try:
+            while True:
+                task = self.inbox.get()
+                if task is _STOP:
+                    break
+                try:
+                    passed = self.handler(task)
+                except Exception as e:
+                    task.fail(str(e))
+                    passed = False
+
+                if passed and self.downstream is not None:
+                    # 下游队列已满时在这里阻塞，形成背压
+                    self.downstream.put(task)
+                else:
+                    self.results.put(task)
+        finally:
+            with self._lock:
+                self._alive -= 1
+                last = self._alive == 0
+            # 最后一个退出的线程负责关闭下游
+            if last:
+                (self.downstream or self.results).close()
+
+
+class PollStage:
+    """查询阶段：把任务登记到轮询器，完成后由回调交给下一阶段"""
+
+    def __init__(self, watch, results, downstream, upstream=None):
+        self.watch = watch
+        self.results = results
+        self.downstream = downstream
+        # 提交阶段，需要重新提交的任务交回这里
+        self.upstream = upstream
+
+        self._outstanding = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def put(self, task):
+        with self._lock:
+            self._outstanding += 1
+        self.watch(task).add_done_callback(lambda future: self._on_done(task, future))
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            finished = self._outstanding == 0
+        if finished:
+            self.downstream.close()
+
+    def _on_done(self, task, future):
+        try:
+            passed = future.result()
+        except Exception as e:
+            task.fail(str(e))
+            passed = False
+        # 在途名额保证上下游队列不会满，这里不会阻塞轮询线程
+        if passed is RESUBMIT:
+            self.upstream.put(task)
+        elif passed:
+            self.downstream.put(task)
+        else:
+            self.results.put(task)
+
+        with self._lock:
+            self._outstanding -= 1
+            finished = self._closed and self._outstanding == 0
+        if finished:
+            self.downstream.close()
+
+
+class GenerationPipeline:
+    """把GenerationEngine的三个阶段串成流水线"""
+
+    def __init__(self, engine, max_in_flight=4, submit_workers=1, download_workers=2, queue_size=4):
+        self.engine = engine
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.submit_workers = submit_workers
+        self.download_workers = download_workers
+        self.queue_size = queue_size
+
+    def run(self, tasks):
+        """执行任务（可以是惰性生成器），按完成顺序逐个返回"""
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        results = ResultSink(slots)
+        # 下载队列容量不小于在途上限，轮询回调放入任务时不会阻塞
+        download_stage = PipelineStage("download", self.engine.download_task, self.download_workers,
+                                       max(self.queue_size, self.max_in_flight), results)
+        poll_stage = PollStage(self.engine.watch_task, results, download_stage)
+        # 查询阶段会把任务交回提交阶段，容量同样不小于在途上限
+        submit_stage = PipelineStage("submit", self.engine.submit_task, self.submit_workers,
+                                     max(self.queue_size, self.max_in_flight), results, poll_stage)
+        poll_stage.upstream = submit_stage
+
+        feed_error = []
+
+        def feed():
+            try:
+                for task in tasks:
+                    # 在途任务达到上限时等待，清单只会被按需读取
+                    slots.acquire()
+                    submit_stage.put(task)
+            except Exception as e:
+                feed_error.append(e)
+            finally:
+                # 等在途任务全部结束再关闭提交阶段：之前任务可能还会被交回重新提交
+                for _ in range(self.max_in_flight):
+                    slots.acquire()
+                submit_stage.close()
+
+        for stage in (download_stage, poll_stage, submit_stage):
+            stage.start()
+        feeder = threading.Thread(target=feed, name="feed")
+        feeder.daemon = True
+        feeder.start()
+
+        while True:
+            task = results.queue.get()
+            if task is _STOP:
+                break
+            yield task
+
+        if feed_error:
+            raise feed_error[0]
@@ -0,0 +1,574 @@
+# coding:utf-8
+"""
+本地HTTP/JSON生成服务
+
+其他程序可以通过HTTP接口提交生成任务，多个客户端共用一个常驻进程（同一个
+GenerationEngine：账号池、限流器、轮询线程和下载连接池）。接口提交的任务
+依次送入一条长期运行的 run_batch 流水线，同时在途的任务数、提交和下载线程
+数都有上限；等待开始的任务最多 --max-queue 个，队列满时返回503。
+
+接口:
+    POST /api/tasks                    提交任务，请求体与批量清单的一行相同，例如
+                                       {"prompt": "...", "ratio": "16:9", "seed": 42}，可用
+                                       "timeout" 指定任务期限（秒）；也可以是JSON数组，
+                                       一次提交多个。返回202和任务id
+    DELETE /api/tasks/<id>             取消任务：停止查询和下载，释放并发名额
+    GET  /api/tasks/<id>?wait=N        任务状态；wait>0 时最多等待N秒直到任务结束（长轮询）
+    GET  /api/tasks/<id>/result?wait=N 任务结果：结束时返回200，否则等待最多N秒（默认30）后返回202
+    GET  /api/tasks/<id>/events        以 server-sent events 推送状态变化，结束时发送 done 事件
+    GET  /api/status                   服务状态：队列长度、在途任务数、各账号限流状态
+    GET  /api/history?q=猫&limit=50     按提示词搜索已完成的任务（保存目录的索引，最近的在前）
+    GET  /files/<路径>                 直接读取保存目录中的图片（结果中的 file_urls），其他文件返回404
+
+指定 --token 后每个请求都需要 Authorization: Bearer <token>（或 ?token=）。
+
+用法:
+    python generation_server.py --port 8765 -c 8
+"""
+import os
+import sys
+import json
+import hmac
+import math
+import time
+import uuid
+import queue
+import shutil
+import argparse
+import mimetypes
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote, quote
+
+from generation_engine import GenerationEngine, GenerationTask, RATIO_DIMENSIONS, MIN_CUSTOM_SIZE, DEFAULT_SEED
+from batch_generate import load_config, resolve_accounts, build_pool
+from result_cache import ResultCache
+from task_journal import TaskJournal
+from output_store import OutputStore, IMAGE_SUFFIXES
+from config_store import apply_profile
+
+# 长轮询的最长等待时间（秒）
+MAX_WAIT = 60.0
+DEFAULT_RESULT_WAIT = 30.0
+# 没有状态变化时检查任务状态的间隔，以及server-sent events的心跳间隔（秒）
+STATUS_CHECK_INTERVAL = 0.5
+SSE_HEARTBEAT = 15.0
+# 请求体大小上限
+MAX_BODY = 1024 * 1024
+# 一次最多提交的任务数
+MAX_BATCH = 100
+# 历史记录一次最多返回的条数
+MAX_HISTORY = 500
+# 接口接受的自定义边长、种子（-1为随机）和任务期限（秒）的范围
+MAX_CUSTOM_SIZE = 2048
+MIN_SEED = min(-1, DEFAULT_SEED)
+MAX_SEED = 2 ** 31 - 1
+MAX_TASK_TIMEOUT = 24 * 3600
+
+_STOP = object()
+
+
+def is_inside(path, directory):
+    """path 是否位于 directory 之中（两者都应为realpath）"""
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        # Windows 上不在同一个盘符
+        return False
+
+
+def validate_row(row, index):
+    """检查接口提交的一行参数的类型，无效时抛出ValueError
+
+    批量清单中的值可以是字符串（CSV），接口只接受明确的类型；未知的比例和非整数的
+    宽高直接拒绝，不回退到默认尺寸。
+    """
+    if not isinstance(row, dict):
+        raise ValueError(f"第{index}个任务应为JSON对象")
+    for key in ("prompt", "req_key"):
+        if row.get(key) is not None and not isinstance(row[key], str):
+            raise ValueError(f"第{index}个任务的{key}应为字符串")
+    ratio = row.get("ratio")
+    if ratio is not None and not (isinstance(ratio, str) and ratio in RATIO_DIMENSIONS):
+        raise ValueError(f"第{index}个任务的ratio无效，可选: {', '.join(RATIO_DIMENSIONS)}")
+    bounds = {"width": (MIN_CUSTOM_SIZE, MAX_CUSTOM_SIZE), "height": (MIN_CUSTOM_SIZE, MAX_CUSTOM_SIZE),
+              "seed": (MIN_SEED, MAX_SEED)}
+    for key, (low, high) in bounds.items():
+        value = row.get(key)
+        # bool 是 int 的子类，单独排除
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)
+                                  or not low <= value <= high):
+            raise ValueError(f"第{index}个任务的{key}应为{low}到{high}之间的整数")
+    timeout = row.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                                or not math.isfinite(timeout) or not 0 < timeout <= MAX_TASK_TIMEOUT):
+        raise ValueError(f"第{index}个任务的timeout应为0到{MAX_TASK_TIMEOUT}之间的秒数")
+
+
+class QueueFullError(Exception):
+    """等待开始的任务已达上限"""
+
+
+class ServerJob:
+    """通过接口提交的一个任务"""
+
+    def __init__(self, job_id, task):
+        self.job_id = job_id
+        self.task = task
+        self.created_at = time.time()
+        self.finished = False
+
+
+class GenerationService:
+    """把接口提交的任务送入一条长期运行的流水线，并记录任务状态供查询"""
+
+    def __init__(self, engine, max_queue=1000, keep_finished=10000,
+                 submit_workers=None, download_workers=None, queue_size=None):
+        self.engine = engine
+        self.keep_finished = keep_finished
+        self.pipeline_options = {"submit_workers": submit_workers, "download_workers": download_workers,
+                                 "queue_size": queue_size}
+        self.submitted = 0
+        self.completed = 0
+
+        # 流水线按在途名额从这里取任务，队列满时拒绝新任务
+        self._inbox = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._jobs = {}
+        # 已结束的任务按结束顺序保留，超过 keep_finished 个时丢弃最早的
+        self._finished = deque()
+        self._cond = threading.Condition()
+        self._consumer = None
+        self._stopping = False
+
+    def start(self):
+        self._consumer = threading.Thread(target=self._consume, name="service-pipeline")
+        self._consumer.daemon = True
+        self._consumer.start()
+        return self
+
+    def _consume(self):
+        tasks = iter(self._inbox.get, _STOP)
+        for task in self.engine.run_batch(tasks, **self.pipeline_options):
+            self._on_finished(task)
+
+    def _on_finished(self, task):
+        with self._cond:
+            job = self._jobs.get(task.task_key)
+            if job is not None:
+                job.finished = True
+                self._finished.append(job.job_id)
+            self.completed += 1
+            while len(self._finished) > self.keep_finished:
+                self._jobs.pop(self._finished.popleft(), None)
+            self._cond.notify_all()
+
+    def submit(self, row, index=1):
+        """由请求中的一行参数（第index个）创建任务并排队，返回ServerJob
+
+        参数无效时抛出ValueError，队列已满时抛出QueueFullError。
+        """
+        validate_row(row, index)
+        job_id = uuid.uuid4().hex
+        # 任务id由服务生成；保存目录固定为服务的保存目录
+        row = {k: v for k, v in row.items() if k not in ("id", "save_dir")}
+        task = GenerationTask.from_row(row, index)
+        task.task_key = job_id
+        job = ServerJob(job_id, task)
+        with self._cond:
+            if self._stopping:
+                raise QueueFullError("服务正在停止")
+            try:
+                self._inbox.put_nowait(task)
+            except queue.Full:
+                raise QueueFullError("等待中的任务太多，请稍后重试")
+            self._jobs[job_id] = job
+            self.submitted += 1
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout, last_status=None):
+        """等待任务结束或状态不再是last_status，最多timeout秒；返回任务是否已结束"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not job.finished:
+                if last_status is not None and job.task.status != last_status:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # 中间状态的变化没有通知，定期检查
+                self._cond.wait(min(remaining, STATUS_CHECK_INTERVAL) if last_status is not None else remaining)
+            return job.finished
+
+    def stop(self):
+        """不再接受新任务；排队中的任务直接标记失败，等待在途任务结束"""
+        with self._cond:
+            self._stopping = True
+        while True:
+            try:
+                task = self._inbox.get_nowait()
+            except queue.Empty:
+                break
+            task.fail("服务已停止")
+            self._on_finished(task)
+        self._inbox.put(_STOP)
+        if self._consumer is not None:
+            self._consumer.join()
+
+    def stats(self):
+        with self._cond:
+            jobs = len(self._jobs)
+            finished = len(self._finished)
+        return {
+            "queued": self._inbox.qsize(),
+            "in_progress": jobs - finished - self._inbox.qsize(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "coalesced": self.engine.coalescer.coalesced if self.engine.coalescer is not None else 0,
+            "accounts": self.engine.pool.stats()
+        }
+
+
+class GenerationServer(ThreadingHTTPServer):
+    """生成服务的HTTP接口"""
+
+    daemon_threads = True
+
+    def __init__(self, service, save_dir, host="127.0.0.1", port=8765, token=None, storage=None):
+        super().__init__((host, port), _ServiceHandler)
+        self.service = service
+        self.save_dir = os.path.realpath(save_dir)
+        self.token = token
+        self.storage = storage
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def job_json(self, job):
+        """任务状态和结果；图片同时给出本地路径和可以直接下载的URL"""
+        result = job.task.to_result()
+        result["finished"] = job.finished
+        result["file_urls"] = [url for url in (self.file_url(path) for path in result["files"]) if url]
+        return result
+
+    def history_json(self, row):
+        result = dict(row)
+        result["file_urls"] = [url for url in (self.file_url(path) for path in row["files"]) if url]
+        return result
+
+    def file_url(self, path):
+        """保存目录中文件的下载路径，不在保存目录中时返回None"""
+        path = os.path.realpath(path)
+        if not is_inside(path, self.save_dir):
+            return None
+        relative = os.path.relpath(path, self.save_dir).replace(os.sep, "/")
+        return "/files/" + quote(relative)
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    # 保持连接，客户端可以复用同一个连接发送多个请求
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_error_json(self, status, message, headers=None):
+        self.send_json(status, {"error": message}, headers)
+
+    def authorized(self, query):
+        token = self.server.token
+        if not token:
+            return True
+        header = self.headers.get("Authorization", "")
+        supplied = header[len("Bearer "):] if header.startswith("Bearer ") else query.get("token", [""])[0]
+        return hmac.compare_digest(supplied.encode("utf-8"), token.encode("utf-8"))
+
+    def parse(self):
+        """返回 (路径各段, 查询参数)，未授权时返回None"""
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if not self.authorized(query):
+            self.send_error_json(401, "未授权")
+            return None
+        return [unquote(part) for part in url.path.split("/") if part], query
+
+    def wait_param(self, query, default):
+        try:
+            return min(MAX_WAIT, max(0.0, float(query.get("wait", [default])[0])))
+        except ValueError:
+            return default
+
+    def do_POST(self):
+        parsed = self.parse()
+        if parsed is None:
+            return
+        parts, _ = parsed
+        if parts != ["api", "tasks"]:
+            self.send_error_json(404, "未知的接口")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # 无法确定请求体的边界，连接上的后续数据不可信
+            self.close_connection = True
+            self.send_error_json(400, "Content-Length无效")
+            return
+        if length > MAX_BODY:
+            self.close_connection = True
+            self.send_error_json(413, "请求体太大")
+            return
+        try:
+            data = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as e:
+            self.send_error_json(400, f"请求体不是有效的JSON: {e}")
+            return
+
+        rows = data if isinstance(data, list) else [data]
+        if not rows or len(rows) > MAX_BATCH:
+            self.send_error_json(400, f"一次提交1到{MAX_BATCH}个任务")
+            return
+        jobs = []
+        try:
+            for index, row in enumerate(rows, 1):
+                jobs.append(self.server.service.submit(row, index))
+        except ValueError as e:
+            # 已排队的任务照常执行，返回中列出
+            self.send_json(400, {"error": str(e), "accepted": [self.server.job_json(job) for job in jobs]})
+            return
+        except QueueFullError as e:
+            self.send_json(503, {"error": str(e), "accepted": [self.server.job_json(job) for job in jobs]},
+                           headers={"Retry-After": "5"})
+            return
+        results = [self.server.job_json(job) for job in jobs]
+        self.send_json(202, results if isinstance(data, list) else results[0])
+
+    def do_GET(self):
+        parsed = self.parse()
+        if parsed is None:
+            return
+        parts, query = parsed
+        service = self.server.service
+
+        if parts == ["api", "status"]:
+            self.send_json(200, service.stats())
+            return
+        if parts == ["api", "history"]:
+            self.send_history(query)
+            return
+        if parts and parts[0] == "files":
+            self.send_file(parts[1:])
+            return
+        if len(parts) < 3 or parts[:2] != ["api", "tasks"] or len(parts) > 4:
+            self.send_error_json(404, "未知的接口")
+            return
+
+        job = service.get(parts[2])
+        if job is None:
+            self.send_error_json(404, "任务不存在或已过期")
+            return
+        action = parts[3] if len(parts) == 4 else None
+        if action is None:
+            wait = self.wait_param(query, 0.0)
+            if wait:
+                service.wait(job, wait)
+            self.send_json(200, self.server.job_json(job))
+        elif action == "result":
+            finished = service.wait(job, self.wait_param(query, DEFAULT_RESULT_WAIT))
+            self.send_json(200 if finished else 202, self.server.job_json(job))
+        elif action == "events":
+            self.send_events(job)
+        else:
+            self.send_error_json(404, "未知的接口")
+
+    def send_history(self, query):
+        storage = self.server.storage
+        if storage is None:
+            self.send_error_json(404, "服务未启用保存目录索引（--flat）")
+            return
+        try:
+            limit = min(MAX_HISTORY, max(1, int(query.get("limit", ["50"])[0])))
+            offset = max(0, int(query.get("offset", ["0"])[0]))
+        except ValueError:
+            self.send_error_json(400, "limit和offset应为整数")
+            return
+        rows = storage.search(query.get("q", [""])[0], limit=limit, offset=offset)
+        self.send_json(200, [self.server.history_json(row) for row in rows])
+
+    def do_DELETE(self):
+        parsed = self.parse()
+        if parsed is None:
+            return
+        parts, _ = parsed
+        if len(parts) != 3 or parts[:2] != ["api", "tasks"]:
+            self.send_error_json(404, "未知的接口")
+            return
+        job = self.server.service.get(parts[2])
+        if job is None:
+            self.send_error_json(404, "任务不存在或已过期")
+            return
+        # 已结束的任务取消无效果；未结束的在下一个检查点结束
+        job.task.cancel()
+        self.send_json(202, self.server.job_json(job))
+
+    def send_events(self, job):
+        """server-sent events：状态变化时发送 status 事件，任务结束时发送 done 事件后关闭"""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        service = self.server.service
+        last_status = None
+        last_sent = time.monotonic()
+        try:
+            while True:
+                finished = job.finished
+                status = job.task.status
+                if finished or status != last_status:
+                    event = "done" if finished else "status"
+                    data = json.dumps(self.server.job_json(job), ensure_ascii=False)
+                    self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    last_status = status
+                    last_sent = time.monotonic()
+                    if finished:
+                        return
+                elif time.monotonic() - last_sent >= SSE_HEARTBEAT:
+                    # 注释行作为心跳，防止中间代理断开空闲连接
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+                    last_sent = time.monotonic()
+                service.wait(job, SSE_HEARTBEAT, last_status=status)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开，任务继续执行
+            pass
+
+    def send_file(self, parts):
+        """读取保存目录中的图片，不允许访问目录之外的路径和图片以外的文件（如索引数据库）"""
+        save_dir = self.server.save_dir
+        path = os.path.realpath(os.path.join(save_dir, *parts))
+        if (not parts or not path.lower().endswith(IMAGE_SUFFIXES) or not is_inside(path, save_dir)
+                or not os.path.isfile(path)):
+            self.send_error_json(404, "文件不存在")
+            return
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        with open(path, 'rb') as f:
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            # 文件名包含task_id，内容不会改变
+            self.send_header("Cache-Control", "max-age=86400")
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI图像生成HTTP服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    parser.add_argument("--token", default=os.environ.get("JIMENG_SERVER_TOKEN"),
+                        help="访问令牌（默认读取环境变量JIMENG_SERVER_TOKEN，为空时不校验）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="每个账号同时在途（等待出图）的任务数")
+    parser.add_argument("--max-queue", type=int, default=1000, help="等待开始的任务数上限，超过时返回503")
+    parser.add_argument("--keep-finished", type=int, default=10000, help="保留可查询的已结束任务数")
+    parser.add_argument("--submit-workers", type=int, help="提交阶段的线程数")
+    parser.add_argument("--download-workers", type=int, help="下载阶段的线程数")
+    parser.add_argument("--max-downloads", type=int, default=8, help="所有任务合计同时下载的图片数")
+    parser.add_argument("--downloads-per-task", type=int, default=4, help="单个任务同时下载的图片数")
+    parser.add_argument("--save-dir", help="图片保存目录（默认使用配置文件中的目录）")
+    parser.add_argument("--flat", action="store_true", help="图片平铺保存在保存目录中（不分片、不写索引）")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--profile", help="使用配置文件中该名称的配置方案（密钥、保存目录等）")
+    parser.add_argument("--stats-file", default="render_stats.json", help="出图耗时统计文件")
+    parser.add_argument("--submit-qps", type=float, default=2.0, help="提交接口的QPS上限")
+    parser.add_argument("--poll-qps", type=float, default=10.0, help="查询接口的QPS上限")
+    parser.add_argument("--cache-dir", default="image_cache", help="结果缓存目录（仅缓存固定种子的任务）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用结果缓存")
+    parser.add_argument("--journal", default="task_journal.sqlite3", help="任务日志文件")
+    parser.add_argument("--accounts", help="多账号列表（JSON数组，每项含name/ak/sk，可选max_concurrency）")
+    parser.add_argument("--ak", help="Access Key（默认读取环境变量VOLC_ACCESSKEY或配置文件）")
+    parser.add_argument("--sk", help="Secret Key（默认读取环境变量VOLC_SECRETKEY或配置文件）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = load_config(args.config)
+    if args.profile:
+        try:
+            config = apply_profile(config, args.profile)
+        except ValueError as e:
+            print(f"错误: {e}")
+            return 2
+    try:
+        account_list = resolve_accounts(args, config)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 2
+
+    save_dir = args.save_dir or config.get("save_dir", "generated_images")
+    os.makedirs(save_dir, exist_ok=True)
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    journal = TaskJournal(args.journal)
+    storage = None if args.flat else OutputStore(save_dir)
+    pool, max_in_flight = build_pool(account_list, args.submit_qps, args.poll_qps, args.concurrency)
+    engine = GenerationEngine(pool.accounts[0].ak, pool.accounts[0].sk, save_dir=save_dir,
+                              max_in_flight=max_in_flight, stats_file=args.stats_file,
+                              max_downloads=args.max_downloads,
+                              downloads_per_task=args.downloads_per_task, cache=cache,
+                              limiter=pool.accounts[0].limiter, journal=journal, pool=pool,
+                              storage=storage)
+    service = GenerationService(engine, max_queue=args.max_queue, keep_finished=args.keep_finished,
+                                submit_workers=args.submit_workers,
+                                download_workers=args.download_workers).start()
+    try:
+        server = GenerationServer(service, save_dir, host=args.host, port=args.port, token=args.token,
+                                  storage=storage)
+    except OSError as e:
+        print(f"错误: 无法监听 {args.host}:{args.port}: {e}")
+        service.stop()
+        engine.close()
+        journal.close()
+        if storage is not None:
+            storage.close()
+        return 2
+
+    print(f"生成服务已启动: {server.endpoint}（保存目录: {os.path.abspath(save_dir)}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("正在停止：不再接受新任务，等待在途任务结束（再按Ctrl+C强制退出）")
+    finally:
+        server.server_close()
+        service.stop()
+        engine.close()
+        if cache is not None:
+            cache.close()
+        journal.close()
+        if storage is not None:
+            storage.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+# coding:utf-8
+"""
+生成过程各阶段的结构化追踪与指标
+
+每次提交、查询、下载都记录为一个span事件（单调时钟计时，附带字节数、重试
+次数、状态码等），可选地逐行写入JSONL文件。同时在内存中按阶段汇总：
+    admission    等待远端并发名额
+    submit       提交请求（含令牌桶等待 rate_wait）
+    poll         单次查询请求
+    remote       远端排队+生成耗时（按两次查询的中点估计）
+    poll_slack   远端完成到被查询发现之间的空等时间
+    download     单张图片下载
+    download_task  一个任务全部图片的下载
+    task         任务从开始到结束的总耗时
+汇总结果可输出为 p50/p95/p99 报告，或Prometheus文本格式（可通过HTTP暴露）。
+
+用法（根据已有的追踪文件输出报告）：
+    python generation_trace.py trace.jsonl
+"""
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from collections import deque
+
+from render_stats import quantile
+
+# 每个阶段保留用于计算分位数的样本数
+WINDOW = 10000
+# Prometheus 直方图的桶（秒）
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+# 这些数值属性会按阶段累加为计数器
+SUMMED_ATTRS = ("bytes", "retries")
+METRIC_PREFIX = "jimeng"
+
+_STOP = object()
+
+
+class Span:
+    """一个阶段的计时；用作上下文管理器，退出时记录"""
+
+    def __init__(self, tracer, phase, attrs):
+        self.tracer = tracer
+        self.phase = phase
+        self.attrs = attrs
+        self.status = "ok"
+        self.start_time = time.time()
+        self._start = time.monotonic()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error):
+        self.status = "error"
+        self.attrs["error"] = str(error)
+
+    def set_response(self, resp):
+        """记录接口返回的code和任务状态，code不为10000时记为失败"""
+        if not isinstance(resp, dict):
+            return
+        code = resp.get("code")
+        self.attrs["code"] = code
+        status = (resp.get("data") or {}).get("status")
+        if status:
+            self.attrs["remote_status"] = status
+        if code != 10000:
+            self.fail(resp.get("message") or code)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.status == "ok":
+            self.fail(f"{exc_type.__name__}: {exc}")
+        self.tracer.emit(self.phase, time.monotonic() - self._start, self.status,
+                         self.start_time, self.attrs)
+        return False
+
+
+class _PhaseStats:
+    """单个阶段的汇总：直方图、计数器和最近的样本"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.sums = dict.fromkeys(SUMMED_ATTRS, 0)
+        self.samples = deque(maxlen=WINDOW)
+
+    def add(self, duration, status, attrs):
+        self.count += 1
+        self.total += duration
+        if status != "ok":
+            self.errors += 1
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+        for name in SUMMED_ATTRS:
+            value = attrs.get(name)
+            if isinstance(value, (int, float)):
+                self.sums[name] += value
+        self.samples.append(duration)
+
+
+class Tracer:
+    """记录span事件；path为None时只在内存中汇总，不写文件"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._queue = None
+        self._writer = None
+        if path:
+            # 写文件放在后台线程，追踪不会拖慢请求线程
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._write_loop, name="trace-writer")
+            self._writer.daemon = True
+            self._writer.start()
+
+    def span(self, phase, **attrs):
+        """开始一个span：with tracer.span("submit", task_id=...) as span: ..."""
+        return Span(self, phase, attrs)
+
+    def record(self, phase, duration, status="ok", **attrs):
+        """记录在别处测得的耗时"""
+        self.emit(phase, duration, status, time.time() - duration, attrs)
+
+    def emit(self, phase, duration, status, start_time, attrs):
+        with self._lock:
+            stats = self._phases.get(phase)
+            if stats is None:
+                stats = self._phases[phase] = _PhaseStats()
+            stats.add(duration, status, attrs)
+        if self._queue is not None:
+            event = {"ts": round(start_time, 3), "phase": phase,
+                     "duration": round(duration, 4), "status": status}
+            event.update(attrs)
+            self._queue.put(event)
+
+    def _write_loop(self):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            while True:
+                event = self._queue.get()
+                if event is _STOP:
+                    return
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+                # 队列空了才刷新，突发时合并写入
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self):
+        """写完剩余事件并关闭文件"""
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+
+    def summary(self):
+        """按阶段返回次数、错误数和 p50/p95/p99"""
+        with self._lock:
+            phases = {name: (stats.count, stats.errors, stats.total, sorted(stats.samples), dict(stats.sums))
+                      for name, stats in self._phases.items()}
+        return {name: summarize(samples, count, errors, total, sums)
+                for name, (count, errors, total, samples, sums) in phases.items()}
+
+    def format_summary(self):
+        return format_summary(self.summary())
+
+    def prometheus_text(self):
+        """Prometheus 文本格式的指标"""
+        with self._lock:
+            phases = sorted((name, stats.count, stats.errors, stats.total, list(stats.buckets), dict(stats.sums))
+                            for name, stats in self._phases.items())
+
+        lines = [f"# HELP {METRIC_PREFIX}_phase_duration_seconds 各阶段耗时",
+                 f"# TYPE {METRIC_PREFIX}_phase_duration_seconds histogram"]
+        for name, count, _, total, buckets, _ in phases:
+            for bound, value in zip(BUCKETS, buckets):
+                lines.append(f'{METRIC_PREFIX}_phase_duration_seconds_bucket{{phase="{name}",le="{bound}"}} {value}')
+            lines.append(f'{METRIC_PREFIX}_phase_duration_seconds_bucket{{phase="{name}",le="+Inf"}} {count}')
+            lines.append(f'{METRIC_PREFIX}_phase_duration_seconds_sum{{phase="{name}"}} {total:.6f}')
+            lines.append(f'{METRIC_PREFIX}_phase_duration_seconds_count{{phase="{name}"}} {count}')
+
+        lines += [f"# HELP {METRIC_PREFIX}_phase_errors_total 各阶段失败次数",
+                  f"# TYPE {METRIC_PREFIX}_phase_errors_total counter"]
+        for name, _, errors, _, _, _ in phases:
+            lines.append(f'{METRIC_PREFIX}_phase_errors_total{{phase="{name}"}} {errors}')
+        for attr in SUMMED_ATTRS:
+            lines += [f"# HELP {METRIC_PREFIX}_phase_{attr}_total 各阶段累计的{attr}",
+                      f"# TYPE {METRIC_PREFIX}_phase_{attr}_total counter"]
+            for name, _, _, _, _, sums in phases:
+                if sums[attr]:
+                    lines.append(f'{METRIC_PREFIX}_phase_{attr}_total{{phase="{name}"}} {sums[attr]}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """写入文本文件（供 node_exporter 的 textfile collector 读取）"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def summarize(samples, count=None, errors=0, total=None, sums=None):
+    """由已排序的样本计算汇总"""
+    count = len(samples) if count is None else count
+    total = sum(samples) if total is None else total
+    result = {
+        "count": count,
+        "errors": errors,
+        "mean": round(total / count, 3) if count else None,
+        "p50": quantile(samples, 0.5),
+        "p95": quantile(samples, 0.95),
+        "p99": quantile(samples, 0.99)
+    }
+    for name, value in (sums or {}).items():
+        if value:
+            result[name] = value
+    return result
+
+
+def format_summary(summary):
+    """把汇总格式化为表格文本"""
+    lines = [f"{'阶段':<12}{'次数':>8}{'失败':>6}{'平均':>9}{'p50':>9}{'p95':>9}{'p99':>9}"]
+    for name in sorted(summary):
+        row = summary[name]
+        cells = [f"{row[k]:.3f}" if row[k] is not None else "-" for k in ("mean", "p50", "p95", "p99")]
+        lines.append(f"{name:<12}{row['count']:>8}{row['errors']:>6}" + "".join(f"{c:>9}" for c in cells))
+    return "\n".join(lines)
+
+
+def summarize_file(path):
+    """读取JSONL追踪文件并按阶段汇总"""
+    durations = {}
+    errors = {}
+    sums = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            phase = event.get("phase")
+            durations.setdefault(phase, []).append(float(event.get("duration", 0)))
+            if event.get("status") != "ok":
+                errors[phase] = errors.get(phase, 0) + 1
+            phase_sums = sums.setdefault(phase, dict.fromkeys(SUMMED_ATTRS, 0))
+            for name in SUMMED_ATTRS:
+                if isinstance(event.get(name), (int, float)):
+                    phase_sums[name] += event[name]
+    return {phase: summarize(sorted(values), errors=errors.get(phase, 0), sums=sums[phase])
+            for phase, values in durations.items()}
+
+
+class MetricsServer:
+    """在 /metrics 上以Prometheus文本格式暴露指标；http.server 在start时才导入"""
+
+    def __init__(self, tracer, host="127.0.0.1", port=9464):
+        self.tracer = tracer
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer((self.host, self.port), _metrics_handler(self.tracer))
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics-server")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _metrics_handler(tracer):
+    """返回输出该tracer指标的请求处理类"""
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            data = tracer.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return MetricsHandler
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print("用法: python generation_trace.py trace.jsonl")
+        return 2
+    print(format_summary(summarize_file(argv[0])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
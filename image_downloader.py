@@ -0,0 +1,191 @@
+# coding:utf-8
+"""
+流式图片下载器
+
+所有下载共用一个有容量上限的连接池（复用TCP/TLS连接），响应按块直接写入
+临时文件，完成后原子替换为目标文件，内存占用与图片大小无关。中断的下载
+会通过Range请求续传，失败时按带随机抖动的指数退避重试。任务被取消（CancelToken）时
+在下一个数据块处停止并删除临时文件，等待中的图片不再下载。
+requests 在第一次下载时才导入并创建连接池，不拖慢程序启动。
+"""
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from generation_trace import Tracer
+from cancellation import TaskCancelledError
+
+# 未完成下载的临时文件后缀
+PART_SUFFIX = ".part"
+# 这些状态码可以重试，其余4xx直接失败
+RETRY_STATUS = {408, 429}
+# 任务被取消时，download_all 检查取消的间隔（秒）
+CANCEL_CHECK_INTERVAL = 0.5
+
+
+class DownloadError(Exception):
+    """重试后仍然下载失败"""
+
+
+class ImageDownloader:
+    """共享连接池的图片下载器，可被多个任务并发使用"""
+
+    def __init__(self, max_parallel=8, per_task_parallel=4, max_retries=3,
+                 chunk_size=64 * 1024, timeout=(10, 60), backoff=0.5, max_backoff=10.0, tracer=None):
+        self.max_parallel = max(1, int(max_parallel))
+        self.per_task_parallel = max(1, int(per_task_parallel))
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tracer = tracer or Tracer()
+
+        self._session = None
+
+        # 全局并发上限：所有任务的下载共用这些线程
+        self._executor = ThreadPoolExecutor(max_workers=self.max_parallel,
+                                            thread_name_prefix="download")
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def close(self):
+        """关闭连接池和下载线程"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        if self._session is not None:
+            self._session.close()
+
+    @property
+    def session(self):
+        """共享的requests会话，第一次使用时创建"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                # 连接池大小与全局并发数一致，池满时等待空闲连接而不是新建
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_parallel, pool_block=True)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def download(self, url, save_path, token=None):
+        """下载单个文件，返回写入的字节数
+
+        重试后仍失败时抛出DownloadError；token（CancelToken）被取消时删除临时文件
+        并抛出TaskCancelledError。
+        """
+        import requests
+        with self.tracer.span("download", path=os.path.basename(save_path)) as span:
+            attempt = 0
+            while True:
+                span.set(retries=attempt)
+                try:
+                    written = self._download_once(url, save_path, span, token)
+                    span.set(bytes=written)
+                    return written
+                except TaskCancelledError:
+                    part_path = save_path + PART_SUFFIX
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                except requests.HTTPError as e:
+                    status = e.response.status_code if e.response is not None else None
+                    if status is not None and status < 500 and status not in RETRY_STATUS:
+                        raise DownloadError(f"HTTP {status}: {url}")
+                    error = e
+                except (requests.RequestException, OSError) as e:
+                    error = e
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise DownloadError(str(error))
+                # 指数退避 + 完全随机抖动，避免大量下载同时重试
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+                if token is None:
+                    time.sleep(delay)
+                elif token.wait(delay):
+                    raise TaskCancelledError(token.reason)
+
+    def download_all(self, items, token=None):
+        """并发下载一个任务的多张图片
+
+        items 为 [(url, save_path), ...]，返回与之一一对应的结果列表，
+        每项为写入的字节数或失败时的DownloadError。同一任务最多同时下载
+        per_task_parallel 张，所有任务合计不超过 max_parallel 张。
+        token（CancelToken）被取消时立即返回，未完成的各项为TaskCancelledError，
+        进行中的下载在下一个数据块处自行停止。
+        """
+        results = [None] * len(items)
+        pending = {}
+        queue = list(enumerate(items))
+        queue.reverse()
+
+        while queue or pending:
+            if token is not None and token.cancelled:
+                error = TaskCancelledError(token.reason)
+                for index in list(pending.values()) + [index for index, _ in queue]:
+                    results[index] = error
+                break
+            while queue and len(pending) < self.per_task_parallel:
+                index, (url, save_path) = queue.pop()
+                pending[self._executor.submit(self.download, url, save_path, token)] = index
+            done, _ = wait(pending, timeout=CANCEL_CHECK_INTERVAL if token is not None else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    results[index] = future.result()
+                except TaskCancelledError as e:
+                    results[index] = e
+                except Exception as e:
+                    results[index] = e if isinstance(e, DownloadError) else DownloadError(str(e))
+        return results
+
+    def _download_once(self, url, save_path, span, token=None):
+        """发起一次请求；已有部分内容时用Range续传"""
+        part_path = save_path + PART_SUFFIX
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            span.set(http_status=response.status_code, resumed=offset)
+            if offset and response.status_code == 416:
+                # 服务器不接受该范围（文件可能已变化），丢弃临时文件重新下载
+                os.remove(part_path)
+                raise OSError("续传范围无效，重新下载")
+            response.raise_for_status()
+
+            if offset and response.status_code == 206:
+                mode = 'ab'
+            else:
+                # 服务器忽略了Range，从头写入
+                mode = 'wb'
+                offset = 0
+
+            expected = None
+            if not response.headers.get("Content-Encoding"):
+                expected = response.headers.get("Content-Length")
+            received = 0
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    if token is not None and token.cancelled:
+                        raise TaskCancelledError(token.reason)
+                    if chunk:
+                        f.write(chunk)
+                        received += len(chunk)
+
+        if expected is not None and received != int(expected):
+            # 连接提前断开，保留临时文件，下次从断点续传
+            raise OSError(f"下载不完整: {received}/{expected} 字节")
+
+        os.replace(part_path, save_path)
+        return offset + received
@@ -1,24 +1,51 @@
 # coding:utf-8
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, filedialog
+from tkinter import ttk, scrolledtext, messagebox, filedialog, simpledialog
 import threading
 import os
-import json
 import time
-import requests
+import sys
+import queue
 import base64
-from volcengine import visual
-from volcengine.visual.VisualService import VisualService
+import subprocess
+
+from generation_engine import GenerationEngine, resolve_dimensions, RATIO_DIMENSIONS
+from job_panel import JobQueuePanel, MAX_JOBS
+from task_journal import TaskJournal
+from config_store import ConfigStore, ACTIVE_PROFILE_KEY
+from output_store import OutputStore
+from gallery_panel import GalleryPanel
+
+# 界面刷新间隔（毫秒），工作线程的消息按帧合并后再更新界面
+UI_FRAME_MS = 50
+# 状态信息最多保留的行数
+MAX_LOG_LINES = 1000
+# 启动耗时探测（见 bench_startup.py）：设置为文件路径时，窗口首次显示后写入时间戳并退出
+STARTUP_PROBE_ENV = "JIMENG_STARTUP_PROBE"
+# 历史记录窗口一次显示的条数
+HISTORY_LIMIT = 200
+
+
+def open_path(path):
+    """用系统默认程序打开文件"""
+    if sys.platform == "win32":
+        os.startfile(path)
+    elif sys.platform == "darwin":
+        subprocess.Popen(["open", path])
+    else:
+        subprocess.Popen(["xdg-open", path])
 
 class ImageGeneratorGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("AI图像生成器")
-        self.root.geometry("800x600")
+        self.root.geometry("900x800")
         self.root.resizable(True, True)
         
         # 配置文件路径
         self.config_file = "config.json"
+        # 任务日志路径：记录已提交的任务，程序意外退出后可以继续下载
+        self.journal_file = "task_journal.sqlite3"
         
         # 配置变量
         self.ak = tk.StringVar()
@@ -28,13 +55,30 @@ class ImageGeneratorGUI:
         self.custom_width = tk.StringVar(value="1024")
         self.custom_height = tk.StringVar(value="1024")
         
+        # 工作线程发往界面的消息队列，只在主线程中消费
+        self.ui_queue = queue.Queue()
+        
+        # 按密钥和保存目录复用的生成引擎，多个任务共用轮询和下载线程
+        self.engines = {}
+        self.engines_lock = threading.Lock()
+        # 每个保存目录的分片存储和索引（同一目录的引擎共用）
+        self.stores = {}
+        self.journal = TaskJournal(self.journal_file)
+        
         # 默认提示词
         self.default_prompt = "标题：试错，副标题：才是产品经理的常态，特写：一个产品经理正在思考那些犯过的错，背景：各种PPT、图表、报表，要求：背景模糊处理，标题清晰醒目，用海报设计字体"
         
-        # 加载保存的配置
+        # 加载保存的配置（只在启动时读取一次，之后的修改由后台线程合并写入）
+        self.config_store = ConfigStore(self.config_file)
         self.load_config()
+        for var in (self.ak, self.sk, self.save_dir, self.aspect_ratio, self.custom_width, self.custom_height):
+            var.trace_add("write", lambda *args: self.save_config())
         
         self.setup_ui()
+        self.root.after(UI_FRAME_MS, self.pump_ui_queue)
+        
+        # 恢复上次未完成的任务
+        self.resume_unfinished_jobs()
         
         # 程序关闭时保存配置
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -61,89 +105,105 @@ class ImageGeneratorGUI:
     
     def load_config(self):
         """从配置文件加载设置"""
-        try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                
-                # 解密并设置API密钥
-                if 'ak' in config:
-                    self.ak.set(self.simple_decrypt(config['ak']))
-                if 'sk' in config:
-                    self.sk.set(self.simple_decrypt(config['sk']))
-                
-                # 设置保存目录
-                if 'save_dir' in config:
-                    self.save_dir.set(config['save_dir'])
-                
-                # 设置图片比例
-                if 'aspect_ratio' in config:
-                    self.aspect_ratio.set(config['aspect_ratio'])
-                if 'custom_width' in config:
-                    self.custom_width.set(config['custom_width'])
-                if 'custom_height' in config:
-                    self.custom_height.set(config['custom_height'])
-                    
-                print("配置加载成功")
-        except Exception as e:
-            print(f"加载配置失败: {e}")
+        config = self.config_store.snapshot()
+        if config:
+            self.apply_settings(config)
+            print("配置加载成功")
     
-    def save_config(self):
-        """保存设置到配置文件"""
-        try:
-            config = {
-                'ak': self.simple_encrypt(self.ak.get()),
-                'sk': self.simple_encrypt(self.sk.get()),
-                'save_dir': self.save_dir.get(),
-                'aspect_ratio': self.aspect_ratio.get(),
-                'custom_width': self.custom_width.get(),
-                'custom_height': self.custom_height.get()
-            }
-            
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-                
-            print("配置保存成功")
-        except Exception as e:
-            print(f"保存配置失败: {e}")
+    def apply_settings(self, config):
+        """把配置（或方案）中的设置填入界面"""
+        # 解密并设置API密钥
+        if 'ak' in config:
+            self.ak.set(self.simple_decrypt(config['ak']))
+        if 'sk' in config:
+            self.sk.set(self.simple_decrypt(config['sk']))
+        
+        # 设置保存目录
+        if 'save_dir' in config:
+            self.save_dir.set(config['save_dir'])
+        
+        # 设置图片比例
+        if 'aspect_ratio' in config:
+            self.aspect_ratio.set(config['aspect_ratio'])
+        if 'custom_width' in config:
+            self.custom_width.set(config['custom_width'])
+        if 'custom_height' in config:
+            self.custom_height.set(config['custom_height'])
+    
+    def current_settings(self):
+        """界面上当前的设置（密钥以Base64保存）"""
+        return {
+            'ak': self.simple_encrypt(self.ak.get()),
+            'sk': self.simple_encrypt(self.sk.get()),
+            'save_dir': self.save_dir.get(),
+            'aspect_ratio': self.aspect_ratio.get(),
+            'custom_width': self.custom_width.get(),
+            'custom_height': self.custom_height.get()
+        }
+    
+    def save_config(self, immediate=False):
+        """保存设置：只更新内存中的配置，由后台线程合并后写入文件"""
+        self.config_store.update(self.current_settings(), immediate=immediate)
+    
+    def on_profile_selected(self):
+        """切换配置方案"""
+        name = self.profile_name.get()
+        profile = self.config_store.get_profile(name)
+        if profile is None:
+            return
+        self.apply_settings(profile)
+        self.on_aspect_ratio_change()
+        self.config_store.update({ACTIVE_PROFILE_KEY: name})
+        self.log_message(f"已切换到配置方案: {name}")
+    
+    def save_profile(self):
+        """把当前设置保存为命名方案"""
+        name = simpledialog.askstring("保存配置方案", "方案名称:", initialvalue=self.profile_name.get(),
+                                      parent=self.root)
+        if not name or not name.strip():
+            return
+        name = name.strip()
+        self.config_store.save_profile(name, self.current_settings())
+        self.profile_combo.configure(values=self.config_store.profile_names())
+        self.profile_name.set(name)
+        self.log_message(f"已保存配置方案: {name}")
+    
+    def delete_profile(self):
+        """删除当前选择的方案"""
+        name = self.profile_name.get()
+        if not name or not messagebox.askyesno("删除配置方案", f"确定删除方案“{name}”吗？"):
+            return
+        self.config_store.delete_profile(name)
+        self.profile_combo.configure(values=self.config_store.profile_names())
+        self.profile_name.set("")
     
     def on_closing(self):
         """程序关闭时的处理"""
         self.save_config()
+        self.config_store.close()
+        self.gallery.close()
+        with self.engines_lock:
+            engines = list(self.engines.values())
+            self.engines.clear()
+            stores = list(self.stores.values())
+            self.stores.clear()
+        for engine in engines:
+            engine.close()
+        for store in stores:
+            store.close()
+        self.journal.close()
         self.root.destroy()
     
     def browse_directory(self):
         """浏览并选择保存目录"""
         directory = filedialog.askdirectory(initialdir=self.save_dir.get())
         if directory:
+            # 目录改变时自动保存配置（变量的写入回调）
             self.save_dir.set(directory)
-            # 目录改变时自动保存配置
-            self.save_config()
     
     def get_image_dimensions(self):
         """根据选择的比例返回图片尺寸"""
-        ratio = self.aspect_ratio.get()
-        
-        # 预设比例对应的尺寸（基于1024像素）
-        ratio_dimensions = {
-            "1:1": (1024, 1024),
-            "2:3": (683, 1024),
-            "4:3": (1024, 768),
-            "9:16": (576, 1024),
-            "16:9": (1024, 576),
-            "16:7": (1024, 448)
-        }
-        
-        if ratio == "自定义":
-            try:
-                width = max(500, int(self.custom_width.get()))
-                height = max(500, int(self.custom_height.get()))
-                return (width, height)
-            except ValueError:
-                # 如果输入无效，返回默认尺寸
-                return (1024, 1024)
-        else:
-            return ratio_dimensions.get(ratio, (1024, 1024))
+        return resolve_dimensions(self.aspect_ratio.get(), self.custom_width.get(), self.custom_height.get())
     
     def on_aspect_ratio_change(self):
         """比例选择改变时的处理"""
@@ -156,13 +216,20 @@ class ImageGeneratorGUI:
         width, height = self.get_image_dimensions()
         self.dimension_label.config(text=f"图片尺寸: {width} × {height}")
         
-        # 自动保存配置
-        self.save_config()
-        
     def setup_ui(self):
+        # 两个标签页：生成、图库
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        
         # 创建主框架
-        main_frame = ttk.Frame(self.root, padding="10")
-        main_frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        main_frame = ttk.Frame(self.notebook, padding="10")
+        self.notebook.add(main_frame, text="生成")
+        
+        # 图库：保存目录中的图片缩略图，切换到该页时刷新
+        self.gallery = GalleryPanel(self.notebook, self.get_store, self.save_dir.get, self.post_ui,
+                                    self.log_message, on_open=open_path)
+        self.notebook.add(self.gallery, text="图库")
+        self.notebook.bind('<<NotebookTabChanged>>', lambda e: self.on_tab_changed())
         
         # 配置网格权重
         self.root.columnconfigure(0, weight=1)
@@ -193,9 +260,21 @@ class ImageGeneratorGUI:
         
         ttk.Button(dir_frame, text="浏览", command=self.browse_directory).grid(row=0, column=1)
         
-        # 保存配置按钮
-        save_config_btn = ttk.Button(config_frame, text="保存配置", command=self.save_config)
-        save_config_btn.grid(row=3, column=1, sticky=tk.E, pady=(10, 0))
+        # 配置方案：保存和切换多组密钥、比例、目录设置
+        ttk.Label(config_frame, text="配置方案:").grid(row=3, column=0, sticky=tk.W, padx=(0, 5), pady=(10, 0))
+        profile_frame = ttk.Frame(config_frame)
+        profile_frame.grid(row=3, column=1, sticky=(tk.W, tk.E), pady=(10, 0))
+        self.profile_name = tk.StringVar(value=self.config_store.get(ACTIVE_PROFILE_KEY, ""))
+        self.profile_combo = ttk.Combobox(profile_frame, textvariable=self.profile_name,
+                                          values=self.config_store.profile_names(), state="readonly", width=15)
+        self.profile_combo.pack(side=tk.LEFT)
+        self.profile_combo.bind('<<ComboboxSelected>>', lambda e: self.on_profile_selected())
+        ttk.Button(profile_frame, text="保存为方案", command=self.save_profile).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(profile_frame, text="删除方案", command=self.delete_profile).pack(side=tk.LEFT, padx=(5, 0))
+        
+        # 保存配置按钮（立即写入文件）
+        save_config_btn = ttk.Button(profile_frame, text="保存配置", command=lambda: self.save_config(immediate=True))
+        save_config_btn.pack(side=tk.RIGHT, padx=(0, 10))
         
         # 图片比例设置区域
         ratio_frame = ttk.LabelFrame(main_frame, text="图片比例设置", padding="10")
@@ -255,26 +334,39 @@ class ImageGeneratorGUI:
         self.prompt_text.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         self.prompt_text.insert(tk.END, self.default_prompt)
         
-        # 生成按钮
-        self.generate_button = ttk.Button(main_frame, text="生成图像", command=self.start_generation)
-        self.generate_button.grid(row=3, column=0, columnspan=2, pady=(0, 10))
+        # 生成按钮（每次点击加入一个任务，不必等待上一个完成）
+        generate_frame = ttk.Frame(main_frame)
+        generate_frame.grid(row=3, column=0, columnspan=2, pady=(0, 10))
+        self.generate_button = ttk.Button(generate_frame, text="生成图像", command=self.start_generation)
+        self.generate_button.pack(side=tk.LEFT)
+        # 同一提示词按每个预设比例各加入一个任务
+        ttk.Button(generate_frame, text="全部比例各生成一张",
+                   command=self.start_ratio_sweep).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(generate_frame, text="历史记录", command=self.show_history).pack(side=tk.LEFT, padx=(10, 0))
         
         # 进度条
         self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
+        self.progress_running = False
         self.progress.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 10))
         
+        # 任务队列
+        self.job_panel = JobQueuePanel(main_frame, self.get_engine, self.post_ui, self.log_message,
+                                       on_busy_change=self.on_jobs_busy_change)
+        self.job_panel.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
+        
         # 状态显示区域
         status_frame = ttk.LabelFrame(main_frame, text="状态信息", padding="10")
-        status_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
+        status_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
         status_frame.columnconfigure(0, weight=1)
         status_frame.rowconfigure(0, weight=1)
         
-        self.status_text = scrolledtext.ScrolledText(status_frame, height=10, wrap=tk.WORD, state=tk.DISABLED)
+        self.status_text = scrolledtext.ScrolledText(status_frame, height=8, wrap=tk.WORD, state=tk.DISABLED)
         self.status_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # 配置主框架的行权重
         main_frame.rowconfigure(2, weight=1)
         main_frame.rowconfigure(5, weight=1)
+        main_frame.rowconfigure(6, weight=1)
         
     def load_default_prompt(self):
         """加载默认提示词"""
@@ -295,179 +387,242 @@ class ImageGeneratorGUI:
             # 如果输入无效，显示默认值
             self.dimension_label.config(text="图片尺寸: 请输入有效数值")
         
-        # 延迟保存配置，避免频繁保存
-        self.root.after(1000, self.save_config)
-        
     def log_message(self, message):
-        """在状态文本框中显示消息"""
+        """在状态文本框中显示消息（可在任意线程调用）"""
+        self.ui_queue.put(("log", f"[{time.strftime('%H:%M:%S')}] {message}\n"))
+        
+    def post_ui(self, func, *args):
+        """让主线程执行界面操作（可在任意线程调用）"""
+        self.ui_queue.put(("call", func, args))
+        
+    def pump_ui_queue(self):
+        """每帧取出队列中的全部消息，日志合并为一次插入"""
+        lines = []
+        try:
+            while True:
+                item = self.ui_queue.get_nowait()
+                if item[0] == "log":
+                    lines.append(item[1])
+                else:
+                    # 先输出之前的日志，保持消息顺序
+                    self.append_log_lines(lines)
+                    lines = []
+                    item[1](*item[2])
+        except queue.Empty:
+            pass
+        finally:
+            self.append_log_lines(lines)
+            self.root.after(UI_FRAME_MS, self.pump_ui_queue)
+        
+    def append_log_lines(self, lines):
+        """把多行日志一次性写入状态文本框，只保留最近MAX_LOG_LINES行"""
+        if not lines:
+            return
         self.status_text.config(state=tk.NORMAL)
-        self.status_text.insert(tk.END, f"[{time.strftime('%H:%M:%S')}] {message}\n")
+        self.status_text.insert(tk.END, "".join(lines[-MAX_LOG_LINES:]))
+        line_count = int(self.status_text.index('end-1c').split('.')[0])
+        if line_count > MAX_LOG_LINES:
+            self.status_text.delete(1.0, f"{line_count - MAX_LOG_LINES + 1}.0")
         self.status_text.see(tk.END)
         self.status_text.config(state=tk.DISABLED)
-        self.root.update()
         
-    def download_image(self, url, save_path):
-        """下载图片并保存到本地"""
+    def get_engine(self, ak, sk, save_dir):
+        """返回（必要时创建）对应密钥和保存目录的生成引擎（可在任意线程调用）"""
+        key = (ak, sk, save_dir)
+        with self.engines_lock:
+            engine = self.engines.get(key)
+            if engine is None:
+                # 同时运行的任务数由队列面板控制，引擎的在途名额按面板的上限创建
+                engine = GenerationEngine(ak, sk, save_dir=save_dir, max_in_flight=MAX_JOBS,
+                                          log=self.log_message, journal=self.journal,
+                                          storage=self._get_store(save_dir))
+                self.engines[key] = engine
+            return engine
+    
+    def _get_store(self, save_dir):
+        """（持有engines_lock时调用）返回保存目录的存储，必要时创建"""
+        key = os.path.realpath(save_dir)
+        store = self.stores.get(key)
+        if store is None:
+            store = OutputStore(save_dir)
+            self.stores[key] = store
+        return store
+    
+    def get_store(self, save_dir):
+        with self.engines_lock:
+            return self._get_store(save_dir)
+    
+    def on_tab_changed(self):
+        if self.notebook.select() == str(self.gallery):
+            self.gallery.refresh()
+    
+    def show_history(self):
+        """按提示词搜索当前保存目录中已完成的任务，双击打开图片"""
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
-            self.log_message(f"图片已保存到: {save_path}")
-            return True
+            store = self.get_store(self.save_dir.get())
         except Exception as e:
-            self.log_message(f"下载图片失败: {str(e)}")
-            return False
-            
-    def generate_image(self, visual_service, prompt):
-        """提交图像生成任务并返回task_id"""
-        # 获取图片尺寸
-        width, height = self.get_image_dimensions()
-        
-        submit_form = {
-            "req_key": "jimeng_t2i_v31",
-            "prompt": prompt,
-            "seed": -5,
-            "width": width,
-            "height": height
-        }
-        
-        self.log_message(f"正在提交图像生成任务... (尺寸: {width}×{height})")
-        submit_resp = visual_service.cv_sync2async_submit_task(submit_form)
-        
-        if submit_resp.get("code") != 10000:
-            self.log_message(f"提交任务失败: {json.dumps(submit_resp, ensure_ascii=False)}")
-            return None
-        
-        task_id = submit_resp["data"].get("task_id")
-        if not task_id:
-            self.log_message("获取任务ID失败")
-            return None
-        
-        self.log_message(f"任务已提交，ID: {task_id}")
-        return task_id
-        
-    def get_image_result(self, visual_service, task_id):
-        """查询任务结果并返回图片URL列表"""
-        result_form = {
-            "req_key": "jimeng_t2i_v31",
-            "task_id": task_id,
-            "req_json": json.dumps({
-                "logo_info": {
-                    "add_logo": False,
-                    "position": 0,
-                    "language": 0,
-                    "opacity": 0.3,
-                    "logo_text_content": "这里是明水印内容"
-                },
-                "return_url": True
-            })
-        }
-        
-        max_retries = 20
-        retry_interval = 5
-        
-        for i in range(max_retries):
-            self.log_message(f"正在查询结果({i+1}/{max_retries})...")
-            result_resp = visual_service.cv_sync2async_get_result(result_form)
+            messagebox.showerror("错误", f"打开保存目录的索引失败: {str(e)}")
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title(f"历史记录 - {store.root}")
+        window.geometry("800x450")
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(1, weight=1)
+        
+        search_frame = ttk.Frame(window, padding="10 10 10 5")
+        search_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        search_frame.columnconfigure(1, weight=1)
+        ttk.Label(search_frame, text="提示词:").grid(row=0, column=0, padx=(0, 5))
+        query = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=query)
+        search_entry.grid(row=0, column=1, sticky=(tk.W, tk.E))
+        count_label = ttk.Label(search_frame, text="")
+        count_label.grid(row=0, column=3, padx=(10, 0))
+        
+        tree_frame = ttk.Frame(window, padding="10 0 10 10")
+        tree_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        tree_frame.columnconfigure(0, weight=1)
+        tree_frame.rowconfigure(0, weight=1)
+        tree = ttk.Treeview(tree_frame, columns=("time", "size", "seed", "prompt"), show="headings")
+        for column, text, width, stretch in (("time", "完成时间", 140, False), ("size", "尺寸", 90, False),
+                                             ("seed", "种子", 90, False), ("prompt", "提示词", 400, True)):
+            tree.heading(column, text=text)
+            tree.column(column, width=width, stretch=stretch)
+        tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=tree.yview)
+        scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
+        tree.configure(yscrollcommand=scrollbar.set)
+        files = {}
+        
+        # 每次搜索的序号，较早的搜索结果晚到时丢弃
+        searches = [0]
+        
+        def search():
+            """在后台线程查询索引，结果交回主线程显示"""
+            searches[0] += 1
+            serial = searches[0]
+            text = query.get()
+            count_label.config(text="搜索中…")
             
-            if result_resp.get("code") == 10000:
-                status = result_resp["data"].get("status", "")
-                
-                if status == "done":
-                    self.log_message("任务处理完成")
-                    return result_resp["data"].get("image_urls", [])
-                elif status == "failed":
-                    self.log_message("任务处理失败")
-                    return []
-                elif status in ["pending", "processing"]:
-                    self.log_message(f"任务处理中，状态: {status}")
-                else:
-                    self.log_message(f"未知状态: {status}")
-            else:
-                self.log_message(f"查询结果失败: {json.dumps(result_resp, ensure_ascii=False)}")
-                return []
+            def run():
+                try:
+                    rows = store.search(text, limit=HISTORY_LIMIT)
+                except Exception as e:
+                    self.log_message(f"搜索历史记录失败: {str(e)}")
+                    rows = []
+                self.post_ui(show_rows, serial, rows)
             
-            time.sleep(retry_interval)
-        
-        self.log_message("任务处理超时")
-        return []
+            thread = threading.Thread(target=run)
+            thread.daemon = True
+            thread.start()
         
-    def generation_worker(self):
-        """图像生成工作线程"""
-        try:
-            # 验证输入
-            ak = self.ak.get().strip()
-            sk = self.sk.get().strip()
-            prompt = self.prompt_text.get(1.0, tk.END).strip()
-            
-            if not ak or not sk:
-                messagebox.showerror("错误", "请填写Access Key和Secret Key")
+        def show_rows(serial, rows):
+            if serial != searches[0] or not window.winfo_exists():
                 return
-                
-            if not prompt:
-                messagebox.showerror("错误", "请输入提示词")
-                return
-            
-            # 创建保存目录
-            save_dir = self.save_dir.get()
-            os.makedirs(save_dir, exist_ok=True)
-            
-            # 初始化服务
-            visual_service = VisualService()
-            visual_service.set_ak(ak)
-            visual_service.set_sk(sk)
-            
-            # 提交任务
-            task_id = self.generate_image(visual_service, prompt)
-            if not task_id:
-                return
-            
-            # 获取结果
-            image_urls = self.get_image_result(visual_service, task_id)
-            
-            # 下载图片
-            if image_urls:
-                for idx, url in enumerate(image_urls):
-                    filename = f"{task_id}_{idx}.jpg"
-                    save_path = os.path.join(save_dir, filename)
-                    self.log_message(f"正在下载图片 {idx+1}/{len(image_urls)}: {url}")
-                    self.download_image(url, save_path)
-                    
-                self.log_message(f"所有图片已保存完成！共{len(image_urls)}张图片")
-                messagebox.showinfo("完成", f"图像生成完成！共生成{len(image_urls)}张图片")
-            else:
-                self.log_message("未获取到图片URL或任务失败")
-                messagebox.showerror("失败", "图像生成失败，请检查日志信息")
-                
+            tree.delete(*tree.get_children())
+            files.clear()
+            for row in rows:
+                finished = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["finished_at"]))
+                size = f"{row['width']}×{row['height']}" if row["width"] else ""
+                seed = "" if row["seed"] is None else row["seed"]
+                item = tree.insert("", tk.END, values=(finished, size, seed, row["prompt"]))
+                files[item] = row["files"]
+            count_label.config(text=f"{len(rows)}条" + ("（仅显示最近的）" if len(rows) >= HISTORY_LIMIT else ""))
+        
+        def open_selected(event=None):
+            for item in tree.selection():
+                existing = [path for path in files.get(item, []) if os.path.exists(path)]
+                if not existing:
+                    self.log_message("图片文件已不存在")
+                    continue
+                try:
+                    open_path(existing[0])
+                except Exception as e:
+                    self.log_message(f"打开图片失败: {str(e)}")
+        
+        ttk.Button(search_frame, text="搜索", command=search).grid(row=0, column=2, padx=(5, 0))
+        search_entry.bind('<Return>', lambda e: search())
+        tree.bind('<Double-1>', open_selected)
+        search_entry.focus_set()
+        search()
+        
+    def resume_unfinished_jobs(self):
+        """把任务日志中已提交但未下载的任务重新放入队列"""
+        ak = self.ak.get().strip()
+        sk = self.sk.get().strip()
+        if not ak or not sk:
+            return
+        try:
+            # 只恢复用当前AK提交的任务；其他程序仍在处理的任务由它自己完成
+            tasks = self.journal.unfinished(accounts={ak})
         except Exception as e:
-            error_msg = f"生成过程中发生错误: {str(e)}"
-            self.log_message(error_msg)
-            messagebox.showerror("错误", error_msg)
-        finally:
-            # 恢复按钮状态
-            self.generate_button.config(state=tk.NORMAL, text="生成图像")
+            self.log_message(f"读取任务日志失败: {str(e)}")
+            return
+        if tasks:
+            self.log_message(f"发现{len(tasks)}个上次未完成的任务，继续查询和下载")
+        for task in tasks:
+            self.job_panel.add_job(task.prompt, task.width, task.height, ak, sk, task.save_dir, task=task)
+        
+    def on_jobs_busy_change(self, busy):
+        """有任务运行时显示进度条动画"""
+        if busy == self.progress_running:
+            return
+        self.progress_running = busy
+        if busy:
+            self.progress.start()
+        else:
             self.progress.stop()
-            
-    def start_generation(self):
-        """开始图像生成"""
-        # 禁用生成按钮
-        self.generate_button.config(state=tk.DISABLED, text="生成中...")
-        self.progress.start()
         
-        # 清空状态日志
-        self.status_text.config(state=tk.NORMAL)
-        self.status_text.delete(1.0, tk.END)
-        self.status_text.config(state=tk.DISABLED)
+    def start_generation(self):
+        """把当前提示词和尺寸设置加入任务队列"""
+        # 验证输入（在主线程中读取界面变量）
+        ak = self.ak.get().strip()
+        sk = self.sk.get().strip()
+        prompt = self.prompt_text.get(1.0, tk.END).strip()
+        
+        if not ak or not sk:
+            messagebox.showerror("错误", "请填写Access Key和Secret Key")
+            return
+            
+        if not prompt:
+            messagebox.showerror("错误", "请输入提示词")
+            return
         
-        # 在新线程中执行生成任务
-        thread = threading.Thread(target=self.generation_worker)
-        thread.daemon = True
-        thread.start()
+        width, height = self.get_image_dimensions()
+        job = self.job_panel.add_job(prompt, width, height, ak, sk, self.save_dir.get())
+        self.log_message(f"任务{job.job_id}已加入队列 (尺寸: {width}×{height})")
+
+    def start_ratio_sweep(self):
+        """把当前提示词按每个预设比例各加入一个任务"""
+        ak = self.ak.get().strip()
+        sk = self.sk.get().strip()
+        prompt = self.prompt_text.get(1.0, tk.END).strip()
+
+        if not ak or not sk:
+            messagebox.showerror("错误", "请填写Access Key和Secret Key")
+            return
+
+        if not prompt:
+            messagebox.showerror("错误", "请输入提示词")
+            return
+
+        for ratio, (width, height) in RATIO_DIMENSIONS.items():
+            job = self.job_panel.add_job(prompt, width, height, ak, sk, self.save_dir.get())
+            self.log_message(f"任务{job.job_id}已加入队列 (比例: {ratio}, 尺寸: {width}×{height})")
 
 def main():
     root = tk.Tk()
     app = ImageGeneratorGUI(root)
+    probe_file = os.environ.get(STARTUP_PROBE_ENV)
+    if probe_file:
+        # 画出第一帧后记录时间并退出（不保存配置）
+        root.update()
+        with open(probe_file, 'w', encoding='utf-8') as f:
+            f.write(repr(time.time()))
+        app.journal.close()
+        root.destroy()
+        return
     root.mainloop()
 
 if __name__ == '__main__':
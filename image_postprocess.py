@@ -0,0 +1,260 @@
+# coding:utf-8
+"""
+下载后的图片处理（进程池）
+
+图片下载完成后，可选地在独立进程中进行以下处理，每项都可以单独开启：
+    thumbnail   生成小缩略图（thumbnails/ 目录）
+    preview     生成长边受限的预览图（previews/ 目录）
+    convert     另存为 WebP / AVIF
+    recompress  按目标质量重新压缩原始JPEG（变小时才替换）
+    metadata    把提示词和参数写入EXIF（ImageDescription，JSON格式）
+处理在 ProcessPoolExecutor 中进行，不阻塞下载流程，吞吐量随CPU核数增长。
+需要安装 Pillow。
+"""
+import os
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Pillow 可选：没有安装时无法启用后处理
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+    features = None
+
+THUMBNAIL_DIR = "thumbnails"
+PREVIEW_DIR = "previews"
+CONVERT_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+
+# EXIF 标签
+EXIF_IMAGE_DESCRIPTION = 0x010E
+EXIF_SOFTWARE = 0x0131
+METADATA_SOFTWARE = "jimeng_generat_images"
+
+
+class PostProcessConfig:
+    """后处理设置；尺寸为0或格式为空表示不做该项"""
+
+    def __init__(self, thumbnail_size=0, preview_size=0, convert_format=None, quality=85,
+                 recompress=False, embed_metadata=False):
+        self.thumbnail_size = int(thumbnail_size or 0)
+        self.preview_size = int(preview_size or 0)
+        self.convert_format = convert_format.lower() if convert_format else None
+        self.quality = int(quality)
+        self.recompress = recompress
+        self.embed_metadata = embed_metadata
+
+    def enabled(self):
+        """是否至少开启了一项处理"""
+        return bool(self.thumbnail_size or self.preview_size or self.convert_format
+                    or self.recompress or self.embed_metadata)
+
+    def validate(self):
+        """检查设置是否可用，不可用时抛出ValueError"""
+        if Image is None:
+            raise ValueError("图片后处理需要安装 Pillow: pip install Pillow")
+        if not 1 <= self.quality <= 100:
+            raise ValueError("质量需在1到100之间")
+        if self.convert_format:
+            if self.convert_format not in CONVERT_FORMATS:
+                raise ValueError(f"不支持的格式: {self.convert_format}")
+            if not features.check(self.convert_format):
+                raise ValueError(f"当前Pillow不支持 {self.convert_format.upper()} 编码")
+
+    def rewrites_original(self):
+        """是否改写下载的原图（其余处理只生成派生文件）"""
+        return bool(self.recompress or self.embed_metadata)
+
+    def needs_full_image(self):
+        """除缩略图和预览图外的处理都需要完整解码原图"""
+        return bool(self.convert_format or self.recompress or self.embed_metadata)
+
+
+def build_metadata(task):
+    """任务的提示词和参数，写入图片EXIF"""
+    return {
+        "prompt": task.prompt,
+        "req_key": task.req_key,
+        "seed": task.seed,
+        "width": task.width,
+        "height": task.height,
+        "task_id": task.task_id
+    }
+
+
+def make_exif(metadata):
+    """生成包含元数据的EXIF；EXIF文本只能是ASCII，中文以JSON转义保存"""
+    exif = Image.Exif()
+    exif[EXIF_IMAGE_DESCRIPTION] = json.dumps(metadata, ensure_ascii=True, sort_keys=True)
+    exif[EXIF_SOFTWARE] = METADATA_SOFTWARE
+    return exif
+
+
+def read_metadata(path):
+    """读取 make_exif 写入的元数据，没有时返回None"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            if exif.get(EXIF_SOFTWARE) != METADATA_SOFTWARE:
+                return None
+            return json.loads(exif.get(EXIF_IMAGE_DESCRIPTION, ""))
+    except (OSError, ValueError):
+        return None
+
+
+def derived_path(path, subdir, suffix):
+    """原图同目录下子目录中的派生文件路径"""
+    directory, name = os.path.split(path)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(directory, subdir, stem + suffix) if subdir else os.path.join(directory, stem + suffix)
+
+
+def save_atomic(image, path, format, **params):
+    """先写临时文件再替换，中途失败不会留下损坏的图片"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        image.save(tmp_path, format, **params)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def process_image(path, metadata, config, rewrite=True):
+    """在工作进程中处理一张图片，返回 {处理项: 输出路径}；rewrite为False时不改写原图"""
+    outputs = {}
+    exif = make_exif(metadata) if config.embed_metadata and metadata else None
+
+    with Image.open(path) as source:
+        if not config.needs_full_image():
+            # 只需要小图时让JPEG解码器直接按比例缩小解码，快得多
+            size = max(config.thumbnail_size, config.preview_size)
+            source.draft("RGB", (size, size))
+        image = source.convert("RGB")
+        is_jpeg = source.format == "JPEG"
+
+        if rewrite and (config.recompress or exif is not None):
+            # 只写元数据时沿用原图的量化表，避免再次有损压缩
+            quality = config.quality if config.recompress or not is_jpeg else "keep"
+            params = {"quality": quality, "optimize": True, "progressive": True}
+            if exif is not None:
+                params["exif"] = exif
+            target = source if quality == "keep" else image
+            tmp_path = f"{path}.{os.getpid()}.recompress"
+            target.save(tmp_path, "JPEG", **params)
+            # 单纯重新压缩时只有变小才替换原图
+            if exif is not None or os.path.getsize(tmp_path) < os.path.getsize(path):
+                os.replace(tmp_path, path)
+                outputs["recompress" if config.recompress else "metadata"] = path
+            else:
+                os.remove(tmp_path)
+
+    if config.convert_format:
+        target = derived_path(path, None, "." + config.convert_format)
+        params = {"quality": config.quality}
+        if exif is not None:
+            params["exif"] = exif
+        save_atomic(image, target, CONVERT_FORMATS[config.convert_format], **params)
+        outputs["convert"] = target
+
+    # 先生成较大的预览图，缩略图在其基础上继续缩小
+    for name, size, subdir in (("preview", config.preview_size, PREVIEW_DIR),
+                               ("thumbnail", config.thumbnail_size, THUMBNAIL_DIR)):
+        if not size:
+            continue
+        image.thumbnail((size, size), Image.LANCZOS)
+        target = derived_path(path, subdir, ".jpg")
+        save_atomic(image, target, "JPEG", quality=config.quality, optimize=True)
+        outputs[name] = target
+    return outputs
+
+
+class ImagePostProcessor:
+    """把下载完成的图片交给进程池处理，不等待结果"""
+
+    def __init__(self, config, max_workers=None, log=None):
+        config.validate()
+        self.config = config
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.log = log or print
+        self.processed = 0
+        self.failed = 0
+
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def submit(self, task, on_done=None, rewrite=True):
+        """提交一个任务的全部图片，每张图片单独处理以便分散到各个进程
+
+        on_done(task) 在该任务的图片全部处理成功后调用（在进程池的回调线程中）；
+        rewrite为False时不改写原图（图片来自缓存，已经处理过）。
+        """
+        metadata = build_metadata(task)
+        executor = self._get_executor()
+        # 该任务尚未处理完的图片数，以及是否都处理成功
+        state = {"left": len(task.files), "ok": True}
+        for path in task.files:
+            future = executor.submit(process_image, path, metadata, self.config, rewrite)
+            with self._lock:
+                self._pending.add(future)
+            future.add_done_callback(lambda f, path=path: self._on_done(f, path, task, state, on_done))
+
+    def _on_done(self, future, path, task, state, on_done):
+        try:
+            future.result()
+            failed = False
+        except Exception as e:
+            failed = True
+            self.log(f"图片后处理失败 {path}: {str(e)}")
+        with self._lock:
+            state["left"] -= 1
+            state["ok"] = state["ok"] and not failed
+            finished = state["left"] == 0 and state["ok"]
+        if finished and on_done is not None:
+            # 在移出 _pending 之前调用，wait() 返回时回调已经完成
+            try:
+                on_done(task)
+            except Exception as e:
+                self.log(f"后处理完成回调失败: {str(e)}")
+        with self._lock:
+            self._pending.discard(future)
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+            if not self._pending:
+                self._idle.notify_all()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def wait(self):
+        """等待已提交的图片全部处理完"""
+        with self._lock:
+            while self._pending:
+                self._idle.wait()
+
+    def close(self):
+        """处理完剩余图片后关闭进程池"""
+        self.wait()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        return {"processed": self.processed, "failed": self.failed, "pending": self.pending_count()}
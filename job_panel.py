@@ -0,0 +1,303 @@
+# coding:utf-8
+"""
+生成任务队列面板
+
+每次点击“生成图像”都会把当前提示词和尺寸设置作为一个任务放入队列，后台最多
+同时运行K个任务。列表中显示每个任务的状态、耗时和缩略图，支持取消和重试。
+取消（或超过设置的期限）会通过任务的 CancelToken 中止提交、查询和下载，任务占用的
+运行名额立即让给下一个任务。
+面板的状态只在主线程中修改，工作线程通过 post_ui 把更新交回主线程。
+"""
+import time
+import itertools
+import importlib.util
+import threading
+from collections import deque
+import tkinter as tk
+from tkinter import ttk
+
+from generation_engine import GenerationTask
+
+# Pillow 可选：没有安装时不显示缩略图；第一次显示缩略图时才导入，不拖慢启动
+HAS_PIL = importlib.util.find_spec("PIL") is not None
+
+THUMBNAIL_SIZE = 48
+# "同时运行"的上限；引擎的在途名额（ServiceLimiter）按这个值创建
+MAX_JOBS = 20
+# 耗时列的刷新间隔（毫秒）
+ELAPSED_REFRESH_MS = 1000
+
+STATUS_QUEUED = "排队中"
+STATUS_SUBMITTING = "提交中"
+STATUS_RENDERING = "生成中"
+STATUS_DOWNLOADING = "下载中"
+STATUS_DONE = "完成"
+STATUS_FAILED = "失败"
+STATUS_CANCELLED = "已取消"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+
+class GenerationJob:
+    """队列中的一个任务（界面侧的记录）"""
+
+    def __init__(self, job_id, prompt, width, height, ak, sk, save_dir):
+        self.job_id = job_id
+        self.prompt = prompt
+        self.width = width
+        self.height = height
+        self.ak = ak
+        self.sk = sk
+        self.save_dir = save_dir
+
+        self.status = STATUS_QUEUED
+        self.cancelled = False
+        self.task = None
+        self.started_at = None
+        self.finished_at = None
+
+    def elapsed(self):
+        """已运行的秒数，未开始时返回None"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+
+class JobQueuePanel(ttk.LabelFrame):
+    """任务队列：Treeview 列表 + 取消/重试按钮 + 并发数设置"""
+
+    def __init__(self, parent, engine_for, post_ui, log, on_busy_change=None, max_jobs=3, timeout=0):
+        super().__init__(parent, text="任务队列", padding="10")
+        # engine_for(ak, sk, save_dir) 返回共用的 GenerationEngine
+        self.engine_for = engine_for
+        self.post_ui = post_ui
+        self.log = log
+        self.on_busy_change = on_busy_change
+
+        self.max_jobs = tk.IntVar(value=max_jobs)
+        # 每个任务的期限（秒），0为不限
+        self.timeout = tk.IntVar(value=timeout)
+        self.jobs = {}
+        self.pending = deque()
+        self.running = set()
+        self.thumbnails = {}
+        self._ids = itertools.count(1)
+
+        self.setup_ui()
+        self.after(ELAPSED_REFRESH_MS, self.refresh_elapsed)
+
+    def setup_ui(self):
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+        toolbar = ttk.Frame(self)
+        toolbar.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
+        ttk.Label(toolbar, text="同时运行:").pack(side=tk.LEFT)
+        ttk.Spinbox(toolbar, from_=1, to=MAX_JOBS, width=4, textvariable=self.max_jobs,
+                    command=self.dispatch).pack(side=tk.LEFT, padx=(5, 10))
+        ttk.Label(toolbar, text="期限(秒):").pack(side=tk.LEFT)
+        ttk.Spinbox(toolbar, from_=0, to=3600, increment=30, width=6,
+                    textvariable=self.timeout).pack(side=tk.LEFT, padx=(5, 10))
+        ttk.Button(toolbar, text="取消", command=self.cancel_selected).pack(side=tk.LEFT)
+        ttk.Button(toolbar, text="重试", command=self.retry_selected).pack(side=tk.LEFT, padx=(5, 0))
+        ttk.Button(toolbar, text="清除已结束", command=self.clear_finished).pack(side=tk.LEFT, padx=(5, 0))
+
+        # 有缩略图时加大行高
+        style = ttk.Style(self)
+        row_height = THUMBNAIL_SIZE + 4 if HAS_PIL else 20
+        style.configure("JobQueue.Treeview", rowheight=row_height)
+
+        self.tree = ttk.Treeview(self, columns=("prompt", "size", "status", "elapsed"),
+                                 style="JobQueue.Treeview", height=4)
+        self.tree.heading("#0", text="#")
+        self.tree.heading("prompt", text="提示词")
+        self.tree.heading("size", text="尺寸")
+        self.tree.heading("status", text="状态")
+        self.tree.heading("elapsed", text="耗时")
+        self.tree.column("#0", width=THUMBNAIL_SIZE + 40, stretch=False)
+        self.tree.column("prompt", width=300)
+        self.tree.column("size", width=90, stretch=False)
+        self.tree.column("status", width=70, stretch=False)
+        self.tree.column("elapsed", width=60, stretch=False)
+        self.tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+
+        scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+        scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        self.tree.configure(yscrollcommand=scrollbar.set)
+
+    def add_job(self, prompt, width, height, ak, sk, save_dir, task=None):
+        """把一个任务放入队列；task 为从任务日志恢复的已提交任务"""
+        job = GenerationJob(next(self._ids), prompt, width, height, ak, sk, save_dir)
+        job.task = task or GenerationTask(prompt, width, height)
+        try:
+            job.task.timeout = max(0, int(self.timeout.get())) or None
+        except (tk.TclError, ValueError):
+            pass
+        self.jobs[job.job_id] = job
+        self.tree.insert("", tk.END, iid=str(job.job_id), text=str(job.job_id),
+                         values=(self.short_prompt(prompt), f"{width}×{height}", job.status, ""))
+        self.pending.append(job)
+        self.dispatch()
+        return job
+
+    @staticmethod
+    def short_prompt(prompt, limit=60):
+        prompt = " ".join(prompt.split())
+        return prompt if len(prompt) <= limit else prompt[:limit] + "…"
+
+    def is_busy(self):
+        return bool(self.running or self.pending)
+
+    def dispatch(self):
+        """在并发上限内启动排队中的任务"""
+        try:
+            limit = min(MAX_JOBS, max(1, int(self.max_jobs.get())))
+        except (tk.TclError, ValueError):
+            limit = 1
+        while self.pending and len(self.running) < limit:
+            job = self.pending.popleft()
+            if job.cancelled:
+                continue
+            self.running.add(job.job_id)
+            job.started_at = time.time()
+            self.set_status(job, STATUS_SUBMITTING)
+            thread = threading.Thread(target=self.run_job, args=(job,))
+            thread.daemon = True
+            thread.start()
+        if self.on_busy_change:
+            self.on_busy_change(self.is_busy())
+
+    def run_job(self, job):
+        """工作线程：依次执行提交、查询、下载；取消时各步骤由任务的CancelToken提前结束"""
+        task = job.task
+        try:
+            engine = self.engine_for(job.ak, job.sk, job.save_dir)
+            if engine.submit_task(task):
+                self.post_ui(self.set_status, job, STATUS_RENDERING)
+                if engine.poll_task(task):
+                    self.post_ui(self.set_status, job, STATUS_DOWNLOADING)
+                    engine.download_task(task)
+        except Exception as e:
+            task.fail(str(e))
+            self.log(f"任务{job.job_id}发生错误: {str(e)}")
+        self.post_ui(self.finish_job, job)
+
+    def finish_job(self, job):
+        """主线程：任务结束后更新列表并启动下一个任务"""
+        self.running.discard(job.job_id)
+        if job.finished_at is None:
+            job.finished_at = time.time()
+        if job.cancelled or job.task.status == "cancelled":
+            status = STATUS_CANCELLED
+        elif job.task.status == "done":
+            status = STATUS_DONE
+            self.log(f"任务{job.job_id}完成，共{len(job.task.files)}张图片")
+            if job.task.files:
+                self.load_thumbnail(job, job.task.files[0])
+        else:
+            status = STATUS_FAILED
+            self.log(f"任务{job.job_id}失败: {job.task.error}")
+        self.set_status(job, status)
+        self.dispatch()
+
+    def set_status(self, job, status):
+        """更新任务状态（主线程）"""
+        if job.cancelled and status not in FINISHED_STATUSES:
+            return
+        job.status = status
+        if self.tree.exists(str(job.job_id)):
+            self.tree.set(str(job.job_id), "status", status)
+            self.update_elapsed(job)
+
+    def update_elapsed(self, job):
+        elapsed = job.elapsed()
+        if elapsed is not None and self.tree.exists(str(job.job_id)):
+            self.tree.set(str(job.job_id), "elapsed", f"{elapsed:.0f}秒")
+
+    def refresh_elapsed(self):
+        """定时刷新运行中任务的耗时"""
+        for job_id in self.running:
+            self.update_elapsed(self.jobs[job_id])
+        self.after(ELAPSED_REFRESH_MS, self.refresh_elapsed)
+
+    def selected_jobs(self):
+        return [self.jobs[int(iid)] for iid in self.tree.selection() if int(iid) in self.jobs]
+
+    def cancel_selected(self):
+        """取消选中的任务：排队中的直接移除，运行中的中止当前步骤并立即让出运行名额"""
+        tasks = []
+        for job in self.selected_jobs():
+            if job.status in FINISHED_STATUSES:
+                continue
+            job.cancelled = True
+            tasks.append(job.task)
+            job.finished_at = time.time()
+            if job.job_id in self.running:
+                # 工作线程在下一个检查点退出，不必等它结束；取消原因由引擎写入日志
+                self.running.discard(job.job_id)
+            else:
+                self.log(f"任务{job.job_id}已取消")
+            self.set_status(job, STATUS_CANCELLED)
+        if tasks:
+            # 取消回调会写任务日志（同步落盘）并获取限流器和账号池的锁，不在主线程中执行
+            thread = threading.Thread(target=self.cancel_tasks, args=(tasks,), name="job-cancel")
+            thread.daemon = True
+            thread.start()
+        self.dispatch()
+
+    @staticmethod
+    def cancel_tasks(tasks):
+        """工作线程：依次取消任务"""
+        for task in tasks:
+            task.cancel()
+
+    def retry_selected(self):
+        """重新排队已失败或已取消的任务
+
+        已提交且远端可能仍在处理的任务（如从任务日志恢复后查询超时或被取消的）继续查询
+        原来的task_id，不重新提交，避免同一张图付两次费用；其余的用相同的设置重新生成。
+        """
+        for job in self.selected_jobs():
+            if job.status not in (STATUS_FAILED, STATUS_CANCELLED) or job.job_id in self.running:
+                continue
+            task = job.task.reattach() if job.task.can_reattach() else None
+            self.add_job(job.prompt, job.width, job.height, job.ak, job.sk, job.save_dir, task=task)
+
+    def clear_finished(self):
+        """从列表中移除已结束的任务"""
+        for job in list(self.jobs.values()):
+            if job.status in FINISHED_STATUSES and job.job_id not in self.running:
+                self.tree.delete(str(job.job_id))
+                self.thumbnails.pop(job.job_id, None)
+                del self.jobs[job.job_id]
+
+    def load_thumbnail(self, job, path):
+        """在后台线程解码缩略图，完成后交给主线程显示"""
+        if not HAS_PIL:
+            return
+
+        def decode():
+            try:
+                from PIL import Image
+
+                with Image.open(path) as image:
+                    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                    thumbnail = image.convert("RGB")
+            except Exception as e:
+                self.log(f"生成缩略图失败: {str(e)}")
+                return
+            self.post_ui(self.show_thumbnail, job, thumbnail)
+
+        thread = threading.Thread(target=decode)
+        thread.daemon = True
+        thread.start()
+
+    def show_thumbnail(self, job, thumbnail):
+        if not self.tree.exists(str(job.job_id)):
+            return
+        from PIL import ImageTk
+
+        photo = ImageTk.PhotoImage(thumbnail)
+        # 保留引用，否则图片会被回收
+        self.thumbnails[job.job_id] = photo
+        self.tree.item(str(job.job_id), image=photo)
@@ -0,0 +1,289 @@
+# coding:utf-8
+"""
+本地模拟的即梦接口服务
+
+模拟 jimeng_t2i_v31 的 CVSync2AsyncSubmitTask / CVSync2AsyncGetResult：
+任务先排队（pending）再生成（processing），耗时按随机分布抽取，完成后
+返回指向本服务的图片URL；超过设定的QPS或并发数时返回限流错误码
+50429 / 50430。并发上限和任务都按AK区分，用其他AK查询会找不到任务；
+--reject-ak 中的AK返回鉴权错误。用于在不消耗额度的情况下测试和压测客户端。
+
+用法：
+    python mock_visual_server.py --port 8765 --render-time 8 --submit-qps 2
+然后把 VisualService 的 host 设为 127.0.0.1:8765、scheme 设为 http，
+或创建 AsyncVisualClient(ak, sk, host="127.0.0.1:8765", scheme="http")。
+"""
+import os
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# 默认出图尺寸（1:1），耗时按面积相对它缩放
+REFERENCE_AREA = 1328 * 1328
+# 已结束的任务保留多久可以查询（秒）
+TASK_TTL = 600
+
+CODE_SUCCESS = 10000
+CODE_QPS_LIMIT = 50429
+CODE_CONCURRENCY_LIMIT = 50430
+CODE_TASK_NOT_FOUND = 50411
+CODE_INVALID_PARAM = 50400
+
+
+class MockTask:
+    """模拟的远端任务，状态由提交后经过的时间决定"""
+
+    def __init__(self, form, ak, queue_time, render_time, fail):
+        self.task_id = uuid.uuid4().hex
+        self.ak = ak
+        self.width = int(form.get("width", 1328))
+        self.height = int(form.get("height", 1328))
+        self.submitted_at = time.monotonic()
+        self.queue_time = queue_time
+        self.render_time = render_time
+        self.fail = fail
+
+    def status(self, now):
+        elapsed = now - self.submitted_at
+        if elapsed < self.queue_time:
+            return "pending"
+        if elapsed < self.queue_time + self.render_time:
+            return "processing"
+        return "failed" if self.fail else "done"
+
+    def finished_at(self):
+        return self.submitted_at + self.queue_time + self.render_time
+
+
+class MockVisualServer(ThreadingHTTPServer):
+    """模拟服务；start() 在后台线程中运行"""
+
+    daemon_threads = True
+    # 压测时会同时建立上千个连接
+    request_queue_size = 1024
+
+    def __init__(self, host="127.0.0.1", port=0, render_time=8.0, render_jitter=0.3,
+                 queue_time=1.0, submit_qps=0, poll_qps=0, max_concurrency=0,
+                 failure_rate=0.0, images=4, image_size=200 * 1024, seed=None, rejected_keys=()):
+        super().__init__((host, port), MockRequestHandler)
+        self.render_time = render_time
+        self.render_jitter = render_jitter
+        self.queue_time = queue_time
+        self.max_concurrency = max_concurrency
+        self.rejected_keys = set(rejected_keys)
+        self.failure_rate = failure_rate
+        self.images = images
+        self.image_data = b"\xff\xd8\xff\xe0" + os.urandom(max(0, image_size - 6)) + b"\xff\xd9"
+
+        self.tasks = {}
+        self.counters = {"submit": 0, "get_result": 0, "throttled": 0, "images": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # 0 表示不限制
+        self._limits = {"submit": [submit_qps, 0, 0.0], "get_result": [poll_qps, 0, 0.0]}
+
+    @property
+    def endpoint(self):
+        """供客户端使用的 host:port"""
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="mock-visual")
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def over_qps(self, action):
+        """按1秒固定窗口统计QPS，超出时返回True"""
+        limit = self._limits[action]
+        if not limit[0]:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - limit[2] >= 1.0:
+                limit[1], limit[2] = 0, now
+            limit[1] += 1
+            return limit[1] > limit[0]
+
+    def in_flight(self, now, ak):
+        return sum(1 for task in self.tasks.values() if task.ak == ak and task.finished_at() > now)
+
+    def submit(self, form, ak):
+        if not form.get("prompt") or not form.get("req_key"):
+            return 200, error_body(CODE_INVALID_PARAM, "Invalid Request Param")
+        if self.over_qps("submit"):
+            return 429, error_body(CODE_QPS_LIMIT, "Request Has Reached API Limit, Please Try Later")
+
+        now = time.monotonic()
+        with self._lock:
+            self.expire(now)
+            if self.max_concurrency and self.in_flight(now, ak) >= self.max_concurrency:
+                return 429, error_body(CODE_CONCURRENCY_LIMIT,
+                                       "Request Has Reached API Concurrent Limit, Please Try Later")
+            # 渲染耗时：按面积缩放的对数正态分布；排队时间：指数分布
+            scale = (int(form.get("width", 1328)) * int(form.get("height", 1328)) / REFERENCE_AREA) ** 0.5
+            render_time = self.render_time * scale * self._random.lognormvariate(0, self.render_jitter)
+            queue_time = self._random.expovariate(1 / self.queue_time) if self.queue_time else 0
+            task = MockTask(form, ak, queue_time, render_time, self._random.random() < self.failure_rate)
+            self.tasks[task.task_id] = task
+            self.counters["submit"] += 1
+        return 200, success_body({"task_id": task.task_id})
+
+    def get_result(self, form, ak, base_url):
+        if self.over_qps("get_result"):
+            return 429, error_body(CODE_QPS_LIMIT, "Request Has Reached API Limit, Please Try Later")
+        now = time.monotonic()
+        with self._lock:
+            self.counters["get_result"] += 1
+            task = self.tasks.get(form.get("task_id"))
+        if task is None or task.ak != ak:
+            return 200, error_body(CODE_TASK_NOT_FOUND, "Task Not Found")
+
+        status = task.status(now)
+        data = {"status": status, "binary_data_base64": [], "image_urls": None}
+        if status == "done":
+            data["image_urls"] = [f"{base_url}/images/{task.task_id}/{i}.jpg" for i in range(self.images)]
+        return 200, success_body(data)
+
+    def expire(self, now):
+        """清理早已结束的任务（调用时已持有锁）"""
+        if len(self.tasks) < 1000:
+            return
+        for task_id in [k for k, t in self.tasks.items() if now - t.finished_at() > TASK_TTL]:
+            del self.tasks[task_id]
+
+
+def success_body(data):
+    return {"code": CODE_SUCCESS, "data": data, "message": "Success",
+            "request_id": uuid.uuid4().hex, "status": CODE_SUCCESS, "time_elapsed": "1ms"}
+
+
+def error_body(code, message):
+    return {"code": code, "data": None, "message": message,
+            "request_id": uuid.uuid4().hex, "status": code, "time_elapsed": "1ms"}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """按 Action 分发接口请求，/images/ 下返回图片"""
+
+    # 保持长连接，客户端可以复用连接池
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        url = urlsplit(self.path)
+        action = parse_qs(url.query).get("Action", [""])[0]
+
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("HMAC-SHA256"):
+            self.send_json(401, {"ResponseMetadata": {"Action": action, "Error": {
+                "Code": "InvalidAuthorization", "Message": "missing signature"}}})
+            return
+        # Credential=AK/日期/区域/服务/request
+        ak = authorization.split("Credential=", 1)[-1].split("/", 1)[0]
+        if ak in self.server.rejected_keys:
+            self.send_json(401, {"ResponseMetadata": {"Action": action, "Error": {
+                "Code": "InvalidAccessKey", "Message": "access key is invalid"}}})
+            return
+        try:
+            form = json.loads(body or b"{}")
+        except ValueError:
+            self.send_json(400, error_body(CODE_INVALID_PARAM, "Invalid JSON"))
+            return
+
+        if action == "CVSync2AsyncSubmitTask":
+            status, resp = self.server.submit(form, ak)
+        elif action == "CVSync2AsyncGetResult":
+            status, resp = self.server.get_result(form, ak, f"http://{self.headers.get('Host', self.server.endpoint)}")
+        else:
+            status, resp = 404, {"ResponseMetadata": {"Action": action, "Error": {
+                "Code": "InvalidActionOrVersion", "Message": "unsupported action"}}}
+        if status == 429:
+            with self.server._lock:
+                self.server.counters["throttled"] += 1
+        self.send_json(status, resp)
+
+    def do_GET(self):
+        if not self.path.startswith("/images/"):
+            self.send_json(404, {"message": "not found"})
+            return
+        data = self.server.image_data
+        start = 0
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start = int(range_header[6:].split("-")[0] or 0)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+        with self.server._lock:
+            self.server.counters["images"] += 1
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地模拟的即梦接口服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--render-time", type=float, default=8.0, help="1328×1328出图耗时中位数（秒）")
+    parser.add_argument("--render-jitter", type=float, default=0.3, help="耗时的对数正态分布sigma")
+    parser.add_argument("--queue-time", type=float, default=1.0, help="平均排队时间（秒）")
+    parser.add_argument("--submit-qps", type=float, default=0, help="提交QPS上限，0为不限")
+    parser.add_argument("--poll-qps", type=float, default=0, help="查询QPS上限，0为不限")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="每个AK同时处理中的任务上限，0为不限")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="任务失败的概率")
+    parser.add_argument("--images", type=int, default=4, help="每个任务返回的图片数")
+    parser.add_argument("--reject-ak", nargs="*", default=[], help="这些AK返回鉴权错误")
+    parser.add_argument("--image-size", type=int, default=200 * 1024, help="每张图片的字节数")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = MockVisualServer(args.host, args.port, render_time=args.render_time,
+                              render_jitter=args.render_jitter, queue_time=args.queue_time,
+                              submit_qps=args.submit_qps, poll_qps=args.poll_qps,
+                              max_concurrency=args.max_concurrency, failure_rate=args.failure_rate,
+                              images=args.images, image_size=args.image_size, rejected_keys=args.reject_ak)
+    print(f"模拟服务已启动: http://{server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"请求统计: {server.counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+# coding:utf-8
+"""
+保存目录的分片存储与索引
+
+图片不再全部平铺在保存目录中，而是按 task_id 的哈希前缀分到两级子目录：
+    <保存目录>/3f/a2/<task_id>_0.jpg
+每个目录中的文件数保持在较小的规模，几十万张图片时列目录和查找文件仍然很快。
+每个完成的任务写入保存目录下的SQLite索引（index.sqlite3）：task_id、提示词、
+尺寸、种子、时间和图片路径（相对保存目录，目录整体移动后仍然有效）。提示词
+可以全文搜索（FTS5 trigram 分词，支持中文子串；少于3个字的词按LIKE匹配）。
+
+用法:
+    python output_store.py generated_images --search 猫      搜索提示词
+    python output_store.py generated_images --migrate        把旧的平铺文件移入分片目录并建立索引
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import heapq
+import hashlib
+import argparse
+import threading
+
+INDEX_FILE = "index.sqlite3"
+# 分片目录的层数，每层256个子目录
+SHARD_LEVELS = 2
+# trigram 分词要求查询词至少3个字符
+FTS_MIN_TERM = 3
+# 旧版本平铺保存的文件名
+FLAT_NAME = re.compile(r"^(?P<task_id>.+)_(?P<idx>\d+)\.jpg$")
+# 后处理生成缩略图的子目录（与 image_postprocess.THUMBNAIL_DIR 相同；这里不导入它，
+# 图库在界面启动时导入本模块，不能因此加载Pillow）
+THUMBNAIL_DIR = "thumbnails"
+# 扫描索引之外的图片时认作图片的扩展名（后处理转换出的 webp/avif 与原图重复，不列出）
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png")
+# 最多列出的未索引图片数
+UNINDEXED_LIMIT = 1000
+
+
+def shard_dir(task_id):
+    """task_id 对应的分片子目录（相对路径）"""
+    digest = hashlib.sha1(str(task_id).encode("utf-8")).hexdigest()
+    return os.path.join(*(digest[i * 2:i * 2 + 2] for i in range(SHARD_LEVELS)))
+
+
+def preview_file(path):
+    """优先使用后处理生成的缩略图"""
+    directory, filename = os.path.split(path)
+    thumbnail = os.path.join(directory, THUMBNAIL_DIR, os.path.splitext(filename)[0] + ".jpg")
+    return thumbnail if os.path.exists(thumbnail) else path
+
+
+class OutputStore:
+    """一个保存目录的分片存储和索引，可被多个线程共用"""
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        # 上次扫描未索引图片的结果：(保存目录的修改时间, [文件名, ...])
+        self._unindexed = None
+        self._db = sqlite3.connect(os.path.join(self.root, INDEX_FILE), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                task_id TEXT NOT NULL UNIQUE,
+                task_key TEXT,
+                prompt TEXT NOT NULL,
+                req_key TEXT,
+                width INTEGER,
+                height INTEGER,
+                seed INTEGER,
+                started_at REAL,
+                finished_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (task_id, idx)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_finished ON tasks (finished_at);
+        """)
+        # 全文索引依赖SQLite的FTS5，不可用时搜索退化为LIKE
+        try:
+            self._db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS prompts USING fts5(
+                    prompt, content='tasks', content_rowid='id', tokenize='trigram');
+                CREATE TRIGGER IF NOT EXISTS tasks_ai AFTER INSERT ON tasks BEGIN
+                    INSERT INTO prompts (rowid, prompt) VALUES (new.id, new.prompt);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tasks_ad AFTER DELETE ON tasks BEGIN
+                    INSERT INTO prompts (prompts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tasks_au AFTER UPDATE OF prompt ON tasks BEGIN
+                    INSERT INTO prompts (prompts, rowid, prompt) VALUES ('delete', old.id, old.prompt);
+                    INSERT INTO prompts (rowid, prompt) VALUES (new.id, new.prompt);
+                END;
+            """)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def image_path(self, task_id, idx, ext=".jpg"):
+        """任务第idx张图片的保存路径，所在的分片目录不存在时创建"""
+        directory = os.path.join(self.root, shard_dir(task_id))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{task_id}_{idx}{ext}")
+
+    def record(self, task):
+        """把完成的任务写入索引（同一task_id再次写入时覆盖）"""
+        self.record_files(task.task_id, task.files, prompt=task.prompt, task_key=task.task_key,
+                          req_key=task.req_key, width=task.width, height=task.height, seed=task.seed,
+                          started_at=task.started_at, finished_at=task.finished_at)
+
+    def record_files(self, task_id, files, prompt="", task_key=None, req_key=None, width=None,
+                     height=None, seed=None, started_at=None, finished_at=None):
+        relative = [os.path.relpath(os.path.realpath(path), self.root) for path in files]
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO tasks (task_id, task_key, prompt, req_key, width, height, seed, started_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (task_id) DO UPDATE SET task_key = excluded.task_key, prompt = excluded.prompt, "
+                "req_key = excluded.req_key, width = excluded.width, height = excluded.height, "
+                "seed = excluded.seed, started_at = excluded.started_at, finished_at = excluded.finished_at",
+                (task_id, task_key, prompt or "", req_key, width, height, seed, started_at,
+                 finished_at or time.time()))
+            self._db.execute("DELETE FROM files WHERE task_id = ?", (task_id,))
+            self._db.executemany("INSERT INTO files (task_id, idx, path) VALUES (?, ?, ?)",
+                                 [(task_id, idx, path) for idx, path in enumerate(relative)])
+            self._db.commit()
+
+    def lookup(self, task_id):
+        """按task_id取记录，不存在时返回None"""
+        with self._lock:
+            rows = self._query("WHERE t.task_id = ?", [task_id], 1, 0)
+        return rows[0] if rows else None
+
+    def search(self, text="", limit=100, offset=0):
+        """按提示词搜索（空格分隔的词都要出现），最近完成的在前；text为空时返回最近的记录"""
+        where, params = self._match(text)
+        with self._lock:
+            return self._query(where, params, limit, offset)
+
+    def list_images(self, text="", limit=-1):
+        """按提示词搜索，返回 [(图片绝对路径, task_id, 提示词), ...]，最近完成的在前，同一任务按序号排列"""
+        where, params = self._match(text)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT f.path, t.task_id, t.prompt FROM tasks t JOIN files f ON f.task_id = t.task_id " +
+                where + " ORDER BY t.finished_at DESC, t.id DESC, f.idx LIMIT ?", list(params) + [limit]).fetchall()
+        return [(os.path.join(self.root, path), task_id, prompt) for path, task_id, prompt in rows]
+
+    def unindexed_images(self, text=""):
+        """保存目录第一层中不在索引里的图片（旧版平铺保存的、手工放入的），返回
+        [(图片绝对路径, None, ""), ...]，最近修改的在前；text中的词都要出现在文件名中
+
+        分片目录中的图片都已索引，不扫描。只保留最近的 UNINDEXED_LIMIT 张，目录
+        内容不变时沿用上次的结果；更早的旧文件可以用 --migrate 建立索引。
+        """
+        try:
+            mtime = os.stat(self.root).st_mtime_ns
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._unindexed
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, self._scan_unindexed())
+            with self._lock:
+                self._unindexed = cached
+        terms = text.lower().split()
+        return [(os.path.join(self.root, name), None, "") for name in cached[1]
+                if all(term in name.lower() for term in terms)]
+
+    def _scan_unindexed(self):
+        """扫描保存目录第一层，返回不在索引中的图片文件名，最近修改的在前"""
+        found = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(IMAGE_SUFFIXES):
+                    continue
+                try:
+                    if entry.is_file():
+                        found.append((entry.stat().st_mtime, entry.name))
+                except OSError:
+                    continue
+        indexed = set()
+        names = [name for _, name in found]
+        with self._lock:
+            # 第一层文件在索引中的相对路径就是文件名；分批查询，避免超出SQL参数个数限制
+            for start in range(0, len(names), 500):
+                batch = names[start:start + 500]
+                indexed.update(path for (path,) in self._db.execute(
+                    "SELECT path FROM files WHERE path IN (" + ", ".join("?" * len(batch)) + ")", batch))
+        newest = heapq.nlargest(UNINDEXED_LIMIT, (item for item in found if item[1] not in indexed))
+        return [name for _, name in newest]
+
+    def _match(self, text):
+        """提示词搜索条件，返回 (WHERE子句, 参数)"""
+        clauses = []
+        params = []
+        fts_terms = []
+        for term in text.split():
+            if self.fts and len(term) >= FTS_MIN_TERM:
+                # 作为短语匹配，避免词中的符号被当作FTS语法
+                fts_terms.append('"' + term.replace('"', '""') + '"')
+            else:
+                clauses.append("t.prompt LIKE ? ESCAPE '\\'")
+                params.append("%" + re.sub(r"([%_\\\\])", r"\\\1", term) + "%")
+        if fts_terms:
+            clauses.insert(0, "t.id IN (SELECT rowid FROM prompts WHERE prompts MATCH ?)")
+            params.insert(0, " AND ".join(fts_terms))
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        return where, params
+
+    def _query(self, where, params, limit, offset):
+        """（持有锁时调用）查询任务及其图片，图片为绝对路径
+
+        先在子查询中按条件取出一页任务，再连接 files 表一次取出全部图片。
+        """
+        rows = self._db.execute(
+            "SELECT t.task_id, t.task_key, t.prompt, t.req_key, t.width, t.height, t.seed, "
+            "t.started_at, t.finished_at, f.path FROM (SELECT t.* FROM tasks t " + where +
+            " ORDER BY t.finished_at DESC, t.id DESC LIMIT ? OFFSET ?) t "
+            "LEFT JOIN files f ON f.task_id = t.task_id ORDER BY t.finished_at DESC, t.id DESC, f.idx",
+            list(params) + [limit, offset]).fetchall()
+        results = []
+        for task_id, task_key, prompt, req_key, width, height, seed, started_at, finished_at, path in rows:
+            if not results or results[-1]["task_id"] != task_id:
+                results.append({"task_id": task_id, "task_key": task_key, "prompt": prompt, "req_key": req_key,
+                                "width": width, "height": height, "seed": seed, "started_at": started_at,
+                                "finished_at": finished_at, "files": []})
+            if path is not None:
+                results[-1]["files"].append(os.path.join(self.root, path))
+        return results
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def migrate_flat_files(self, log=print):
+        """把保存目录第一层中旧版平铺的 <task_id>_<idx>.jpg 移入分片目录并写入索引
+
+        提示词和参数从图片EXIF中读取（需要写入元数据且安装了Pillow），读不到时为空。
+        返回移动的文件数。
+        """
+        from image_postprocess import read_metadata
+
+        grouped = {}
+        for name in os.listdir(self.root):
+            match = FLAT_NAME.match(name)
+            if match and os.path.isfile(os.path.join(self.root, name)):
+                grouped.setdefault(match.group("task_id"), []).append((int(match.group("idx")), name))
+
+        moved = 0
+        for task_id, names in grouped.items():
+            files = []
+            for idx, name in sorted(names):
+                source = os.path.join(self.root, name)
+                target = self.image_path(task_id, idx)
+                os.replace(source, target)
+                files.append(target)
+                moved += 1
+            metadata = read_metadata(files[0]) or {}
+            self.record_files(task_id, files, prompt=metadata.get("prompt", ""),
+                              req_key=metadata.get("req_key"), width=metadata.get("width"),
+                              height=metadata.get("height"), seed=metadata.get("seed"),
+                              finished_at=os.path.getmtime(files[0]))
+        log(f"已移动{moved}个文件（{len(grouped)}个任务）")
+        return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存目录的分片存储与索引")
+    parser.add_argument("save_dir", help="图片保存目录")
+    parser.add_argument("--search", help="按提示词搜索（空格分隔多个词）")
+    parser.add_argument("--limit", type=int, default=20, help="最多显示的记录数")
+    parser.add_argument("--migrate", action="store_true", help="把旧的平铺文件移入分片目录并建立索引")
+    args = parser.parse_args(argv)
+
+    store = OutputStore(args.save_dir)
+    try:
+        if args.migrate:
+            store.migrate_flat_files()
+        print(f"索引中共有{store.count()}个任务")
+        if args.search is not None or not args.migrate:
+            for row in store.search(args.search or "", limit=args.limit):
+                finished = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["finished_at"]))
+                print(f"{finished}  {row['task_id']}  {row['width']}×{row['height']} seed={row['seed']}  {row['prompt']}")
+                for path in row["files"]:
+                    print(f"    {path}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+# coding:utf-8
+"""
+提示词矩阵与参数扫描
+
+一个提示词模板与变量取值、预设比例（RATIO_DIMENSIONS）、自定义尺寸和多个
+种子做笛卡尔积，逐个生成任务。组合按序号惰性展开（混合进制，最后一个维度
+变化最快），不会在内存中生成完整的组合列表，种子可以是很大的区间。
+
+扫描配置（JSON）示例:
+    {
+        "name": "cat",
+        "template": "一只{animal}在{place}，{style}风格",
+        "vars": {"animal": ["猫", "狗"], "place": ["雪山", "海边"], "style": ["水彩", "油画"]},
+        "ratios": "all",
+        "seeds": {"start": 1, "count": 4},
+        "grid": {"columns": "seed"}
+    }
+    template 也可以写成 templates 列表；ratios 为 "all" 表示全部预设比例；
+    sizes 为自定义尺寸列表，如 [[1280, 720]]；seeds 为列表或 {"start", "count"}。
+    模板中除变量外还可以引用 {ratio} 和 {seed}。
+
+生成结束后可按任意两个维度输出网格索引（HTML），并可选地拼成联系表图片。
+
+用法（查看组合数和前几个提示词，或根据已有的结果清单重新生成索引）:
+    python prompt_sweep.py sweep.json
+    python prompt_sweep.py sweep.json --index results.jsonl
+"""
+import os
+import sys
+import json
+import html
+import argparse
+import itertools
+
+from generation_engine import (GenerationTask, RATIO_DIMENSIONS, DEFAULT_REQ_KEY,
+                               resolve_dimensions)
+from output_store import preview_file
+
+# Pillow 可选：没有安装时只输出HTML索引
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+    Image = None
+
+# 内置维度的名称，变量不能使用
+RESERVED_AXES = ("template", "ratio", "seed")
+
+# 联系表每格的边长、每行最多格数和每页最多行数
+SHEET_CELL_SIZE = 256
+SHEET_MAX_COLUMNS = 16
+SHEET_MAX_LINES = 8
+SHEET_LABEL_HEIGHT = 28
+# 依次尝试的中文字体（Windows / macOS / Linux）
+SHEET_FONTS = ("msyh.ttc", "simhei.ttf", "PingFang.ttc", "NotoSansCJK-Regular.ttc", "wqy-microhei.ttc")
+
+
+class SweepSpec:
+    """扫描配置：各维度的取值和由组合序号构造任务的方法"""
+
+    def __init__(self, templates, variables=None, ratios=None, sizes=None, seeds=None,
+                 req_key=DEFAULT_REQ_KEY, name="sweep", grid=None):
+        if not templates:
+            raise ValueError("缺少提示词模板 template")
+        self.templates = list(templates)
+        self.name = name
+        self.req_key = req_key
+        self.grid = grid or {}
+
+        # 每个维度为 (名称, 可按下标取值的序列)；种子用range表示，不展开
+        self.axes = []
+        if len(self.templates) > 1:
+            self.axes.append(("template", self.templates))
+        for key, values in (variables or {}).items():
+            if key in RESERVED_AXES:
+                raise ValueError(f"变量名 {key} 与内置维度重名（{', '.join(RESERVED_AXES)}）")
+            values = list(values) if isinstance(values, (list, tuple)) else [values]
+            if not values:
+                raise ValueError(f"变量 {key} 没有取值")
+            self.axes.append((key, values))
+
+        size_values = [(ratio, RATIO_DIMENSIONS[ratio]) for ratio in ratios or []]
+        for width, height in sizes or []:
+            width, height = resolve_dimensions("自定义", width, height)
+            size_values.append((f"{width}x{height}", (width, height)))
+        if not size_values:
+            size_values = [("1:1", RATIO_DIMENSIONS["1:1"])]
+        self.axes.append(("ratio", size_values))
+        self.axes.append(("seed", seeds if seeds is not None else [-1]))
+
+        # 先用第一个组合检查模板中的变量都有定义
+        self.prompt_at(0)
+
+    @classmethod
+    def from_dict(cls, data):
+        templates = data.get("templates") or ([data["template"]] if data.get("template") else [])
+        ratios = data.get("ratios")
+        if ratios == "all":
+            ratios = list(RATIO_DIMENSIONS)
+        elif isinstance(ratios, str):
+            ratios = [ratios]
+        for ratio in ratios or []:
+            if ratio not in RATIO_DIMENSIONS:
+                raise ValueError(f"未知的比例: {ratio}（可选 {', '.join(RATIO_DIMENSIONS)}）")
+        return cls(templates, variables=data.get("vars"), ratios=ratios, sizes=data.get("sizes"),
+                   seeds=parse_seeds(data.get("seeds")), req_key=data.get("req_key", DEFAULT_REQ_KEY),
+                   name=str(data.get("name", "sweep")), grid=data.get("grid"))
+
+    @classmethod
+    def load(cls, path):
+        """读取JSON格式的扫描配置"""
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            return cls.from_dict(json.load(f))
+
+    def __len__(self):
+        total = 1
+        for _, values in self.axes:
+            total *= len(values)
+        return total
+
+    def axis_names(self):
+        return [name for name, _ in self.axes]
+
+    def coordinates(self, index):
+        """组合序号对应的各维度下标（最后一个维度变化最快）"""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        coords = []
+        for _, values in reversed(self.axes):
+            index, position = divmod(index, len(values))
+            coords.append(position)
+        return coords[::-1]
+
+    def index_of(self, coords):
+        """各维度下标对应的组合序号"""
+        index = 0
+        for (_, values), position in zip(self.axes, coords):
+            index = index * len(values) + position
+        return index
+
+    def combination(self, index):
+        """组合序号对应的 {维度名: 取值}，尺寸维度取比例名称"""
+        combo = {}
+        for (name, values), position in zip(self.axes, self.coordinates(index)):
+            value = values[position]
+            combo[name] = value[0] if name == "ratio" else value
+        return combo
+
+    def prompt_at(self, index):
+        combo = self.combination(index)
+        template = combo.get("template", self.templates[0])
+        try:
+            return template.format_map(combo)
+        except KeyError as e:
+            raise ValueError(f"模板中的变量 {e} 没有定义")
+        except (IndexError, ValueError) as e:
+            raise ValueError(f"提示词模板格式有误: {e}")
+
+    def task_at(self, index):
+        """构造第index个组合的生成任务，任务id为 名称-序号"""
+        coords = self.coordinates(index)
+        axis = self.axis_names().index("ratio")
+        width, height = self.axes[axis][1][coords[axis]][1]
+        seed = self.axes[-1][1][coords[-1]]
+        return GenerationTask(self.prompt_at(index), width, height, seed=int(seed),
+                              req_key=self.req_key, task_key=self.task_key(index))
+
+    def task_key(self, index):
+        return f"{self.name}-{index}"
+
+    def index_from_key(self, task_key):
+        """由任务id解析组合序号，不属于该扫描时返回None"""
+        prefix = f"{self.name}-"
+        if not task_key or not str(task_key).startswith(prefix):
+            return None
+        try:
+            index = int(str(task_key)[len(prefix):])
+        except ValueError:
+            return None
+        return index if 0 <= index < len(self) else None
+
+    def tasks(self, start=0):
+        """从第start个组合开始逐个生成任务（惰性，可直接交给run_batch）"""
+        for index in range(start, len(self)):
+            yield self.task_at(index)
+
+    def grid_axes(self):
+        """网格的行、列维度：grid中未指定时列为最后一个取值多于一个的维度，行为其余维度"""
+        names = self.axis_names()
+        varying = [name for name, values in self.axes if len(values) > 1] or names[-1:]
+        columns = self.grid.get("columns") or varying[-1]
+        if columns not in names:
+            raise ValueError(f"网格的列维度 {columns} 不存在（可选 {', '.join(names)}）")
+        return [name for name in names if name != columns], columns
+
+
+def parse_seeds(value):
+    """种子列表、单个种子或 {"start": 起始, "count": 个数}，区间不展开"""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        start = int(value.get("start", 0))
+        count = int(value.get("count", 1))
+        if count < 1:
+            raise ValueError("seeds.count 至少为1")
+        return range(start, start + count)
+    if isinstance(value, (list, tuple)):
+        if not value:
+            raise ValueError("seeds 不能为空")
+        return [int(seed) for seed in value]
+    return [int(value)]
+
+
+def load_results(spec, results_path):
+    """读取结果清单中属于该扫描的结果：{组合序号: 结果}，只保留索引用到的字段"""
+    results = {}
+    with open(results_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            index = spec.index_from_key(row.get("id"))
+            if index is None:
+                continue
+            results[index] = {"status": row.get("status"), "files": row.get("files") or [],
+                              "error": row.get("error")}
+    return results
+
+
+def iter_grid_rows(spec):
+    """逐行返回 (行标签, [该行各列的组合序号])，行按其余维度的顺序排列"""
+    row_names, column_name = spec.grid_axes()
+    names = spec.axis_names()
+    column_axis = names.index(column_name)
+    row_axes = [names.index(name) for name in row_names]
+    for row_coords in itertools.product(*(range(len(spec.axes[axis][1])) for axis in row_axes)):
+        coords = [0] * len(names)
+        for axis, position in zip(row_axes, row_coords):
+            coords[axis] = position
+        label = ", ".join(f"{name}={axis_label(spec, axis, coords[axis])}"
+                          for name, axis in zip(row_names, row_axes))
+        indices = []
+        for position in range(len(spec.axes[column_axis][1])):
+            coords[column_axis] = position
+            indices.append(spec.index_of(coords))
+        yield label, indices
+
+
+def axis_label(spec, axis, position):
+    name, values = spec.axes[axis]
+    value = values[position]
+    if name == "ratio":
+        return value[0]
+    if name == "template":
+        return f"#{position + 1}"
+    return str(value)
+
+
+def write_html_index(spec, results, path):
+    """把结果按网格写成HTML：每行是其余维度的一个组合，每列是列维度的一个取值"""
+    _, column_name = spec.grid_axes()
+    column_axis = spec.axis_names().index(column_name)
+    base = os.path.dirname(os.path.abspath(path))
+
+    def rel(file_path):
+        return html.escape(os.path.relpath(os.path.abspath(file_path), base).replace(os.sep, "/"))
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">\n")
+        f.write(f"<title>{html.escape(spec.name)}</title>\n<style>\n"
+                "body{font-family:sans-serif;margin:16px}table{border-collapse:collapse}"
+                "th,td{border:1px solid #ccc;padding:4px;vertical-align:top;font-size:12px}"
+                "th{background:#f4f4f4}td img{max-width:200px;max-height:200px;display:block}"
+                ".failed{color:#c00}.missing{color:#999}\n</style></head><body>\n")
+        f.write(f"<h1>{html.escape(spec.name)}</h1>\n<p>{len(spec)}个组合，"
+                f"完成{sum(1 for r in results.values() if r['status'] == 'done')}个</p>\n")
+        f.write("<table>\n<tr><th></th>")
+        for position in range(len(spec.axes[column_axis][1])):
+            f.write(f"<th>{column_name}={html.escape(axis_label(spec, column_axis, position))}</th>")
+        f.write("</tr>\n")
+        for label, indices in iter_grid_rows(spec):
+            f.write(f"<tr><th>{html.escape(label)}</th>")
+            for index in indices:
+                result = results.get(index)
+                title = html.escape(spec.prompt_at(index), quote=True)
+                if result is None:
+                    f.write(f"<td class=\"missing\" title=\"{title}\">未生成</td>")
+                elif result["status"] != "done" or not result["files"]:
+                    error = html.escape(str(result["error"] or result["status"]))
+                    f.write(f"<td class=\"failed\" title=\"{title}\">{error}</td>")
+                else:
+                    files = result["files"]
+                    f.write(f"<td><a href=\"{rel(files[0])}\"><img src=\"{rel(preview_file(files[0]))}\" "
+                            f"title=\"{title}\" loading=\"lazy\"></a>")
+                    for number, extra in enumerate(files[1:], 2):
+                        f.write(f" <a href=\"{rel(extra)}\">{number}</a>")
+                    f.write("</td>")
+            f.write("</tr>\n")
+        f.write("</table>\n</body></html>\n")
+
+
+def load_sheet_font(size=16):
+    """加载可以显示中文的字体，找不到时使用Pillow默认字体"""
+    for name in SHEET_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+
+def write_contact_sheets(spec, results, path_prefix, cell_size=SHEET_CELL_SIZE):
+    """把结果拼成联系表图片（每页最多SHEET_MAX_LINES行），返回生成的文件列表
+
+    每个网格行前有一条标签，列数超过SHEET_MAX_COLUMNS时折行。
+    """
+    if Image is None:
+        raise ValueError("生成联系表需要安装 Pillow: pip install Pillow")
+    font = load_sheet_font()
+    _, column_name = spec.grid_axes()
+    columns = min(SHEET_MAX_COLUMNS, len(spec.axes[spec.axis_names().index(column_name)][1]))
+    width = columns * cell_size
+
+    # 每个网格行拆成若干 (标签, 本行的组合序号) 的显示行
+    def lines():
+        for label, indices in iter_grid_rows(spec):
+            for offset in range(0, len(indices), columns):
+                yield label if offset == 0 else "", indices[offset:offset + columns]
+
+    outputs = []
+    # 按页消耗生成器，内存中只保留一页
+    all_lines = lines()
+    page = list(itertools.islice(all_lines, SHEET_MAX_LINES))
+    while page:
+        height = sum(cell_size + (SHEET_LABEL_HEIGHT if label else 0) for label, _ in page)
+        sheet = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(sheet)
+        y = 0
+        for label, indices in page:
+            if label:
+                draw.text((4, y + 4), label, fill="black", font=font)
+                y += SHEET_LABEL_HEIGHT
+            for column, index in enumerate(indices):
+                paste_cell(sheet, draw, results.get(index), column * cell_size, y, cell_size, font)
+            y += cell_size
+        target = f"{path_prefix}_{len(outputs) + 1:03d}.jpg"
+        sheet.save(target, "JPEG", quality=85)
+        outputs.append(target)
+        page = list(itertools.islice(all_lines, SHEET_MAX_LINES))
+    return outputs
+
+
+def paste_cell(sheet, draw, result, x, y, cell_size, font):
+    """把一个结果缩小后贴到联系表的一格中，没有图片时写出状态"""
+    if result is None or result["status"] != "done" or not result["files"]:
+        text = "未生成" if result is None else str(result["error"] or result["status"])[:20]
+        draw.rectangle((x + 2, y + 2, x + cell_size - 3, y + cell_size - 3), outline="#cccccc")
+        draw.text((x + 8, y + cell_size // 2 - 8), text, fill="#999999", font=font)
+        return
+    try:
+        with Image.open(preview_file(result["files"][0])) as image:
+            image.draft("RGB", (cell_size, cell_size))
+            image = image.convert("RGB")
+            image.thumbnail((cell_size - 4, cell_size - 4))
+            sheet.paste(image, (x + (cell_size - image.width) // 2, y + (cell_size - image.height) // 2))
+    except OSError as e:
+        draw.text((x + 8, y + cell_size // 2 - 8), f"无法读取: {e}"[:20], fill="#cc0000", font=font)
+
+
+def write_sweep_index(spec, results_path, index_path, contact_sheet=False):
+    """根据结果清单生成HTML网格索引，并可选地生成联系表，返回生成的文件列表"""
+    results = load_results(spec, results_path)
+    write_html_index(spec, results, index_path)
+    outputs = [index_path]
+    if contact_sheet:
+        outputs += write_contact_sheets(spec, results, os.path.splitext(index_path)[0] + "_sheet")
+    return outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="提示词矩阵与参数扫描")
+    parser.add_argument("spec", help="扫描配置文件（JSON）")
+    parser.add_argument("--show", type=int, default=10, help="显示前几个组合的提示词")
+    parser.add_argument("--index", metavar="RESULTS", help="根据该结果清单生成网格索引")
+    parser.add_argument("--index-file", help="网格索引的输出路径（默认为 <名称>_index.html）")
+    parser.add_argument("--contact-sheet", action="store_true", help="同时生成联系表图片")
+    args = parser.parse_args(argv)
+
+    try:
+        spec = SweepSpec.load(args.spec)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"错误: 读取扫描配置失败: {e}")
+        return 2
+
+    if args.index:
+        index_file = args.index_file or f"{spec.name}_index.html"
+        try:
+            outputs = write_sweep_index(spec, args.index, index_file, contact_sheet=args.contact_sheet)
+        except (OSError, ValueError) as e:
+            print(f"错误: 生成索引失败: {e}")
+            return 2
+        for output in outputs:
+            print(f"已生成: {output}")
+        return 0
+
+    dims = " × ".join(f"{name}({len(values)})" for name, values in spec.axes)
+    print(f"{spec.name}: {dims} = {len(spec)}个组合")
+    for task in itertools.islice(spec.tasks(), args.show):
+        print(f"  {task.task_key}: {task.width}×{task.height} seed={task.seed} {task.prompt}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# coding:utf-8
+"""
+VisualService 调用的限流与准入控制
+
+提交（cv_sync2async_submit_task）和查询（cv_sync2async_get_result）各有一个
+令牌桶限制QPS；同时在远端处理中的任务数由自适应并发限制控制。遇到限流错误码
+时按AIMD调整：速率和并发上限减半，之后每次成功再缓慢增加，使持续吞吐量稳定
+在服务商的限制之下。
+"""
+import time
+import threading
+
+from cancellation import TaskCancelledError
+
+# 即梦接口的限流错误码：QPS超限 / 并发超限
+THROTTLE_CODES = {50429, 50430}
+# 网关层返回的限流错误（ResponseMetadata.Error.Code）
+THROTTLE_ERROR_CODES = {"RequestLimitExceeded", "Throttling", "FlowLimitExceeded"}
+
+
+class ThrottledError(Exception):
+    """请求被服务端限流"""
+
+
+def is_throttled(resp):
+    """判断接口返回是否为限流错误"""
+    if not isinstance(resp, dict):
+        return False
+    if resp.get("code") in THROTTLE_CODES:
+        return True
+    error = (resp.get("ResponseMetadata") or {}).get("Error") or {}
+    return error.get("Code") in THROTTLE_ERROR_CODES
+
+
+def is_throttled_error(exc):
+    """判断SDK抛出的异常是否为限流错误"""
+    text = str(exc)
+    return any(str(code) in text for code in THROTTLE_CODES) or \
+        any(code in text for code in THROTTLE_ERROR_CODES)
+
+
+class TokenBucket:
+    """令牌桶：按rate每秒补充令牌，最多积攒burst个；被限流时速率减半，成功时线性恢复"""
+
+    def __init__(self, rate, burst=None, min_rate=0.1, increase=0.05):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.min_rate = min_rate
+        self.increase = increase
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, token=None):
+        """取走一个令牌，没有令牌时等待；token（CancelToken）被取消时抛出TaskCancelledError"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if token is None:
+                time.sleep(wait)
+            elif token.wait(wait):
+                raise TaskCancelledError(token.reason)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+            # 清空积攒的令牌，立即放慢
+            self._tokens = min(self._tokens, 0)
+
+
+class AdaptiveConcurrency:
+    """上限可调的信号量：被限流时上限减半，每次成功增加 1/上限（约每轮+1）"""
+
+    def __init__(self, limit, min_limit=1):
+        self.max_limit = max(1, int(limit))
+        self.min_limit = min_limit
+        self.limit = float(self.max_limit)
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_use >= int(self.limit):
+                self._cond.wait()
+            self.in_use += 1
+
+    def try_acquire(self):
+        """有空闲名额时占用并返回True，否则立即返回False"""
+        with self._cond:
+            if self.in_use >= int(self.limit):
+                return False
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit / 2)
+
+
+class ServiceLimiter:
+    """提交和查询分别限速，并限制远端同时处理中的任务数"""
+
+    def __init__(self, submit_qps=2.0, poll_qps=10.0, max_concurrency=8):
+        self.submit = TokenBucket(submit_qps)
+        self.poll = TokenBucket(poll_qps)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+
+    def on_submit_success(self):
+        self.submit.on_success()
+        self.concurrency.on_success()
+
+    def on_submit_throttled(self):
+        self.submit.on_throttle()
+        self.concurrency.on_throttle()
+
+    def stats(self):
+        """返回当前的速率和并发上限"""
+        return {
+            "submit_qps": round(self.submit.rate, 2),
+            "poll_qps": round(self.poll.rate, 2),
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_use
+        }
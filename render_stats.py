@@ -0,0 +1,151 @@
+# coding:utf-8
+"""
+出图耗时统计
+
+按 (req_key, 宽×高) 记录最近的任务完成耗时并持久化到一个小的JSON文件，
+供轮询器决定第一次查询的时间、之后的查询节奏以及超时时间：
+    - 第一次查询安排在耗时中位数附近
+    - 之后依次在 p75 / p90 / p95 / p99 处查询，超过p99后再指数退避
+    - 超时时间取观测到的尾部耗时，而不是固定常数
+"""
+import os
+import json
+import time
+import threading
+
+# 每个尺寸保留的样本数
+WINDOW = 200
+# 样本少于该数量时改用同一模型所有尺寸的样本
+MIN_SAMPLES = 5
+# 依次安排查询的分位点
+CHECKPOINTS = (0.5, 0.75, 0.9, 0.95, 0.99)
+# 没有任何样本时的超时时间（按1024×1024计算，更大的尺寸按面积放大）
+DEFAULT_TIMEOUT = 100.0
+BASE_AREA = 1024 * 1024
+# 有样本时：超时 = p99 × 倍数，且不短于下限
+TIMEOUT_FACTOR = 2.0
+MIN_TIMEOUT = 30.0
+# 两次写文件的最短间隔（秒）
+SAVE_INTERVAL = 10.0
+
+# 按文件路径共用的统计实例，见 shared_stats
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def quantile(sorted_samples, q):
+    """返回已排序样本的q分位数"""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(q * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+class RenderTimeStats:
+    """按模型和尺寸统计的任务完成耗时；path为None时只保存在内存中"""
+
+    def __init__(self, path="render_stats.json"):
+        self.path = path
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.load()
+
+    @staticmethod
+    def _key(req_key, width, height):
+        if width is None or height is None:
+            return f"{req_key}:*"
+        return f"{req_key}:{width}x{height}"
+
+    def load(self):
+        """从文件读取统计数据"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                self._samples = {k: [float(x) for x in v][-WINDOW:] for k, v in data.items()}
+        except Exception as e:
+            print(f"加载耗时统计失败: {e}")
+
+    def save(self):
+        """把统计数据写入文件（先写临时文件再替换）"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {k: [round(x, 3) for x in v] for k, v in self._samples.items()}
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"保存耗时统计失败: {e}")
+
+    def record(self, req_key, width, height, seconds):
+        """记录一次任务完成耗时"""
+        with self._lock:
+            for key in (self._key(req_key, width, height), self._key(req_key, None, None)):
+                samples = self._samples.setdefault(key, [])
+                samples.append(seconds)
+                if len(samples) > WINDOW:
+                    del samples[0]
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def _sorted_samples(self, req_key, width, height):
+        """返回(已排序样本, 是否为该尺寸自己的样本)"""
+        with self._lock:
+            samples = self._samples.get(self._key(req_key, width, height), [])
+            if len(samples) >= MIN_SAMPLES:
+                return sorted(samples), True
+            return sorted(self._samples.get(self._key(req_key, None, None), [])), False
+
+    def expected(self, req_key, width, height):
+        """返回耗时中位数，没有数据时返回None"""
+        samples, _ = self._sorted_samples(req_key, width, height)
+        return quantile(samples, 0.5)
+
+    def poll_delay(self, req_key, width, height, elapsed, min_interval=1.0):
+        """返回距下一个分位点的秒数；已超过所有分位点或没有数据时返回None"""
+        samples, _ = self._sorted_samples(req_key, width, height)
+        for q in CHECKPOINTS:
+            point = quantile(samples, q)
+            if point is not None and point - elapsed >= min_interval:
+                return point - elapsed
+        return None
+
+    def timeout(self, req_key, width, height):
+        """根据观测到的尾部耗时返回超时时间"""
+        samples, exact = self._sorted_samples(req_key, width, height)
+        area_factor = 1.0
+        if not exact:
+            # 没有该尺寸自己的样本时按面积放大，大尺寸任务不会被过早放弃
+            area_factor = max(1.0, (width or 1024) * (height or 1024) / BASE_AREA)
+        if len(samples) >= MIN_SAMPLES:
+            return max(MIN_TIMEOUT, quantile(samples, 0.99) * TIMEOUT_FACTOR) * area_factor
+        return DEFAULT_TIMEOUT * area_factor
+
+
+def shared_stats(path="render_stats.json"):
+    """返回该文件对应的统计实例，同一进程中使用同一文件的引擎共用一个
+
+    每个实例保存的是自己内存中的样本，同一文件有多个实例时后写入的会覆盖其他实例
+    记录的样本。path为None时返回新的内存实例。
+    """
+    if not path:
+        return RenderTimeStats(path=None)
+    key = os.path.realpath(path)
+    with _shared_lock:
+        stats = _shared.get(key)
+        if stats is None:
+            stats = _shared[key] = RenderTimeStats(path)
+        return stats
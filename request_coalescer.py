@@ -0,0 +1,56 @@
+# coding:utf-8
+"""
+相同请求的合并（single-flight）
+
+同时在途的多个任务如果提交参数完全相同（规范化后的 req_key / prompt /
+seed / 宽高一致，且保存到同一目录），只有第一个任务（leader）真正调用
+cv_sync2async_submit_task，其余任务（follower）等待它结束后直接共用它的
+task_id、图片URL和本地文件；leader被取消时，follower的请求仍然有效，各自重新
+提交（第一个重新提交的成为新的leader）。只合并固定种子（seed >= 0）的请求：随机种子
+每次出图不同，用户提交两次就是想要两组图片。
+"""
+import threading
+from concurrent.futures import Future
+
+from result_cache import cache_key, is_deterministic
+
+
+class RequestCoalescer:
+    """按提交参数登记在途的leader任务，可被多个线程共用"""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._leaders = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(form, save_dir):
+        """返回可合并请求的键，不能合并时返回None"""
+        if not is_deterministic(form):
+            return None
+        return f"{cache_key(form)}:{save_dir}"
+
+    def join(self, key):
+        """登记一个任务：返回 (leader结束时得到leader任务的Future, 是否为leader)
+
+        leader被取消时Future得到None，等待者需要重新提交。
+        """
+        with self._lock:
+            future = self._leaders.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._leaders[key] = Future()
+            return future, True
+
+    def finish(self, key, task):
+        """leader结束：之后的相同请求重新提交（或命中缓存）"""
+        with self._lock:
+            future = self._leaders.pop(key, None)
+        if future is not None:
+            # 被取消的结果不能交给等待者
+            future.set_result(None if task.status == "cancelled" else task)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._leaders)
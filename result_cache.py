@@ -0,0 +1,188 @@
+# coding:utf-8
+"""
+按提示词和参数寻址的结果缓存
+
+以规范化后的提交参数（req_key / prompt / seed / width / height）的哈希为键，
+图片按内容哈希存放在 objects/ 目录下，索引保存在SQLite中。只有固定种子
+（seed >= 0）的任务结果是确定的，才会被缓存；命中时直接返回本地图片，不再
+调用接口。缓存按总大小和存放时间以LRU方式淘汰。
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+INDEX_FILE = "index.sqlite3"
+OBJECTS_DIR = "objects"
+
+
+def normalize_form(form):
+    """规范化提交参数，使等价的请求得到相同的键"""
+    return {
+        "req_key": form.get("req_key"),
+        "prompt": " ".join(str(form.get("prompt", "")).split()),
+        "seed": int(form.get("seed", -1)),
+        "width": int(form.get("width", 0)),
+        "height": int(form.get("height", 0))
+    }
+
+
+def cache_key(form):
+    """返回提交参数的缓存键"""
+    data = json.dumps(normalize_form(form), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(form):
+    """固定种子的任务结果可以复用，随机种子（负数）不行"""
+    try:
+        return int(form.get("seed", -1)) >= 0
+    except (TypeError, ValueError):
+        return False
+
+
+def file_digest(path):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """结果缓存，可被多个线程共用"""
+
+    def __init__(self, cache_dir="image_cache", max_bytes=2 * 1024 ** 3, max_age=30 * 86400):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.join(cache_dir, OBJECTS_DIR), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, INDEX_FILE), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                form TEXT NOT NULL,
+                task_id TEXT,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                key TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (key, idx)
+            );
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+        """)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_dir, OBJECTS_DIR, digest[:2], digest + ".jpg")
+
+    def lookup(self, form):
+        """返回缓存中该请求的 (task_id, 图片路径列表)，未命中返回None"""
+        if not is_deterministic(form):
+            return None
+        key = cache_key(form)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT task_id, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            digests = [r[0] for r in self._db.execute(
+                "SELECT digest FROM files WHERE key = ? ORDER BY idx", (key,))]
+            paths = [self._blob_path(d) for d in digests]
+            if not paths or not all(os.path.exists(p) for p in paths):
+                # 文件被外部删除，视为未命中
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.execute("DELETE FROM files WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0], paths
+
+    def store(self, form, task_id, files):
+        """把已下载的图片存入缓存"""
+        if not is_deterministic(form) or not files:
+            return
+        key = cache_key(form)
+        stored = []
+        for path in files:
+            digest = file_digest(path)
+            blob_path = self._blob_path(digest)
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+                shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, blob_path)
+            stored.append((digest, os.path.getsize(blob_path)))
+
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE key = ?", (key,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, form, task_id, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, json.dumps(normalize_form(form), ensure_ascii=False), task_id, now, now))
+            for idx, (digest, size) in enumerate(stored):
+                self._db.execute("INSERT INTO files (key, idx, digest) VALUES (?, ?, ?)", (key, idx, digest))
+                self._db.execute("INSERT OR IGNORE INTO blobs (digest, size) VALUES (?, ?)", (digest, size))
+            self._db.commit()
+        self.evict()
+
+    def evict(self):
+        """淘汰过期条目，并按最近使用时间淘汰直到总大小不超过上限"""
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age,))
+            total = self._total_bytes()
+            if total > self.max_bytes:
+                for key, size in self._db.execute(
+                        "SELECT e.key, COALESCE(SUM(b.size), 0) FROM entries e "
+                        "LEFT JOIN files f ON f.key = e.key LEFT JOIN blobs b ON b.digest = f.digest "
+                        "GROUP BY e.key ORDER BY e.last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    total -= size
+            self._db.execute("DELETE FROM files WHERE key NOT IN (SELECT key FROM entries)")
+            orphans = [r[0] for r in self._db.execute(
+                "SELECT digest FROM blobs WHERE digest NOT IN (SELECT digest FROM files)")]
+            for digest in orphans:
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                self._db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self._db.commit()
+
+    def _total_bytes(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def stats(self):
+        """返回命中/未命中次数、条目数和占用空间"""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            total = self._total_bytes()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
@@ -0,0 +1,176 @@
+# coding:utf-8
+"""
+任务日志（崩溃恢复）
+
+每个提交成功的任务都会写入SQLite（WAL模式），并记录状态变化：
+    submitted（已提交）→ done（已出图，记下图片URL）→ downloaded（已下载）
+    以及 failed（失败）
+程序或进程中途退出后，重新启动时可以取出未完成的任务继续查询和下载，
+不必重新提交，已经付费的出图也不会浪费。
+同一个日志文件可能被几个进程同时使用（界面和批量生成）：每条记录属于提交或恢复它
+的进程，进程定期续约，只有所属进程已退出（正常关闭或续约过期）的记录才会被恢复。
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from generation_engine import GenerationTask
+
+STATE_SUBMITTED = "submitted"
+STATE_DONE = "done"
+STATE_DOWNLOADED = "downloaded"
+STATE_FAILED = "failed"
+
+# 超过该时间的未完成任务不再恢复（远端结果通常只保留一段时间）
+MAX_RESUME_AGE = 24 * 3600
+# 进程续约的间隔；超过 LEASE_TIMEOUT 没有续约视为已退出（崩溃）
+LEASE_INTERVAL = 10.0
+LEASE_TIMEOUT = 30.0
+
+
+class TaskJournal:
+    """任务日志，可被多个线程共用"""
+
+    def __init__(self, path="task_journal.sqlite3"):
+        self.path = path
+        # 本进程（本连接）的标识，记录在提交和恢复的任务上
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # 每次提交都落盘，进程崩溃或断电后记录仍在
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                task_key TEXT,
+                req_key TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                seed INTEGER NOT NULL,
+                save_dir TEXT NOT NULL,
+                account TEXT,
+                owner TEXT,
+                state TEXT NOT NULL,
+                image_urls TEXT,
+                files TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state);
+            CREATE TABLE IF NOT EXISTS owners (
+                owner TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                heartbeat REAL NOT NULL
+            );
+        """)
+        self._db.commit()
+        self._renew()
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._keep_alive, name="journal-lease")
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def close(self):
+        """停止续约并关闭；本进程未完成的任务随即可以被其他进程恢复"""
+        self._stopped.set()
+        self._heartbeat.join()
+        with self._lock:
+            self._db.execute("DELETE FROM owners WHERE owner = ?", (self.owner,))
+            self._db.commit()
+            self._db.close()
+
+    def _renew(self):
+        self._execute("INSERT OR REPLACE INTO owners (owner, pid, heartbeat) VALUES (?, ?, ?)",
+                      (self.owner, os.getpid(), time.time()))
+
+    def _keep_alive(self):
+        while not self._stopped.wait(LEASE_INTERVAL):
+            try:
+                self._renew()
+            except Exception as e:
+                print(f"任务日志续约失败: {e}")
+
+    def _execute(self, sql, params):
+        with self._lock:
+            self._db.execute(sql, params)
+            self._db.commit()
+
+    def record_submitted(self, task, save_dir):
+        """任务提交成功"""
+        now = time.time()
+        self._execute(
+            "INSERT OR IGNORE INTO tasks (task_id, task_key, req_key, prompt, width, height, seed, "
+            "save_dir, account, owner, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (task.task_id, task.task_key, task.req_key, task.prompt, task.width, task.height,
+             task.seed, save_dir, task.account, self.owner, STATE_SUBMITTED, now, now))
+
+    def record_done(self, task):
+        """远端出图完成，记下图片URL"""
+        self._execute(
+            "UPDATE tasks SET state = ?, image_urls = ?, updated_at = ? WHERE task_id = ?",
+            (STATE_DONE, json.dumps(task.image_urls), time.time(), task.task_id))
+
+    def record_downloaded(self, task):
+        """图片已下载到本地"""
+        self._execute(
+            "UPDATE tasks SET state = ?, files = ?, error = ?, updated_at = ? WHERE task_id = ?",
+            (STATE_DOWNLOADED, json.dumps(task.files, ensure_ascii=False), task.error,
+             time.time(), task.task_id))
+
+    def record_failed(self, task):
+        """任务失败，不再恢复"""
+        self._execute(
+            "UPDATE tasks SET state = ?, error = ?, updated_at = ? WHERE task_id = ?",
+            (STATE_FAILED, task.error, time.time(), task.task_id))
+
+    def unfinished(self, max_age=MAX_RESUME_AGE, accounts=None):
+        """取出已提交但尚未下载的任务列表，并把它们记为本进程的任务
+
+        跳过仍在运行的其他进程的任务；accounts（账号名或AK的集合，如CredentialPool）
+        指定时只返回用其中的账号提交的任务，其他账号的任务无法用当前密钥查询。
+        """
+        now = time.time()
+        with self._lock:
+            # 查询和认领在同一个写事务中，两个进程同时恢复时不会取到同一批任务
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT task_id, task_key, req_key, prompt, width, height, seed, save_dir, account, state, "
+                    "image_urls FROM tasks WHERE state IN (?, ?) AND created_at >= ? AND (owner IS NULL "
+                    "OR owner = ? OR owner NOT IN (SELECT owner FROM owners WHERE heartbeat >= ?)) "
+                    "ORDER BY created_at",
+                    (STATE_SUBMITTED, STATE_DONE, now - max_age, self.owner, now - LEASE_TIMEOUT)).fetchall()
+                if accounts is not None:
+                    rows = [row for row in rows if row[8] is not None and row[8] in accounts]
+                self._db.executemany("UPDATE tasks SET owner = ? WHERE task_id = ?",
+                                     [(self.owner, row[0]) for row in rows])
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+        result = []
+        for task_id, task_key, req_key, prompt, width, height, seed, save_dir, account, state, image_urls in rows:
+            task = GenerationTask(prompt, width, height, seed=seed, req_key=req_key,
+                                  task_key=task_key, save_dir=save_dir)
+            task.task_id = task_id
+            # 必须用提交时的账号查询
+            task.account = account
+            task.status = "submitted"
+            if state == STATE_DONE and image_urls:
+                # 重新查询失败时用记下的URL下载
+                task.image_urls = json.loads(image_urls)
+            result.append(task)
+        return result
+
+    def counts(self):
+        """按状态统计任务数"""
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
@@ -0,0 +1,337 @@
+# coding:utf-8
+"""
+多路复用的任务轮询器
+
+所有未完成的task_id放在一个按下次查询时间排序的堆里，由一个调度线程统一
+负责：只有到期的任务才会发起 cv_sync2async_get_result 查询，下次查询时间
+根据返回的状态（pending / processing）和历史完成耗时（见 render_stats）计算。结果通过Future
+返回，因此同时等待上万个任务也只占用一个调度线程。登记时可以带上任务的 CancelToken：
+取消时任务立即以 TaskCancelledError 结束（堆中的条目到期时跳过），任务期限也参与超时的计算。
+"""
+import json
+import time
+import heapq
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from render_stats import RenderTimeStats
+from generation_trace import Tracer
+from rate_limiter import is_throttled, is_throttled_error
+from cancellation import TaskCancelledError
+
+# 两次查询之间的最短/最长间隔（秒）
+MIN_INTERVAL = 1.0
+MAX_INTERVAL = 10.0
+# 远端仍在排队（pending）时的查询间隔
+PENDING_INTERVAL = 5.0
+# 没有历史数据时：第一次查询的时间及之后的固定查询间隔
+DEFAULT_EXPECTED = 5.0
+DEFAULT_INTERVAL = 5.0
+# 第一次查询安排在耗时中位数的这个比例处：已完成时记下的耗时会更短，
+# 统计值因此能逐步向真实出图时间收敛，而不是停在第一次查询的时间点上
+FIRST_POLL_FACTOR = 0.8
+# 查询请求连续出错多少次后放弃
+MAX_QUERY_ERRORS = 3
+
+
+class TaskPollError(Exception):
+    """任务失败、查询失败或超时"""
+
+
+class TaskTimeoutError(TaskPollError):
+    """超过超时时间仍未完成（远端可能仍在处理）"""
+
+
+class PollerClosedError(TaskPollError):
+    """轮询器已关闭（程序退出），任务本身没有失败"""
+
+
+class _Watch:
+    """轮询器内部记录的一个待完成任务"""
+
+    def __init__(self, visual_service, task_id, form, req_key, width, height, submitted_at, limiter=None,
+                 token=None, resumed=False):
+        self.visual_service = visual_service
+        self.limiter = limiter
+        self.token = token
+        self.task_id = task_id
+        self.form = form
+        self.req_key = req_key
+        self.width = width
+        self.height = height
+        self.submitted_at = submitted_at
+        # 重启后恢复的任务：真实提交时间未知，耗时不计入历史统计
+        self.resumed = resumed
+        self.future = Future()
+        self.deadline = None
+        self.last_pending_at = None
+        self.polls = 0
+        self.overdue_polls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.status = None
+        # 第一次查询到 processing 的时间，用于估计远端排队时长
+        self.processing_at = None
+        # 结果只设置一次：取消可能与正在进行的查询同时发生
+        self.settled = False
+        # 登记在token上的取消回调，结束时撤销
+        self.on_cancel = None
+
+
+class TaskPoller:
+    """一个调度线程 + 少量请求线程轮询所有未完成的任务"""
+
+    def __init__(self, log=None, history=None, request_workers=2, limiter=None, tracer=None):
+        self.log = log or print
+        self.history = history or RenderTimeStats(path=None)
+        self.tracer = tracer or Tracer()
+        # 可选的 ServiceLimiter，查询请求受其中的查询令牌桶限速
+        self.limiter = limiter
+        self.poll_count = 0
+
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        # 真正发出HTTP请求的线程数与任务数无关
+        self._executor = ThreadPoolExecutor(max_workers=max(1, request_workers),
+                                            thread_name_prefix="poll-request")
+
+    def watch(self, visual_service, task_id, result_form, req_key, width=None, height=None,
+              submitted_at=None, limiter=None, token=None, resumed=False):
+        """登记一个已提交的任务，返回在完成时得到图片URL列表的Future
+
+        submitted_at 为提交时的 time.monotonic()，默认取当前时间；limiter 为
+        提交该任务的账号的限流器，默认使用轮询器的限流器；token 为任务的
+        CancelToken，取消或到期时Future以TaskCancelledError结束。resumed 表示
+        从任务日志恢复的任务：提交时间未知，第一次查询立即进行，完成耗时不计入
+        历史统计（否则会把统计值拉低，之后的任务过早超时）。
+        """
+        watch = _Watch(visual_service, task_id, result_form, req_key, width, height,
+                       submitted_at or time.monotonic(), limiter or self.limiter, token, resumed)
+        watch.deadline = watch.submitted_at + self.history.timeout(req_key, width, height)
+        if token is not None:
+            if token.deadline is not None:
+                watch.deadline = min(watch.deadline, token.deadline)
+            watch.on_cancel = lambda: self.cancel(watch)
+            token.add_callback(watch.on_cancel)
+            if watch.settled:
+                # 登记前已经取消
+                return watch.future
+
+        expected = self.history.expected(req_key, width, height)
+        # 第一次查询安排在预计完成的时间点附近
+        first_delay = DEFAULT_EXPECTED if expected is None else expected * FIRST_POLL_FACTOR
+        if resumed:
+            # 可能早已完成
+            first_delay = MIN_INTERVAL
+        self._schedule(watch, watch.submitted_at + max(MIN_INTERVAL, first_delay))
+        return watch.future
+
+    def cancel(self, watch):
+        """任务已取消：Future立即以TaskCancelledError结束
+
+        不在堆中查找删除（大量取消时每次都重建堆是平方复杂度），堆中的条目到期
+        取出时因已结束而跳过。
+        """
+        self._fail(watch, watch.token.reason if watch.token is not None else "已取消", TaskCancelledError)
+
+    def pending_count(self):
+        """当前尚未完成的任务数（堆中可能还留有已取消的条目，不计入）"""
+        with self._cond:
+            return sum(1 for entry in self._heap if not entry[2].settled)
+
+    def close(self):
+        """停止调度线程，未完成的任务以PollerClosedError结束"""
+        with self._cond:
+            self._closed = True
+            remaining = [entry[2] for entry in self._heap]
+            self._heap = []
+            self._cond.notify_all()
+        for watch in remaining:
+            if self._settle(watch):
+                watch.future.set_exception(PollerClosedError("轮询器已关闭"))
+        self._executor.shutdown(wait=False)
+
+    def _schedule(self, watch, due):
+        with self._cond:
+            if self._closed:
+                if self._settle(watch):
+                    watch.future.set_exception(PollerClosedError("轮询器已关闭"))
+                return
+            if watch.settled:
+                return
+            self._seq += 1
+            heapq.heappush(self._heap, (min(due, watch.deadline), self._seq, watch))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="task-poller")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        """调度线程：取出到期的任务交给请求线程"""
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                _, _, watch = heapq.heappop(self._heap)
+            if watch.settled:
+                # 已取消的任务留在堆中的条目
+                continue
+            self._executor.submit(self._poll, watch)
+
+    def _poll(self, watch):
+        """查询一次任务状态，未完成时重新排期"""
+        try:
+            self._poll_once(watch)
+        except Exception as e:
+            if not watch.future.done():
+                self._fail(watch, f"查询结果失败: {str(e)}")
+
+    def _poll_once(self, watch):
+        if watch.settled:
+            return
+        if watch.token is not None and watch.token.cancelled:
+            # 到期：token的回调已经结束了该任务
+            return
+        watch.polls += 1
+        with self._cond:
+            self.poll_count += 1
+        if watch.limiter is not None:
+            watch.limiter.poll.acquire()
+        try:
+            with self.tracer.span("poll", task_id=watch.task_id, attempt=watch.polls) as span:
+                result_resp = watch.visual_service.cv_sync2async_get_result(watch.form)
+                span.set_response(result_resp)
+        except Exception as e:
+            if is_throttled_error(e):
+                self._throttled(watch)
+                return
+            watch.errors += 1
+            if watch.errors >= MAX_QUERY_ERRORS:
+                self._fail(watch, f"查询结果失败: {str(e)}")
+            else:
+                self._reschedule(watch, MIN_INTERVAL * (2 ** watch.errors))
+            return
+
+        if is_throttled(result_resp):
+            self._throttled(watch)
+            return
+        if watch.limiter is not None:
+            watch.limiter.poll.on_success()
+
+        if result_resp.get("code") != 10000:
+            self._fail(watch, f"查询结果失败: {json.dumps(result_resp, ensure_ascii=False)}")
+            return
+
+        watch.errors = 0
+        status = result_resp["data"].get("status", "")
+        now = time.monotonic()
+        if status == "done":
+            elapsed = now - watch.submitted_at
+            # 任务在上次未完成的查询与本次查询之间完成，取两者中点作为估计
+            finished = elapsed
+            if watch.last_pending_at is not None:
+                finished = (watch.last_pending_at - watch.submitted_at + elapsed) / 2
+            if not watch.resumed:
+                self.history.record(watch.req_key, watch.width, watch.height, finished)
+                self._trace_remote(watch, finished, elapsed)
+            if not self._settle(watch):
+                return
+            self.log(f"任务 {watch.task_id} 处理完成（查询{watch.polls}次，用时{elapsed:.1f}秒）")
+            watch.future.set_result(result_resp["data"].get("image_urls") or [])
+            return
+        if status == "failed":
+            self._fail(watch, "任务处理失败")
+            return
+        watch.last_pending_at = now
+        if status == "processing" and watch.processing_at is None:
+            watch.processing_at = now
+
+        if status != watch.status:
+            if status in ["pending", "processing"]:
+                self.log(f"任务 {watch.task_id} 处理中，状态: {status}")
+            else:
+                self.log(f"任务 {watch.task_id} 未知状态: {status}")
+            watch.status = status
+        self._reschedule(watch, self._next_delay(watch, status))
+
+    def _throttled(self, watch):
+        """查询被限流：降低查询速率，稍后重试，不算作失败"""
+        watch.throttled += 1
+        if watch.limiter is not None:
+            watch.limiter.poll.on_throttle()
+        self._reschedule(watch, MIN_INTERVAL * 2)
+
+    def _next_delay(self, watch, status):
+        """根据当前状态和历史耗时计算距下次查询的间隔"""
+        elapsed = time.monotonic() - watch.submitted_at
+        expected = self.history.expected(watch.req_key, watch.width, watch.height)
+        if expected is None:
+            # 还没有历史数据，沿用固定间隔
+            return DEFAULT_INTERVAL
+
+        if status == "pending":
+            # 还在排队，渲染尚未开始，不必频繁查询
+            return min(MAX_INTERVAL, max(PENDING_INTERVAL, expected - elapsed))
+
+        # 依次等到历史耗时的下一个分位点
+        delay = self.history.poll_delay(watch.req_key, watch.width, watch.height, elapsed, MIN_INTERVAL)
+        if delay is None:
+            # 已经超过所有分位点，逐步拉长间隔
+            delay = MIN_INTERVAL * (1.5 ** watch.overdue_polls)
+            watch.overdue_polls += 1
+        return min(MAX_INTERVAL, max(MIN_INTERVAL, delay))
+
+    def _reschedule(self, watch, delay):
+        now = time.monotonic()
+        if watch.token is not None and watch.token.cancelled:
+            return
+        if now >= watch.deadline:
+            self._fail(watch, "任务处理超时", TaskTimeoutError)
+            return
+        self._schedule(watch, now + delay)
+
+    def _trace_remote(self, watch, finished, elapsed, error=None):
+        """记录远端耗时，以及出图后到被查询发现之间的空等时间"""
+        attrs = {"task_id": watch.task_id, "req_key": watch.req_key, "width": watch.width,
+                 "height": watch.height, "polls": watch.polls, "retries": watch.errors + watch.throttled}
+        if watch.processing_at is not None:
+            # 排队时长的上限：第一次看到 processing 之前都算排队
+            attrs["queue"] = round(watch.processing_at - watch.submitted_at, 3)
+        if error:
+            self.tracer.record("remote", elapsed, "error", error=error, **attrs)
+            return
+        if watch.last_pending_at is None:
+            # 第一次查询就已完成：真实耗时只知道上限，空等时间无法估计
+            self.tracer.record("remote", finished, censored=True, **attrs)
+            return
+        self.tracer.record("remote", finished, **attrs)
+        self.tracer.record("poll_slack", elapsed - finished, task_id=watch.task_id, polls=watch.polls)
+
+    def _settle(self, watch):
+        """第一次调用时返回True，之后返回False（结果已由其他线程设置）"""
+        with self._cond:
+            if watch.settled:
+                return False
+            watch.settled = True
+        if watch.on_cancel is not None:
+            # 任务已结束，token上不再保留引用该任务的回调
+            watch.token.remove_callback(watch.on_cancel)
+            watch.on_cancel = None
+        return True
+
+    def _fail(self, watch, message, error_class=TaskPollError):
+        if not self._settle(watch):
+            return
+        if error_class is not TaskCancelledError:
+            # 取消由等待该Future的一方（引擎）写入日志
+            self.log(f"任务 {watch.task_id} {message}")
+        if not watch.resumed:
+            self._trace_remote(watch, None, time.monotonic() - watch.submitted_at, message)
+        watch.future.set_exception(error_class(message))